@@ -39,6 +39,7 @@ class EC2DeprecateImg(EC2ImgUtils):
             deprecation_image_name_match=None,
             force=None,
             image_virt_type=None,
+            journal=None,
             public_only=None,
             replacement_image_id=None,
             replacement_image_name=None,
@@ -62,6 +63,7 @@ class EC2DeprecateImg(EC2ImgUtils):
         self.deprecation_image_name_match = deprecation_image_name_match
         self.force = force
         self.image_virt_type = image_virt_type
+        self.journal = journal
         self.public_only = public_only
         self.replacement_image_id = replacement_image_id
         self.replacement_image_name = replacement_image_name
@@ -291,6 +293,8 @@ class EC2DeprecateImg(EC2ImgUtils):
 
         ec2 = self._connect()
         for image in images:
+            if self._is_complete(image['ImageId'], 'deprecate'):
+                continue
             existing_tags = image.get('Tags')
             tagged = False
             if not self.force and existing_tags:
@@ -338,6 +342,7 @@ class EC2DeprecateImg(EC2ImgUtils):
                     self.deletion_date, '%Y%m%d'
                 )
             )
+            self._record_complete(image['ImageId'], 'deprecate')
 
     # ---------------------------------------------------------------------
     def print_deprecation_info(self):
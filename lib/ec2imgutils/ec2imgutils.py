@@ -18,6 +18,7 @@
 import boto3
 import logging
 
+import ec2imgutils.ec2utils as utils
 from ec2imgutils.ec2imgutilsExceptions import EC2ConnectionException
 
 
@@ -26,6 +27,7 @@ class EC2ImgUtils:
 
     def __init__(self, log_level=logging.INFO, log_callback=None):
 
+        self.journal = None
         self.region = None
         self.session_token = None
 
@@ -42,17 +44,19 @@ class EC2ImgUtils:
             self.log_level = self.log.logger.level  # LoggerAdapter
 
     # ---------------------------------------------------------------------
-    def _connect(self):
-        """Connect to EC2"""
+    def _connect(self, region=None):
+        """Connect to EC2 in the given region, the current region if no
+           region is given"""
 
         ec2 = None
-        if self.region:
+        region = region or self.region
+        if region:
             if self.session_token:
                 ec2 = boto3.client(
                     aws_access_key_id=self.access_key,
                     aws_secret_access_key=self.secret_key,
                     aws_session_token=self.session_token,
-                    region_name=self.region,
+                    region_name=region,
                     service_name='ec2'
                 )
             else:
@@ -60,14 +64,14 @@ class EC2ImgUtils:
                 ec2 = session.client(
                     aws_access_key_id=self.access_key,
                     aws_secret_access_key=self.secret_key,
-                    region_name=self.region,
+                    region_name=region,
                     service_name='ec2'
                 )
         else:
-            self.region = 'UNKNOWN'
+            self.region = region = 'UNKNOWN'
 
         if not ec2:
-            msg = 'Could not connect to region: %s ' % self.region
+            msg = 'Could not connect to region: %s ' % region
             raise EC2ConnectionException(msg)
 
         return ec2
@@ -78,6 +82,112 @@ class EC2ImgUtils:
            uploading"""
         return self._connect().describe_images(Owners=['self'])['Images']
 
+    # ---------------------------------------------------------------------
+    def _get_create_volume_permissions(self, snapshot_ids, max_workers=4):
+        """Return a dictionary of snapshot ID to the create volume
+           permissions of the snapshot, the attributes are read
+           concurrently by up to max_workers threads"""
+        ec2 = self._connect()
+
+        def get_permissions(snapshot_id):
+            return utils.call_with_retry(
+                ec2.describe_snapshot_attribute,
+                SnapshotId=snapshot_id,
+                Attribute='createVolumePermission'
+            )['CreateVolumePermissions']
+
+        return self._read_attributes(
+            get_permissions, snapshot_ids, max_workers
+        )
+
+    # ---------------------------------------------------------------------
+    def _get_launch_permissions(self, image_ids, max_workers=4):
+        """Return a dictionary of image ID to the launch permissions of
+           the image, the attributes are read concurrently by up to
+           max_workers threads"""
+        ec2 = self._connect()
+
+        def get_permissions(image_id):
+            return utils.call_with_retry(
+                ec2.describe_image_attribute,
+                ImageId=image_id,
+                Attribute='launchPermission'
+            )['LaunchPermissions']
+
+        return self._read_attributes(get_permissions, image_ids, max_workers)
+
+    # ---------------------------------------------------------------------
+    def _get_public_image_ids(self, image_ids):
+        """Return the set of the given image IDs that are public, using
+           multi ID describe calls filtered on the public state"""
+        ec2 = self._connect()
+        public_image_ids = set()
+        for image_ids_chunk in utils.chunks(list(image_ids), 100):
+            public_images = utils.call_with_retry(
+                ec2.describe_images,
+                Owners=['self'],
+                Filters=[
+                    {'Name': 'image-id', 'Values': image_ids_chunk},
+                    {'Name': 'is-public', 'Values': ['true']}
+                ]
+            )['Images']
+            public_image_ids.update(
+                image['ImageId'] for image in public_images
+            )
+
+        return public_image_ids
+
+    # ---------------------------------------------------------------------
+    def _get_snapshot_ids_for_image(self, image):
+        """Return the snapshot IDs for a given image from the block device
+           mappings of the image record"""
+        snapshot_ids = []
+        for block_map in image.get('BlockDeviceMappings', []):
+            snapshot_id = block_map.get('Ebs', {}).get('SnapshotId')
+            if snapshot_id:
+                snapshot_ids.append(snapshot_id)
+
+        return snapshot_ids
+
+    # ---------------------------------------------------------------------
+    def _is_complete(self, image_id, action):
+        """Check the run journal, if any, for the given image action
+           completed in the current region by a previous run"""
+        if not self.journal:
+            return False
+        if self.journal.is_complete(self.region, image_id, action):
+            self.log.debug(
+                '\tSkipping %s of %s, completed in a previous run' % (
+                    action, image_id
+                )
+            )
+            return True
+        return False
+
+    # ---------------------------------------------------------------------
+    def _read_attributes(self, read_attribute, resource_ids, max_workers):
+        """Call read_attribute for every given resource ID concurrently and
+           return a dictionary of resource ID to attribute value"""
+        attributes = {}
+        results = utils.run_in_parallel(
+            read_attribute,
+            list(resource_ids),
+            max_workers
+        )
+        for resource_id, attribute, error in results:
+            if error:
+                raise error
+            attributes[resource_id] = attribute
+
+        return attributes
+
+    # ---------------------------------------------------------------------
+    def _record_complete(self, image_id, action):
+        """Record the given image action in the current region as
+           completed in the run journal, if any"""
+        if self.journal:
+            self.journal.record(self.region, image_id, action)
+
     # ---------------------------------------------------------------------
     def _set_access_keys(self):
         """Set the access keys for the connection"""
@@ -32,6 +32,10 @@ class EC2DeprecateImgException(Exception):
     pass
 
 
+class EC2JournalException(Exception):
+    pass
+
+
 class EC2ListImgException(Exception):
     pass
 
@@ -44,5 +48,13 @@ class EC2RemoveImgException(Exception):
     pass
 
 
+class EC2TranscodeException(Exception):
+    pass
+
+
+class EC2TransferException(Exception):
+    pass
+
+
 class EC2UploadImgException(Exception):
     pass
@@ -0,0 +1,170 @@
+# Copyright 2026 SUSE LLC
+#
+# This file is part of ec2imgutils
+#
+# ec2imgutils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ec2imgutils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ec2imgutils. If not, see <http://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from ec2imgutils.ec2imgutilsExceptions import EC2JournalException
+
+
+class EC2RunJournal:
+    """Record the completed (region, image, action) work items of a run in
+       a local file such that an interrupted run can be resumed"""
+
+    def __init__(
+            self,
+            run_name,
+            arguments,
+            run_id='default',
+            resume=False,
+            journal_dir=None,
+            log_callback=None,
+            carry_over_actions=()
+    ):
+        if log_callback:
+            self.log = log_callback
+        else:
+            self.log = logging.getLogger('ec2imgutils')
+
+        if not journal_dir:
+            cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+                '~', '.cache'
+            )
+            journal_dir = os.path.join(cache_dir, 'ec2imgutils')
+        journal_dir = os.path.expanduser(journal_dir)
+
+        # The journal is keyed by the run id and the arguments of the run,
+        # resuming a run with different arguments starts a new journal
+        arguments_key = hashlib.sha256(
+            json.dumps(arguments, sort_keys=True).encode('utf-8')
+        ).hexdigest()[:16]
+        self.journal_file = os.path.join(
+            journal_dir,
+            '%s-%s-%s.journal' % (run_name, run_id, arguments_key)
+        )
+        self.completed = set()
+        self._lock = threading.Lock()
+
+        try:
+            os.makedirs(journal_dir, exist_ok=True)
+            if resume and os.path.isfile(self.journal_file):
+                self._load()
+                self.log.info(
+                    'Resuming run, %d completed actions found in %s' % (
+                        len(self.completed), self.journal_file
+                    )
+                )
+            else:
+                previous_file = self._move_previous_journal()
+                open(self.journal_file, 'w').close()
+                if previous_file and carry_over_actions:
+                    self._carry_over(previous_file, carry_over_actions)
+        except (OSError, ValueError) as e:
+            msg = 'Unable to use run journal "%s": %s' % (
+                self.journal_file, e
+            )
+            raise EC2JournalException(msg) from e
+
+    # ---------------------------------------------------------------------
+    def _read_entries(self, journal_file):
+        """Yield the (region, image, action) work items of the given
+           journal file"""
+        with open(journal_file) as journal:
+            for line in journal:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A partially written last line from an interrupted run
+                    continue
+                yield entry['region'], entry['image'], entry['action']
+
+    # ---------------------------------------------------------------------
+    def _load(self):
+        """Load the completed work items from the journal file"""
+        self.completed.update(self._read_entries(self.journal_file))
+
+    # ---------------------------------------------------------------------
+    def _carry_over(self, previous_file, actions):
+        """Record the work items with the given actions of the moved aside
+           journal in the new journal, such that a new run picks up work
+           the interrupted run started but could not finish"""
+        for region, image_id, action in self._read_entries(previous_file):
+            if action in actions:
+                self.record(region, image_id, action)
+
+    # ---------------------------------------------------------------------
+    def _move_previous_journal(self):
+        """A completed run removes its journal, an existing journal with
+           recorded work belongs to an interrupted run with the same
+           arguments. Move it aside instead of discarding its record, the
+           moved journal is kept for diagnostics and cannot be resumed.
+           Return the path of the moved journal, None if there was none."""
+        if not (
+                os.path.isfile(self.journal_file) and
+                os.path.getsize(self.journal_file)
+        ):
+            return None
+        previous_file = '%s.%s' % (
+            self.journal_file, time.strftime('%Y%m%d%H%M%S')
+        )
+        os.replace(self.journal_file, previous_file)
+        msg = 'Found the journal of an interrupted run, moved it to %s for '
+        msg += 'diagnostics, it cannot be resumed. Use --resume to continue '
+        msg += 'an interrupted run'
+        self.log.warning(msg % previous_file)
+        return previous_file
+
+    # ---------------------------------------------------------------------
+    def finish(self):
+        """The run completed, the journal is no longer needed"""
+        with self._lock:
+            if os.path.isfile(self.journal_file):
+                os.remove(self.journal_file)
+
+    # ---------------------------------------------------------------------
+    def get_images(self, region, action):
+        """Return the sorted IDs recorded for the given action in the
+           given region"""
+        with self._lock:
+            return sorted(
+                image_id for entry_region, image_id, entry_action
+                in self.completed
+                if entry_region == region and entry_action == action
+            )
+
+    # ---------------------------------------------------------------------
+    def is_complete(self, region, image_id=None, action='region'):
+        """Return True if the given work item completed in a previous run"""
+        with self._lock:
+            return (region, image_id, action) in self.completed
+
+    # ---------------------------------------------------------------------
+    def record(self, region, image_id=None, action='region'):
+        """Record the given work item as completed"""
+        entry = {'region': region, 'image': image_id, 'action': action}
+        with self._lock:
+            self.completed.add((region, image_id, action))
+            with open(self.journal_file, 'a') as journal:
+                journal.write(json.dumps(entry) + '\n')
+                journal.flush()
+                os.fsync(journal.fileno())
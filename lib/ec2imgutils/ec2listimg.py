@@ -15,6 +15,7 @@
 # You should have received a copy of the GNU General Public License
 # along with ec2pub
 
+import json
 import logging
 import pprint
 
@@ -35,7 +36,9 @@ class EC2ListImage(EC2ImgUtils):
             image_name_fragment=None,
             image_name_match=None,
             indent=0,
+            max_workers=8,
             secret_key=None,
+            selectors=None,
             log_level=logging.INFO,
             log_callback=None,
             verbose=0
@@ -52,14 +55,23 @@ class EC2ListImage(EC2ImgUtils):
         self.image_name = image_name
         self.image_name_fragment = image_name_fragment
         self.image_name_match = image_name_match
+        self.max_workers = max(1, max_workers)
         self.secret_key = secret_key
+        self.selectors = selectors
         self.verbose = verbose
 
     # ---------------------------------------------------------------------
-    def list_images(self):
-        """List images that meet the criteria"""
-        owned_images = self._get_owned_images()
-        if self.image_id:
+    def _filter_images(self, owned_images):
+        """Return the given images that meet the criteria"""
+        if self.selectors:
+            try:
+                return utils.find_images_by_selectors(
+                    owned_images, self.selectors, self.log
+                )
+            except Exception as e:
+                msg = 'Unable to evaluate image selectors: %s' % e
+                raise EC2ListImgException(msg)
+        elif self.image_id:
             return utils.find_images_by_id(
                 owned_images, self.image_id
             )
@@ -83,6 +95,166 @@ class EC2ListImage(EC2ImgUtils):
         else:
             return owned_images
 
+    # ---------------------------------------------------------------------
+    def _has_criteria(self):
+        """Return True if images are filtered by any criteria"""
+        return bool(
+            self.selectors or
+            self.image_id or
+            self.image_name or
+            self.image_name_fragment or
+            self.image_name_match
+        )
+
+    # ---------------------------------------------------------------------
+    def get_permission_audit(self):
+        """Yield a record of the launch permissions of every owned image
+           that meets the criteria and the create volume permissions of its
+           snapshots. The images are read page by page, the attributes of
+           a page are read concurrently by up to max_workers threads and
+           the permissions of snapshots used by several images are read
+           once."""
+        ec2 = self._connect()
+        snapshot_permissions = {}
+
+        images = ec2.get_paginator('describe_images')
+        for page in images.paginate(Owners=['self']):
+            page_images = self._filter_images(page['Images'])
+            launch_permissions = self._get_launch_permissions(
+                [image['ImageId'] for image in page_images],
+                self.max_workers
+            )
+            snapshot_ids = set()
+            for image in page_images:
+                snapshot_ids.update(self._get_snapshot_ids_for_image(image))
+            snapshot_permissions.update(self._get_create_volume_permissions(
+                snapshot_ids - set(snapshot_permissions),
+                self.max_workers
+            ))
+
+            for image in page_images:
+                image_permissions = launch_permissions[image['ImageId']]
+                snapshots = []
+                for snapshot_id in self._get_snapshot_ids_for_image(image):
+                    permissions = snapshot_permissions[snapshot_id]
+                    snapshots.append({
+                        'snapshot_id': snapshot_id,
+                        'public': {'Group': 'all'} in permissions,
+                        'create_volume_permissions': permissions
+                    })
+                yield {
+                    'region': self.region,
+                    'image_id': image['ImageId'],
+                    'name': image.get('Name'),
+                    'public': {'Group': 'all'} in image_permissions,
+                    'launch_permissions': image_permissions,
+                    'snapshots': snapshots
+                }
+
+    # ---------------------------------------------------------------------
+    def _get_snapshot_sizes(self, ec2, snapshot_ids):
+        """Return a dictionary of the given owned snapshot IDs to their size
+           in GiB, snapshots that do not exist are left out"""
+        sizes = {}
+        snapshots = ec2.get_paginator('describe_snapshots')
+        for snapshot_ids_chunk in utils.chunks(sorted(snapshot_ids), 200):
+            for page in snapshots.paginate(
+                    OwnerIds=['self'],
+                    Filters=[{
+                        'Name': 'snapshot-id',
+                        'Values': snapshot_ids_chunk
+                    }]
+            ):
+                for snapshot in page['Snapshots']:
+                    sizes[snapshot['SnapshotId']] = snapshot.get(
+                        'VolumeSize', 0
+                    )
+        return sizes
+
+    # ---------------------------------------------------------------------
+    def get_image_storage(self):
+        """Yield a record of the family, the number of snapshots and the
+           snapshot size in GiB of every owned image that meets the
+           criteria. The images are read page by page and the sizes of
+           the snapshots of a page are read with one filtered request,
+           only one page and the set of snapshot IDs counted in the
+           region are kept in memory. A snapshot used by several images
+           counts for the first one."""
+        ec2 = self._connect()
+        counted_snapshot_ids = set()
+        images = ec2.get_paginator('describe_images')
+        for page in images.paginate(Owners=['self']):
+            page_images = self._filter_images(page['Images'])
+            snapshot_sizes = self._get_snapshot_sizes(ec2, set(
+                snapshot_id
+                for image in page_images
+                for snapshot_id in self._get_snapshot_ids_for_image(image)
+            ) - counted_snapshot_ids)
+            counted_snapshot_ids.update(snapshot_sizes)
+            for image in page_images:
+                snapshots = 0
+                size = 0
+                for snapshot_id in self._get_snapshot_ids_for_image(image):
+                    if snapshot_id in snapshot_sizes:
+                        snapshots += 1
+                        size += snapshot_sizes.pop(snapshot_id)
+                yield {
+                    'region': self.region,
+                    'image_id': image['ImageId'],
+                    'name': image.get('Name'),
+                    'family': utils.get_image_family(image.get('Name')),
+                    'snapshots': snapshots,
+                    'size': size
+                }
+
+    # ---------------------------------------------------------------------
+    def get_storage_report(self, image_callback=None):
+        """Return a dictionary of image family to a dictionary with the
+           number of images, the number of snapshots and the snapshot size
+           in GiB of the family. The image records are aggregated per
+           family as they are read, image_callback is called with every
+           record. Without criteria the owned snapshots not used by any
+           image are reported as unreferenced family, their totals are
+           the difference of a streamed pass over all owned snapshots."""
+        report = {}
+
+        def get_entry(family):
+            return report.setdefault(
+                family, {'images': 0, 'snapshots': 0, 'size': 0}
+            )
+
+        referenced = {'snapshots': 0, 'size': 0}
+        for record in self.get_image_storage():
+            if image_callback:
+                image_callback(record)
+            entry = get_entry(record['family'])
+            entry['images'] += 1
+            for key in referenced:
+                entry[key] += record[key]
+                referenced[key] += record[key]
+
+        if self._has_criteria():
+            return report
+
+        owned = {'snapshots': 0, 'size': 0}
+        ec2 = self._connect()
+        snapshots = ec2.get_paginator('describe_snapshots')
+        for page in snapshots.paginate(OwnerIds=['self']):
+            for snapshot in page['Snapshots']:
+                owned['snapshots'] += 1
+                owned['size'] += snapshot.get('VolumeSize', 0)
+        if owned['snapshots'] > referenced['snapshots']:
+            entry = get_entry('(unreferenced)')
+            entry['snapshots'] = owned['snapshots'] - referenced['snapshots']
+            entry['size'] = max(0, owned['size'] - referenced['size'])
+
+        return report
+
+    # ---------------------------------------------------------------------
+    def list_images(self):
+        """List images that meet the criteria"""
+        return self._filter_images(self._get_owned_images())
+
     # ---------------------------------------------------------------------
     def output_image_list(self):
         """Output the images that match in the account"""
@@ -91,11 +263,15 @@ class EC2ListImage(EC2ImgUtils):
 
         for image in images:
             output = ' ' * self.indent
+            selector = ''
+            if image.get('Selector'):
+                selector = '\t(%s)' % image['Selector']
             if self.verbose == 0:
-                self.log.info(output + image.get('Name'))
+                self.log.info(output + image.get('Name') + selector)
             elif self.verbose == 1:
                 self.log.info(
-                    output + image.get('Name') + '\t' + image.get('ImageId')
+                    output + image.get('Name') + '\t' + image.get('ImageId') +
+                    selector
                 )
             else:
                 pp = pprint.PrettyPrinter(indent=(4 + self.indent))
@@ -103,6 +279,65 @@ class EC2ListImage(EC2ImgUtils):
                 if len(images) > 1 and image != images[-1]:
                     self.log.info('')
 
+    # ---------------------------------------------------------------------
+    def output_permission_audit(
+            self, audit_file, extra_fields=None, lock=None
+    ):
+        """Write the permission audit records as JSON lines to the given
+           file object, extra_fields are added to every record. The given
+           lock serializes the records of audits sharing the file."""
+        for record in self.get_permission_audit():
+            if extra_fields:
+                record.update(extra_fields)
+            line = json.dumps(record) + '\n'
+            if lock:
+                with lock:
+                    audit_file.write(line)
+                    audit_file.flush()
+            else:
+                audit_file.write(line)
+
+    # ---------------------------------------------------------------------
+    def output_storage_report(self):
+        """Output the image count and snapshot storage per image family,
+           with verbose output the storage of every image is output as it
+           is read"""
+        output = ' ' * self.indent
+
+        def output_image(record):
+            self.log.info('%s%s\t%s\t%d snapshots\t%d GiB' % (
+                output,
+                record['image_id'],
+                record['name'],
+                record['snapshots'],
+                record['size']
+            ))
+
+        report = self.get_storage_report(
+            output_image if self.verbose else None
+        )
+        line = '%s%-60s\t%8s\t%9s\t%8s'
+        self.log.info(line % (output, 'Family', 'Images', 'Snapshots', 'GiB'))
+        totals = {'images': 0, 'snapshots': 0, 'size': 0}
+        for family in sorted(report):
+            entry = report[family]
+            self.log.info(line % (
+                output,
+                family,
+                entry['images'],
+                entry['snapshots'],
+                entry['size']
+            ))
+            for key in totals:
+                totals[key] += entry[key]
+        self.log.info(line % (
+            output,
+            'Total',
+            totals['images'],
+            totals['snapshots'],
+            totals['size']
+        ))
+
     # ---------------------------------------------------------------------
     def set_indent(self, indent):
         """Set the indent level for the output"""
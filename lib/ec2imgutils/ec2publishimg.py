@@ -16,6 +16,9 @@
 # along with ec2publishimg. If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 
 import ec2imgutils.ec2utils as utils
 from ec2imgutils.ec2imgutils import EC2ImgUtils
@@ -34,7 +37,10 @@ class EC2PublishImage(EC2ImgUtils):
             image_name=None,
             image_name_fragment=None,
             image_name_match=None,
+            journal=None,
+            max_workers=4,
             secret_key=None,
+            selectors=None,
             visibility='all',
             log_level=logging.INFO,
             log_callback=None
@@ -50,7 +56,10 @@ class EC2PublishImage(EC2ImgUtils):
         self.image_name = image_name
         self.image_name_fragment = image_name_fragment
         self.image_name_match = image_name_match
+        self.journal = journal
+        self.max_workers = max(1, max_workers)
         self.secret_key = secret_key
+        self.selectors = selectors
         self.visibility = visibility
 
         if self.visibility == 'all':
@@ -60,17 +69,60 @@ class EC2PublishImage(EC2ImgUtils):
         else:
             self.publish_msg = '\tShared: %s\t\t%s\t with: %s'
 
+        # Poll delay and overall timeout for pending images, in seconds
+        self.wait_min_delay = 5
+        self.wait_max_delay = 30
+        self.wait_timeout = 600
+
         if allow_copy == 'image':
             self.allow_copy = self.visibility
         else:
             self.allow_copy = allow_copy
 
+        # Requested permissions, changes are sent in chunks of at most
+        # permission_chunk_size permissions
+        self.permission_chunk_size = 100
+        self.launch_permissions = self._get_requested_permissions(
+            self.visibility
+        )
+        self.copy_permissions = [
+            permission for permission in
+            self._get_requested_permissions(self.allow_copy)
+            if 'OrganizationArn' not in permission and
+            'OrganizationalUnitArn' not in permission
+        ]
+        if (
+            self.allow_copy not in ('all', 'none') and
+            not self.copy_permissions
+        ):
+            self.allow_copy = 'none'
+            self.log.info(
+                'Snapshots cannot be shared with organizations, '
+                'snapshot permissions will not be changed'
+            )
+
+        # Current permissions of the images and snapshots in the region
+        self._launch_permissions = {}
+        self._prefetched_image_ids = set()
+        self._public_image_ids = set()
+        self._snapshot_permissions = {}
+
     # --------------------------------------------------------------------
     def _get_images(self):
         """Return a list of images that match the filter criteria"""
         self._connect()
         owned_images = self._get_owned_images()
-        if self.image_id:
+        if self.selectors:
+            try:
+                return utils.find_images_by_selectors(
+                    owned_images,
+                    self.selectors,
+                    self.log
+                )
+            except Exception as e:
+                msg = 'Unable to evaluate image selectors: %s' % e
+                raise EC2PublishImgException(msg)
+        elif self.image_id:
             return utils.find_images_by_id(owned_images, self.image_id)
         elif self.image_name:
             return utils.find_images_by_name(
@@ -97,51 +149,172 @@ class EC2PublishImage(EC2ImgUtils):
                 raise EC2PublishImgException(msg)
 
     # --------------------------------------------------------------------
-    def _get_snapshot_ids_for_image(self, image):
-        """Return the snapshot ID for a given image"""
-        image_data = self._connect().describe_images(
-            ImageIds=[image['ImageId']])['Images']
-        block_device_maps = image_data[0]['BlockDeviceMappings']
-        snapshot_ids = []
-        for block_map in block_device_maps:
-            snapshot_ids.append(block_map['Ebs']['SnapshotId'])
+    def _get_requested_permissions(self, share_with):
+        """Return the list of permissions for the given share setting"""
+        if share_with == 'all':
+            return [{'Group': 'all'}]
+        if share_with == 'none':
+            return []
+        if not utils.validate_share_list(share_with):
+            msg = 'Expecting "all", "none", or comma separated list of 12 '
+            msg += 'digit AWS account numbers or organization ARNs, got "%s"'
+            raise EC2PublishImgException(msg % share_with)
 
-        return snapshot_ids
+        return utils.get_share_permissions(share_with)
 
     # --------------------------------------------------------------------
-    def _share_snapshot(self, image):
-        """Provide permission to copy the underlying snapshot"""
-
-        snapshot_ids = self._get_snapshot_ids_for_image(image)
-        for snapshot_id in snapshot_ids:
-            if self.allow_copy == 'all':
-                self._connect().modify_snapshot_attribute(
-                    SnapshotId=snapshot_id,
-                    Attribute='createVolumePermission',
-                    OperationType='add',
-                    GroupNames=['all']
+    def _set_block_device_mappings(self, images):
+        """Fill in the block device mappings of image records that do not
+           carry them, using multi ID describe calls"""
+        incomplete_images = [
+            image for image in images if 'BlockDeviceMappings' not in image
+        ]
+        if not incomplete_images:
+            return
+
+        block_device_maps = {}
+        image_ids = [image['ImageId'] for image in incomplete_images]
+        for image_ids_chunk in utils.chunks(image_ids, 100):
+            described_images = self._connect().describe_images(
+                ImageIds=image_ids_chunk
+            )['Images']
+            for described_image in described_images:
+                block_device_maps[described_image['ImageId']] = (
+                    described_image.get('BlockDeviceMappings', [])
                 )
-            elif self.allow_copy != 'none':
-                self._connect().modify_snapshot_attribute(
-                    SnapshotId=snapshot_id,
-                    Attribute='createVolumePermission',
-                    OperationType='add',
-                    UserIds=self.allow_copy.split(',')
+        for image in incomplete_images:
+            image['BlockDeviceMappings'] = block_device_maps.get(
+                image['ImageId'], []
+            )
+
+    # --------------------------------------------------------------------
+    def _get_snapshot_permissions(self, snapshot_id):
+        """Return the current create volume permissions of the given
+           snapshot, from the prefetched permissions if available"""
+        if snapshot_id not in self._snapshot_permissions:
+            self._snapshot_permissions.update(
+                self._get_create_volume_permissions([snapshot_id])
+            )
+        return self._snapshot_permissions[snapshot_id]
+
+    # --------------------------------------------------------------------
+    def _prefetch_permissions(self, images):
+        """Read the current launch permissions of the given images and the
+           create volume permissions of their snapshots in bulk, only the
+           permissions that are compared to the requested state are read"""
+        image_ids = [image['ImageId'] for image in images]
+        if self.visibility == 'all':
+            self._public_image_ids.update(
+                self._get_public_image_ids(image_ids)
+            )
+        else:
+            self._launch_permissions.update(
+                self._get_launch_permissions(image_ids, self.max_workers)
+            )
+        if self.visibility == 'none' or self.allow_copy != 'none':
+            snapshot_ids = []
+            for image in images:
+                snapshot_ids += self._get_snapshot_ids_for_image(image)
+            self._snapshot_permissions.update(
+                self._get_create_volume_permissions(
+                    snapshot_ids, self.max_workers
                 )
+            )
+        self._prefetched_image_ids.update(image_ids)
+
+    # --------------------------------------------------------------------
+    def _modify_create_volume_permissions(
+            self,
+            ec2,
+            snapshot_id,
+            operation,
+            permissions
+    ):
+        """Add or remove the given create volume permissions of the given
+           snapshot"""
+        utils.call_with_retry(
+            ec2.modify_snapshot_attribute,
+            SnapshotId=snapshot_id,
+            CreateVolumePermission={operation: permissions}
+        )
+
+    # --------------------------------------------------------------------
+    def _modify_launch_permissions(
+            self,
+            ec2,
+            image_id,
+            operation,
+            permissions
+    ):
+        """Add or remove the given launch permissions of the given image"""
+        utils.call_with_retry(
+            ec2.modify_image_attribute,
+            ImageId=image_id,
+            LaunchPermission={operation: permissions}
+        )
+
+    # --------------------------------------------------------------------
+    def _submit_permission_changes(
+            self,
+            executor,
+            modify_permissions,
+            ec2,
+            resource_id,
+            operation,
+            permissions
+    ):
+        """Submit the given permission change to the executor in chunks of
+           at most permission_chunk_size permissions, return the futures"""
+        return [
+            executor.submit(
+                modify_permissions, ec2, resource_id, operation, chunk
+            )
+            for chunk in utils.chunks(permissions, self.permission_chunk_size)
+        ]
+
+    # --------------------------------------------------------------------
+    def _submit_snapshot_changes(self, ec2, snapshot_id, executor):
+        """Submit the changes to the create volume permissions of the given
+           snapshot to the executor, return the futures"""
+        snapshot_permissions = self._get_snapshot_permissions(snapshot_id)
+        if self.visibility == 'none':
+            # Remove all permissions to copy the snapshot
+            permissions = snapshot_permissions
+            operation = 'Remove'
+        else:
+            permissions = [
+                permission for permission in self.copy_permissions
+                if permission not in snapshot_permissions
+            ]
+            operation = 'Add'
+            if not permissions:
+                self.log.debug(
+                    '\tSnapshot %s is already shared' % snapshot_id
+                )
+
+        return self._submit_permission_changes(
+            executor,
+            self._modify_create_volume_permissions,
+            ec2,
+            snapshot_id,
+            operation,
+            permissions
+        )
 
     # --------------------------------------------------------------------
     def _print_image_info(self, image, log_callback):
         """Print a message about the image that would be modified"""
         if self.visibility == 'all' or self.visibility == 'none':
-            log_callback(
-                self.publish_msg % (image['ImageId'], image['Name'])
-            )
+            msg = self.publish_msg % (image['ImageId'], image['Name'])
         else:
-            log_callback(self.publish_msg % (
+            msg = self.publish_msg % (
                         image['ImageId'],
                         image['Name'],
                         self.visibility
-            ))
+            )
+        if image.get('Selector'):
+            msg += '\t(%s)' % image['Selector']
+        log_callback(msg)
 
     # --------------------------------------------------------------------
     def print_publish_info(self):
@@ -150,101 +323,176 @@ class EC2PublishImage(EC2ImgUtils):
         for image in images:
             self._print_image_info(image, log_callback=self.log.info)
 
+    # --------------------------------------------------------------------
+    def _publish_image(self, ec2, image, executor):
+        """Submit the changes to the launch permission of the given image
+           and the permissions of its snapshots to the executor. Only
+           permissions that differ from the current state are changed.
+           Return the futures of the permission changes."""
+        image_id = image['ImageId']
+        if image_id not in self._prefetched_image_ids:
+            # Images that became available while waiting
+            self._prefetch_permissions([image])
+
+        if self.visibility == 'all':
+            if image_id in self._public_image_ids:
+                launch_attributes = [{'Group': 'all'}]
+            else:
+                launch_attributes = []
+        else:
+            launch_attributes = self._launch_permissions[image_id]
+
+        if self.visibility == 'none':
+            if not launch_attributes:
+                msg = '\tImage with ID: %s  ' % image_id
+                msg += 'is already private, nothing to do'
+                self.log.info(msg)
+                return []
+            permissions = launch_attributes
+            operation = 'Remove'
+        else:
+            permissions = [
+                permission for permission in self.launch_permissions
+                if permission not in launch_attributes
+            ]
+            operation = 'Add'
+            if not permissions:
+                self.log.debug('\tImage %s is already shared' % image_id)
+
+        futures = self._submit_permission_changes(
+            executor,
+            self._modify_launch_permissions,
+            ec2,
+            image_id,
+            operation,
+            permissions
+        )
+        if self.visibility == 'none' or self.allow_copy != 'none':
+            for snapshot_id in self._get_snapshot_ids_for_image(image):
+                futures += self._submit_snapshot_changes(
+                    ec2, snapshot_id, executor
+                )
+
+        return futures
+
+    # --------------------------------------------------------------------
+    def _wait_for_available_images(self, images):
+        """Watch all given pending images with a single multi ID describe
+           call per poll and yield every image as soon as it is available.
+           The poll delay starts short, backs off while no image changes
+           state and resets when one does."""
+        pending_images = dict((image['ImageId'], image) for image in images)
+        delay = self.wait_min_delay
+        deadline = time.time() + self.wait_timeout
+        while pending_images and time.time() < deadline:
+            time.sleep(min(delay, max(0, deadline - time.time())))
+            described_images = self._connect().describe_images(
+                Owners=['self'],
+                Filters=[
+                    {
+                        'Name': 'image-id',
+                        'Values': list(pending_images)
+                    }
+                ]
+            )['Images']
+            described_states = dict(
+                (image['ImageId'], image['State'])
+                for image in described_images
+            )
+            state_changed = False
+            for image_id in list(pending_images):
+                state = described_states.get(image_id, 'deregistered')
+                if state == 'pending':
+                    continue
+                image = pending_images.pop(image_id)
+                state_changed = True
+                if state == 'available':
+                    self.log.info("Image %s is now 'available'.", image_id)
+                    image['State'] = state
+                    yield image
+                else:
+                    self.log.info("Skipping image %s as the state is %s"
+                                  " and is not able to be published.",
+                                  image_id, state)
+            if state_changed:
+                delay = self.wait_min_delay
+            else:
+                delay = min(2 * delay, self.wait_max_delay)
+
+        for image_id in pending_images:
+            self.log.info("Skipping image %s as it failed to become "
+                          "'available'", image_id)
+
     # --------------------------------------------------------------------
     def publish_images(self):
-        """Publish the matching image(s)"""
+        """Publish the matching image(s). Available images are published
+           immediately, pending images as soon as they become available.
+           The permission changes of the images and their snapshots are
+           executed concurrently by up to max_workers threads."""
         images = self._get_images()
+        self._set_block_device_mappings(images)
+        ec2 = self._connect()
 
-        for image in images:
-            skip_state = ['invalid', 'deregistered', 'transient', 'fail']
-            if image['State'] == 'pending':
-                waiter = self._connect().get_waiter('image_available')
-                self.log.info("Current state of image %s is %s. Waiting up "
-                              "to 10 minutes for it to become 'available'.",
-                              image['ImageId'], image['State'])
-                wait_status = 1
-                try:
-                    wait_status = waiter.wait(
-                        ImageIds=[image['ImageId']],
-                        Filters=[
-                            {
-                                'Name': 'state',
-                                'Values': ['available']
-                            }
-                        ],
-                        WaiterConfig={
-                            'Delay': 15,
-                            'MaxAttempts': 40
-                        }
-                    )
-                except Exception:
-                    wait_status = 1
+        self._launch_permissions = {}
+        self._prefetched_image_ids = set()
+        self._public_image_ids = set()
+        self._snapshot_permissions = {}
+        self._prefetch_permissions([
+            image for image in images
+            if image['State'] == 'available' and
+            not self._is_complete(image['ImageId'], 'publish')
+        ])
 
-                if wait_status:
-                    self.log.info("Skipping image %s as it failed to become"
-                                  "'available'", image['ImageId'])
+        image_futures = []
+        pending_images = []
+        skip_state = ['invalid', 'deregistered', 'transient', 'fail']
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for image in images:
+                if self._is_complete(image['ImageId'], 'publish'):
                     continue
-                else:
-                    self.log.info("Image %s is now 'available'.",
-                                  image['ImageId'])
-
-            elif image['State'] in skip_state:
-                self.log.info("Skipping image %s as the state is %s"
-                              " and is not able to be published.",
-                              image['ImageId'], image['State'])
-                continue
-
-            if self.visibility == 'all':
-                self._connect().modify_image_attribute(
-                    ImageId=image['ImageId'],
-                    Attribute='launchPermission',
-                    OperationType='add',
-                    UserGroups=['all']
-                )
-                if self.allow_copy != 'none':
-                    self._share_snapshot(image)
-            elif self.visibility == 'none':
-                launch_attributes = self._connect().describe_image_attribute(
-                    ImageId=image['ImageId'],
-                    Attribute='launchPermission'
-                )['LaunchPermissions']
-                launch_permission = {
-                    'Remove': launch_attributes
-                }
-                if not launch_attributes:
-                    msg = '\tImage with ID: %s  ' % image['ImageId']
-                    msg += 'is already private, nothing to do'
-                    self.log.info(msg)
+                if image['State'] == 'pending':
+                    self.log.info("Current state of image %s is %s. Waiting "
+                                  "up to %d minutes for it to become "
+                                  "'available'.",
+                                  image['ImageId'], image['State'],
+                                  self.wait_timeout // 60)
+                    pending_images.append(image)
                     continue
-                self._connect().modify_image_attribute(
-                    ImageId=image['ImageId'],
-                    LaunchPermission=launch_permission
-                )
-                snapshot_ids = self._get_snapshot_ids_for_image(image)
-                for snapshot_id in snapshot_ids:
-                    snapshot_attrs = (
-                        self._connect().describe_snapshot_attribute(
-                            SnapshotId=snapshot_id,
-                            Attribute='createVolumePermission'
-                        )['CreateVolumePermissions']
-                    )
-                    if not snapshot_attrs:
-                        continue
-                    snapshot_permission = {
-                        'Remove': snapshot_attrs
-                    }
-                    self._connect().modify_snapshot_attribute(
-                        SnapshotId=snapshot_id,
-                        CreateVolumePermission=snapshot_permission
+                elif image['State'] in skip_state:
+                    self.log.info("Skipping image %s as the state is %s"
+                                  " and is not able to be published.",
+                                  image['ImageId'], image['State'])
+                    continue
+
+                image_futures.append((image, executor.submit(
+                    self._publish_image, ec2, image, executor
+                )))
+
+            if pending_images:
+                for image in self._wait_for_available_images(pending_images):
+                    image_futures.append((image, executor.submit(
+                        self._publish_image, ec2, image, executor
+                    )))
+
+            # Collect the outcome in the order of the images
+            failed_images = []
+            for image, image_future in image_futures:
+                try:
+                    for permission_future in image_future.result():
+                        permission_future.result()
+                except Exception as e:
+                    self.log.error(
+                        '\tFailed to publish: %s\t\t%s\t%s' % (
+                            image['ImageId'], image.get('Name'), e
+                        )
                     )
-            else:
-                self._connect().modify_image_attribute(
-                    ImageId=image['ImageId'],
-                    Attribute='launchPermission',
-                    OperationType='add',
-                    UserIds=self.visibility.split(',')
-                )
-                if self.allow_copy:
-                    self._share_snapshot(image)
+                    failed_images.append(image['ImageId'])
+                    continue
+                self._print_image_info(image, log_callback=self.log.debug)
+                self._record_complete(image['ImageId'], 'publish')
 
-            self._print_image_info(image, log_callback=self.log.debug)
+        if failed_images:
+            msg = 'Failed to publish %d image(s) in region %s: %s' % (
+                len(failed_images), self.region, ', '.join(failed_images)
+            )
+            raise EC2PublishImgException(msg)
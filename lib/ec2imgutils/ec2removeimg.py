@@ -15,9 +15,12 @@
 # You should have received a copy of the GNU General Public License
 # along with ec2publishimg. If not, see <http://www.gnu.org/licenses/>.
 
+import datetime
 import logging
-import sys
-import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
 
 import ec2imgutils.ec2utils as utils
 from ec2imgutils.ec2imgutils import EC2ImgUtils
@@ -35,10 +38,14 @@ class EC2RemoveImage(EC2ImgUtils):
             image_name=None,
             image_name_fragment=None,
             image_name_match=None,
+            journal=None,
             keep_snap=False,
             confirm=None,
+            max_workers=4,
             remove_all=False,
+            remove_expired=False,
             secret_key=None,
+            selectors=None,
             log_level=logging.INFO,
             log_callback=None
     ):
@@ -53,10 +60,18 @@ class EC2RemoveImage(EC2ImgUtils):
         self.image_name = image_name
         self.image_name_fragment = image_name_fragment
         self.image_name_match = image_name_match
+        self.journal = journal
         self.keep_snap = keep_snap
         self.confirm = confirm
+        self.max_workers = max(1, max_workers)
         self.remove_all = remove_all
+        self.remove_expired = remove_expired
         self.secret_key = secret_key
+        self.selectors = selectors
+
+        # Attempts to delete a snapshot that is still in use by the image
+        # being deregistered, with exponential backoff
+        self.snapshot_delete_retries = 8
 
     # ---------------------------------------------------------------------
     def _check_images_boundary_condition(self, images):
@@ -69,7 +84,23 @@ class EC2RemoveImage(EC2ImgUtils):
                 'No images to remove found in region: {}'.format(self.region)
             )
 
-        if len(images) > 1 and not self.remove_all:
+        if self.remove_all or self.remove_expired:
+            return True
+
+        if self.selectors:
+            # Every selector may match one image
+            selected = [image['Selector'] for image in images]
+            ambiguous = sorted(set(
+                selector for selector in selected
+                if selected.count(selector) > 1
+            ))
+            if ambiguous:
+                msg = 'Found multiple images to remove for selector(s) '
+                msg += '%s, but "all" is not set. ' % ', '.join(ambiguous)
+                msg += 'Cannot disambiguate images to remove'
+                self.log.info(msg)
+                return False
+        elif len(images) > 1:
             msg = 'Found multiple images to remove, but "all" is '
             msg += 'not set. Cannot disambiguate images to remove'
             self.log.info(msg)
@@ -81,7 +112,23 @@ class EC2RemoveImage(EC2ImgUtils):
     def _get_images_to_remove(self):
         """Find the images to remove"""
         owned_images = self._get_owned_images()
-        if self.image_id:
+        if self.remove_expired:
+            return utils.find_images_by_removal_date(
+                owned_images,
+                datetime.datetime.now(),
+                self.log
+            )
+        elif self.selectors:
+            try:
+                return utils.find_images_by_selectors(
+                    owned_images,
+                    self.selectors,
+                    self.log
+                )
+            except Exception as e:
+                msg = 'Unable to evaluate image selectors: %s' % e
+                raise EC2RemoveImgException(msg)
+        elif self.image_id:
             return utils.find_images_by_id(owned_images, self.image_id)
         elif self.image_name:
             return utils.find_images_by_name(
@@ -111,6 +158,21 @@ class EC2RemoveImage(EC2ImgUtils):
             msg += 'this point.'
             raise EC2RemoveImgException(msg)
 
+    # ---------------------------------------------------------------------
+    def _get_images_by_ids(self, image_ids):
+        """Return the owned images with the given IDs, using multi ID
+           describe calls. IDs of images that do not exist are ignored."""
+        ec2 = self._connect()
+        images = []
+        for image_ids_chunk in utils.chunks(list(image_ids), 100):
+            images += utils.call_with_retry(
+                ec2.describe_images,
+                Owners=['self'],
+                Filters=[{'Name': 'image-id', 'Values': image_ids_chunk}]
+            )['Images']
+
+        return images
+
     # ---------------------------------------------------------------------
     def _get_snapshot_id(self, image):
         """Get the snapshot id associated with this image"""
@@ -146,68 +208,350 @@ class EC2RemoveImage(EC2ImgUtils):
         header_msg += 'in region: {}'
         self.log.info(header_msg.format(self.region))
         for image in images:
+            selector = ''
+            if image.get('Selector'):
+                selector = '\t(%s)' % image['Selector']
             if not self.keep_snap:
                 snapshot = self._get_snapshot_id(image)
-                self.log.info('\t\t%s\t%s\t%s' % (
+                self.log.info('\t\t%s\t%s\t%s%s' % (
                     image['ImageId'],
                     image['Name'],
-                    snapshot
+                    snapshot,
+                    selector
+                ))
+            else:
+                self.log.info('\t\t%s\t%s%s' % (
+                    image['ImageId'], image['Name'], selector
                 ))
+
+        return True
+
+    # ---------------------------------------------------------------------
+    def _delete_snapshot(self, ec2, snapshot_id):
+        """Delete the given snapshot. A snapshot is reported in use until
+           EC2 caught up with the deregistration of its image, the deletion
+           is retried with backoff until the snapshot is released."""
+        retry_codes = ('InvalidSnapshot.InUse',) + utils.THROTTLE_ERROR_CODES
+        utils.call_with_retry(
+            ec2.delete_snapshot,
+            retry_codes=retry_codes,
+            retries=self.snapshot_delete_retries,
+            SnapshotId=snapshot_id
+        )
+        self.log.debug('\tSnapshot: {}'.format(snapshot_id))
+
+    # ---------------------------------------------------------------------
+    def _delete_queued_snapshot(self, ec2, snapshot_id):
+        """Delete a snapshot queued for deletion by an interrupted run, the
+           run may have deleted it without recording the deletion"""
+        try:
+            self._delete_snapshot(ec2, snapshot_id)
+        except ClientError as e:
+            error_code = e.response.get('Error', {}).get('Code')
+            if error_code != 'InvalidSnapshot.NotFound':
+                raise
+
+    # ---------------------------------------------------------------------
+    def _get_queued_snapshots(self):
+        """Return the snapshots in the current region an interrupted run
+           queued for deletion in the run journal but did not delete, their
+           images are deregistered already"""
+        if not self.journal:
+            return []
+        deleted = self.journal.get_images(self.region, 'delete-snapshot')
+        return [
+            snapshot_id for snapshot_id
+            in self.journal.get_images(self.region, 'queue-snapshot')
+            if snapshot_id not in deleted
+        ]
+
+    # ---------------------------------------------------------------------
+    def print_remove_by_ids_info(self, image_ids):
+        """Print information about the images with the given IDs that would
+           be deleted"""
+        images = dict(
+            (image['ImageId'], image)
+            for image in self._get_images_by_ids(image_ids)
+        )
+        self.log.info('Would remove in region: {}'.format(self.region))
+        for image_id in image_ids:
+            image = images.get(image_id)
+            if image:
+                self.log.info('\t\t%s\t%s' % (image_id, image.get('Name')))
             else:
-                self.log.info('\t\t%s\t%s' % (image['ImageId'], image['Name']))
+                self.log.info('\t\t%s\tnot found' % image_id)
 
         return True
 
     # ---------------------------------------------------------------------
-    def remove_images(self):
-        """Remove the images"""
+    def print_remove_orphaned_snapshots_info(
+            self, min_age_days, include_untagged=False
+    ):
+        """Print information about orphaned snapshots that would be
+           deleted"""
+        snapshots = self.get_orphaned_snapshots(
+            min_age_days, include_untagged
+        )
+        self.log.info(
+            'Would remove orphaned snapshots in region: {}'.format(
+                self.region
+            )
+        )
+        self.print_snapshots(snapshots)
+
+        return True
+
+    # ---------------------------------------------------------------------
+    def print_snapshots(self, snapshots):
+        """Print one line of information per given snapshot"""
+        for snapshot in snapshots:
+            self.log.info('\t\t%s\t%s\t%d GiB\t%s' % (
+                snapshot['SnapshotId'],
+                snapshot['StartTime'].strftime('%Y%m%d'),
+                snapshot.get('VolumeSize', 0),
+                snapshot.get('Description', '')
+            ))
+
+    # ---------------------------------------------------------------------
+    def remove_orphaned_snapshots(self, min_age_days, include_untagged=False):
+        """Delete the orphaned snapshots older than min_age_days, see
+           get_orphaned_snapshots. Return a list of (snapshot ID, error)
+           tuples, the error is None if the snapshot was deleted."""
+        return self.remove_snapshots([
+            snapshot['SnapshotId']
+            for snapshot in self.get_orphaned_snapshots(
+                min_age_days, include_untagged
+            )
+        ])
+
+    # ---------------------------------------------------------------------
+    def remove_snapshots(self, snapshot_ids):
+        """Delete the given snapshots using up to max_workers threads.
+           Return a list of (snapshot ID, error) tuples, the error is None
+           if the snapshot was deleted."""
         ec2 = self._connect()
+
+        def delete_snapshot(snapshot_id):
+            utils.call_with_retry(
+                ec2.delete_snapshot,
+                SnapshotId=snapshot_id
+            )
+            self.log.debug('\tSnapshot: {}'.format(snapshot_id))
+
+        deleted = []
+        for snapshot_id, result, error in utils.run_in_parallel(
+            delete_snapshot,
+            snapshot_ids,
+            self.max_workers
+        ):
+            if error:
+                self.log.error(
+                    '\tFailed to delete snapshot: %s\t%s' % (
+                        snapshot_id, error
+                    )
+                )
+            deleted.append((snapshot_id, error))
+
+        return deleted
+
+    # ---------------------------------------------------------------------
+    def remove_images_by_ids(self, image_ids):
+        """Remove the images with the given IDs and their snapshots, unless
+           preserved, using up to max_workers threads. The images are
+           looked up with multi ID describe calls. Return a dictionary of
+           image ID to a (status, snapshot ID, error) tuple, the status is
+           one of removed, not_found or failed."""
+        ec2 = self._connect()
+        images = self._get_images_by_ids(image_ids)
+
+        def remove_image(image):
+            snapshot = None
+            if not self.keep_snap:
+                snapshot = self._get_snapshot_id(image)
+            utils.call_with_retry(
+                ec2.deregister_image,
+                ImageId=image['ImageId']
+            )
+            self.log.debug(
+                '\tImage: %s\t%s' % (image['ImageId'], image.get('Name'))
+            )
+            if snapshot:
+                self._delete_snapshot(ec2, snapshot)
+            return snapshot
+
+        results = dict(
+            (image_id, ('not_found', None, None)) for image_id in image_ids
+        )
+        for image, snapshot, error in utils.run_in_parallel(
+            remove_image,
+            images,
+            self.max_workers
+        ):
+            if error:
+                self.log.error(
+                    '\tFailed to remove: %s\t%s' % (image['ImageId'], error)
+                )
+                results[image['ImageId']] = ('failed', None, str(error))
+            else:
+                results[image['ImageId']] = ('removed', snapshot, None)
+
+        return results
+
+    # ---------------------------------------------------------------------
+    def get_orphaned_snapshots(self, min_age_days, include_untagged=False):
+        """Return the snapshots created by ec2uploadimg older than
+           min_age_days that are not referenced by the block device
+           mappings of any owned image, disabled images included, ordered
+           by their start time. With include_untagged all owned snapshots
+           are candidates, not only the ones carrying the creator tag."""
+        ec2 = self._connect()
+        referenced_snapshot_ids = set()
+        paginator = ec2.get_paginator('describe_images')
+        for page in paginator.paginate(Owners=['self'], IncludeDisabled=True):
+            for image in page['Images']:
+                referenced_snapshot_ids.update(
+                    block_map['Ebs']['SnapshotId']
+                    for block_map in image.get('BlockDeviceMappings', [])
+                    if block_map.get('Ebs', {}).get('SnapshotId')
+                )
+
+        filters = []
+        if not include_untagged:
+            filters.append({
+                'Name': 'tag:%s' % utils.SNAPSHOT_CREATOR_TAG['Key'],
+                'Values': [utils.SNAPSHOT_CREATOR_TAG['Value']]
+            })
+        snapshots = {}
+        paginator = ec2.get_paginator('describe_snapshots')
+        for page in paginator.paginate(OwnerIds=['self'], Filters=filters):
+            for snapshot in page['Snapshots']:
+                snapshots[snapshot['SnapshotId']] = snapshot
+
+        created_before = datetime.datetime.now(
+            datetime.timezone.utc
+        ) - datetime.timedelta(days=min_age_days)
+        orphaned_snapshots = [
+            snapshots[snapshot_id]
+            for snapshot_id in set(snapshots) - referenced_snapshot_ids
+            if snapshots[snapshot_id]['StartTime'] <= created_before
+        ]
+
+        return sorted(
+            orphaned_snapshots, key=lambda snapshot: snapshot['StartTime']
+        )
+
+    # ---------------------------------------------------------------------
+    def get_images_to_remove(self):
+        """Return the images to remove in the current region, images
+           removed by a previous run of the journal are skipped. Raise
+           EC2RemoveImgException if the images are ambiguous."""
         images = self._get_images_to_remove()
         images_ok = self._check_images_boundary_condition(images)
 
         if not images_ok:
             raise EC2RemoveImgException('Image ambiguity')
 
-        for image in images:
-            delete = 'True'
-            if self.confirm:
-                delete = self._query_yes_no(image)
+        return [
+            image for image in images
+            if not self._is_complete(image['ImageId'], 'remove')
+        ]
 
-            if delete:
-                ec2.deregister_image(ImageId=image['ImageId'])
+    # ---------------------------------------------------------------------
+    def remove_images(self, images=None):
+        """Remove the images, or the given images as returned by
+           get_images_to_remove, return a list of (image ID, snapshot ID)
+           tuples for the removed images, the snapshot ID is None if the
+           snapshot was preserved. Images are deregistered back to back,
+           the snapshot deletions are queued and drain concurrently. The
+           snapshots are queued in the run journal before their image is
+           deregistered, the snapshots an interrupted run queued but did
+           not delete are deleted as well."""
+        ec2 = self._connect()
+        if images is None:
+            images = self.get_images_to_remove()
+
+        removed = []
+        snapshot_deletions = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for snapshot in self._get_queued_snapshots():
+                self.log.debug(
+                    '\tSnapshot %s queued by an interrupted run' % snapshot
+                )
+                snapshot_deletions.append((
+                    None,
+                    snapshot,
+                    executor.submit(
+                        self._delete_queued_snapshot, ec2, snapshot
+                    )
+                ))
+
+            for image in images:
+                delete = 'True'
+                if self.confirm:
+                    delete = self._query_yes_no(image)
+
+                if not delete:
+                    continue
+
+                snapshot = None
                 if not self.keep_snap:
                     snapshot = self._get_snapshot_id(image)
-                    # Give the EC2 backend a little bit of time to catch up
-                    time.sleep(1)
-                    ec2.delete_snapshot(SnapshotId=snapshot)
-
-                    self.log.debug(
-                        'Removing in region: {}'.format(self.region))
-                    self.log.debug(
-                        '\tImage: %s\t%s' % (image['ImageId'], image['Name'])
+                    # Once the image is deregistered a rerun no longer
+                    # finds the snapshot through it
+                    self._record_complete(snapshot, 'queue-snapshot')
+                utils.call_with_retry(
+                    ec2.deregister_image,
+                    ImageId=image['ImageId']
+                )
+                self.log.debug('Removing in region: {}'.format(self.region))
+                self.log.debug(
+                    '\tImage: %s\t%s' % (image['ImageId'], image['Name'])
+                )
+                if snapshot:
+                    snapshot_deletions.append((
+                        image,
+                        snapshot,
+                        executor.submit(self._delete_snapshot, ec2, snapshot)
+                    ))
+                else:
+                    removed.append((image['ImageId'], snapshot))
+                    self._record_complete(image['ImageId'], 'remove')
+
+            failed_snapshots = []
+            for image, snapshot, deletion in snapshot_deletions:
+                try:
+                    deletion.result()
+                except Exception as e:
+                    self.log.error(
+                        '\tFailed to delete snapshot: %s\tof %s\t%s' % (
+                            snapshot,
+                            'image %s' % image['ImageId'] if image
+                            else 'an interrupted run',
+                            e
+                        )
                     )
-                if not self.keep_snap:
-                    self.log.debug('\tSnapshot: {}'.format(snapshot))
-            else:
-                continue
-    # ---------------------------------------------------------------------
+                    failed_snapshots.append(snapshot)
+                    continue
+                self._record_complete(snapshot, 'delete-snapshot')
+                if image:
+                    removed.append((image['ImageId'], snapshot))
+                    self._record_complete(image['ImageId'], 'remove')
 
-    def _query_yes_no(self, image):
-        yes = {'yes', 'y', 'ye', ''}
-        no = {'no', 'n'}
+        if failed_snapshots:
+            msg = 'Failed to delete %d snapshot(s) in region %s: %s' % (
+                len(failed_snapshots), self.region, ', '.join(failed_snapshots)
+            )
+            raise EC2RemoveImgException(msg)
 
-        while True:
-            try:
-                choice = input(
-                            '\tConfirm Delete Image: %s\t%s (Y/n)'
-                            % (image['ImageId'], image['Name'])
-                        ).lower()
-                if choice in yes:
-                    return True
-                elif choice in no:
-                    return False
-                else:
-                    sys.stdout.write("Please respond with 'yes' or 'no'\n")
-            except KeyboardInterrupt:
-                raise EC2RemoveImgException(
-                        'Keyboard Interrupt received, exiting')
+        return removed
+
+    # ---------------------------------------------------------------------
+    def _query_yes_no(self, image):
+        try:
+            return utils.query_yes_no(
+                '\tConfirm Delete Image: %s\t%s (Y/n)'
+                % (image['ImageId'], image['Name'])
+            )
+        except KeyboardInterrupt:
+            raise EC2RemoveImgException(
+                    'Keyboard Interrupt received, exiting')
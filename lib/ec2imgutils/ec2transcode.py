@@ -0,0 +1,321 @@
+# Copyright 2026 SUSE LLC
+#
+# This file is part of ec2imgutils
+#
+# ec2imgutils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ec2imgutils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ec2imgutils. If not, see <http://www.gnu.org/licenses/>.
+
+import bz2
+import collections
+import contextlib
+import gzip
+import logging
+import lzma
+import os
+import shutil
+import struct
+import subprocess
+import tarfile
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ec2imgutils.ec2imgutilsExceptions import EC2TranscodeException
+
+try:
+    import zstandard
+except ImportError:
+    # Without the zstandard module the zstd command is used
+    zstandard = None
+
+# Local decompressors of the image files per extension
+DECOMPRESSORS = {
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+    '.xz': lzma.open
+}
+# Extensions of the image archives
+TAR_EXTENSIONS = (
+    '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz', '.tar.xz', '.txz'
+)
+TRANSCODE_CHUNK_SIZE = 4 * 1024 * 1024
+# The transcoded image consists of independent zstd frames of this much
+# raw data, each preceded by the skippable frame pzstd stores the size of
+# the following frame in. pzstd decompresses such files in parallel, zstd
+# skips the skippable frames.
+TRANSCODE_FRAME_SIZE = 16 * 1024 * 1024
+PZSTD_SKIPPABLE_FRAME_MAGIC = 0x184D2A50
+# The compression levels tried by the level selection, fastest first,
+# and the size of the image sample they are measured with
+TRANSCODE_LEVELS = (1, 3, 6, 9, 12, 15, 19)
+TRANSCODE_SAMPLE_SIZE = 32 * 1024 * 1024
+# Compression level used when the link bandwidth is unknown
+DEFAULT_TRANSCODE_LEVEL = 3
+
+
+class ZstdWriter:
+    """Compress the written data with zstd into the target file in
+       independent frames of TRANSCODE_FRAME_SIZE, the frames are
+       compressed concurrently on the given number of worker threads and
+       written in the pzstd format"""
+
+    def __init__(self, target, level, workers):
+        if not zstandard and not shutil.which('zstd'):
+            msg = 'Transcoding requires the zstandard module or the zstd '
+            msg += 'command'
+            raise EC2TranscodeException(msg)
+        self.target = target
+        self.level = level
+        self.workers = workers
+        self.buffer = bytearray()
+        self.frames = collections.deque()
+        self.frame_count = 0
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.stream = open(target, 'wb')
+
+    # ---------------------------------------------------------------------
+    def __enter__(self):
+        return self
+
+    # ---------------------------------------------------------------------
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type:
+            self._shutdown()
+        else:
+            self.close()
+
+    # ---------------------------------------------------------------------
+    def _shutdown(self):
+        """Drop the frames not yet written and close the target file"""
+        for frame in self.frames:
+            frame.cancel()
+        self.frames.clear()
+        self.executor.shutdown()
+        self.stream.close()
+
+    # ---------------------------------------------------------------------
+    def _submit_frame(self, data):
+        """Compress the given data into a frame on a worker thread, write
+           the finished frames in order while keeping every worker busy"""
+        self.frames.append(
+            self.executor.submit(compress_sample, data, self.level)
+        )
+        self.frame_count += 1
+        while len(self.frames) > self.workers:
+            self._write_frame(self.frames.popleft().result())
+
+    # ---------------------------------------------------------------------
+    def _write_frame(self, frame):
+        """Write the given compressed frame preceded by its size"""
+        self.stream.write(struct.pack(
+            '<III', PZSTD_SKIPPABLE_FRAME_MAGIC, 4, len(frame)
+        ))
+        self.stream.write(frame)
+
+    # ---------------------------------------------------------------------
+    def close(self):
+        """Finish the compressed file"""
+        try:
+            if self.buffer or not self.frame_count:
+                self._submit_frame(bytes(self.buffer))
+                self.buffer = bytearray()
+            while self.frames:
+                self._write_frame(self.frames.popleft().result())
+        finally:
+            self._shutdown()
+
+    # ---------------------------------------------------------------------
+    def write(self, data):
+        """Compress the given data"""
+        self.buffer += data
+        while len(self.buffer) >= TRANSCODE_FRAME_SIZE:
+            self._submit_frame(bytes(self.buffer[:TRANSCODE_FRAME_SIZE]))
+            del self.buffer[:TRANSCODE_FRAME_SIZE]
+
+
+# ----------------------------------------------------------------------------
+def compress_sample(sample, level):
+    """Return the sample compressed at the given level into a single zstd
+       frame on a single thread"""
+    if zstandard:
+        return zstandard.ZstdCompressor(level=level).compress(sample)
+    zstd = shutil.which('zstd')
+    if not zstd:
+        msg = 'Transcoding requires the zstandard module or the zstd command'
+        raise EC2TranscodeException(msg)
+
+    process = subprocess.run(
+        [zstd, '-q', '-T1', '-%d' % level, '-c', '-'],
+        input=sample,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    if process.returncode:
+        msg = 'Compression with zstd failed: %s' % process.stderr.decode(
+            'utf-8', 'replace'
+        )
+        raise EC2TranscodeException(msg)
+
+    return process.stdout
+
+
+# ----------------------------------------------------------------------------
+def get_transcoded_name(filename):
+    """Return the name of the zstd compressed raw image the given image
+       file is transcoded to"""
+    for extension in TAR_EXTENSIONS + tuple(DECOMPRESSORS):
+        if filename.endswith(extension):
+            filename = filename[:-len(extension)]
+            break
+    if not filename.endswith('.raw'):
+        filename += '.raw'
+
+    return filename + '.zst'
+
+
+# ----------------------------------------------------------------------------
+def is_transcodable(source):
+    """Return True if the given image file is not yet zstd compressed"""
+    return not source.endswith('.zst')
+
+
+# ----------------------------------------------------------------------------
+def _open_archive_image(archive, source):
+    """Return the name of the raw image in the given opened image archive
+       and a file object reading its uncompressed data"""
+    try:
+        for member in archive:
+            if not member.isfile():
+                continue
+            name = os.path.basename(member.name)
+            if name.endswith('.raw'):
+                return name, archive.extractfile(member)
+            for extension, decompressor in DECOMPRESSORS.items():
+                if name.endswith('.raw' + extension):
+                    return name, decompressor(archive.extractfile(member))
+    except tarfile.TarError as e:
+        msg = 'Unable to read image archive %s: %s' % (source, e)
+        raise EC2TranscodeException(msg)
+    msg = 'Unable to find raw image file with .raw extension in %s' % source
+    raise EC2TranscodeException(msg)
+
+
+# ----------------------------------------------------------------------------
+@contextlib.contextmanager
+def open_image(source):
+    """Context manager providing the name of the raw image in the given
+       image file and a file object reading its uncompressed data, the
+       file object and the image archive, if any, are closed on exit"""
+    filename = os.path.basename(source)
+    if filename.endswith(TAR_EXTENSIONS):
+        try:
+            archive = tarfile.open(source, 'r|*')
+        except tarfile.TarError as e:
+            msg = 'Unable to read image archive %s: %s' % (source, e)
+            raise EC2TranscodeException(msg)
+        with archive:
+            name, image = _open_archive_image(archive, source)
+            with image:
+                yield name, image
+        return
+    for extension, decompressor in DECOMPRESSORS.items():
+        if filename.endswith(extension):
+            with decompressor(source) as image:
+                yield filename, image
+            return
+    with open(source, 'rb') as image:
+        yield filename, image
+
+
+# ----------------------------------------------------------------------------
+def select_compression_level(
+        sample,
+        bandwidth,
+        workers,
+        levels=TRANSCODE_LEVELS
+):
+    """Return the compression level that moves the image over a link of
+       the given bandwidth in bytes per second the fastest. The image is
+       sent at the slower of the compression rate of the workers and the
+       rate at which the link carries the compressed data."""
+    best_level = levels[0]
+    best_rate = 0
+    for level in levels:
+        start = time.monotonic()
+        compressed = compress_sample(sample, level)
+        elapsed = max(time.monotonic() - start, 1e-6)
+        compression_rate = len(sample) / elapsed * workers
+        link_rate = bandwidth * len(sample) / max(len(compressed), 1)
+        rate = min(compression_rate, link_rate)
+        if rate >= best_rate:
+            best_level = level
+            best_rate = rate
+        if compression_rate < link_rate:
+            # Higher levels compress slower still, the compression is the
+            # bottleneck from here on
+            break
+
+    return best_level
+
+
+# ----------------------------------------------------------------------------
+def transcode_image(
+        source,
+        target_dir,
+        level=None,
+        bandwidth=None,
+        workers=None,
+        log_callback=None
+):
+    """Decompress the given image file and compress the raw image with zstd
+       into the target directory in a single pass, return the path of the
+       compressed image. Without a level the level is selected against the
+       given link bandwidth in bytes per second."""
+    log = log_callback or logging.getLogger('ec2imgutils')
+    workers = workers or os.cpu_count() or 1
+    start = time.monotonic()
+    try:
+        with open_image(source) as (raw_image_name, image):
+            target = os.path.join(
+                target_dir, get_transcoded_name(raw_image_name)
+            )
+            data = image.read(TRANSCODE_SAMPLE_SIZE)
+            if not level:
+                if bandwidth:
+                    level = select_compression_level(
+                        data, bandwidth, workers
+                    )
+                else:
+                    level = DEFAULT_TRANSCODE_LEVEL
+            log.debug(
+                'Transcoding %s to %s at level %d on %d threads' % (
+                    source, target, level, workers
+                )
+            )
+            with ZstdWriter(target, level, workers) as writer:
+                while data:
+                    writer.write(data)
+                    data = image.read(TRANSCODE_CHUNK_SIZE)
+    except (OSError, EOFError, lzma.LZMAError, tarfile.TarError) as e:
+        msg = 'Unable to transcode image file %s: %s' % (source, e)
+        raise EC2TranscodeException(msg)
+    log.debug(
+        'Transcoded %s from %d to %d bytes in %.1fs' % (
+            source,
+            os.path.getsize(source),
+            os.path.getsize(target),
+            time.monotonic() - start
+        )
+    )
+
+    return target
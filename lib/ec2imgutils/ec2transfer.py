@@ -0,0 +1,370 @@
+# Copyright 2026 SUSE LLC
+#
+# This file is part of ec2imgutils
+#
+# ec2imgutils is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# ec2imgutils is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ec2imgutils. If not, see <http://www.gnu.org/licenses/>.
+
+import abc
+import logging
+import os
+import paramiko
+import shlex
+import subprocess
+import tempfile
+import time
+
+from ec2imgutils.ec2imgutilsExceptions import EC2TransferException
+
+# Size of the sample uploaded by the benchmark and the remote file it is
+# written to
+BENCHMARK_SIZE = 64 * 1024 * 1024
+BENCHMARK_TARGET = '/tmp/ec2uploadimg-benchmark'
+DEFAULT_SSH_CIPHER = 'aes128-gcm@openssh.com'
+TRANSFER_CHUNK_SIZE = 1024 * 1024
+TUNED_MAX_PACKET_SIZE = 256 * 1024
+TUNED_WINDOW_SIZE = 128 * 1024 * 1024
+
+
+class EC2TransferBackend(abc.ABC):
+    """Move image data from the local host to the helper instance that is
+       connected with the given paramiko SSH client"""
+
+    name = None
+    # Whether the backend provides the SFTP sessions of the sparse, chunked
+    # and resumed uploads
+    supports_sftp = False
+    # Bytes per second measured by the benchmark
+    throughput = None
+
+    def __init__(
+            self,
+            ssh_client,
+            username,
+            key_filename,
+            timeout=900,
+            log_callback=None
+    ):
+        if log_callback:
+            self.log = log_callback
+        else:
+            self.log = logging.getLogger('ec2imgutils')
+
+        self.key_filename = key_filename
+        self.ssh_client = ssh_client
+        self.timeout = timeout
+        self.username = username
+
+    # ---------------------------------------------------------------------
+    def _read_chunks(self, source, progress=None):
+        """Yield the content of the source file in chunks and report the
+           transferred bytes to the progress callback"""
+        total_bytes = os.path.getsize(source)
+        transferred_bytes = 0
+        with open(source, 'rb') as image:
+            while True:
+                data = image.read(TRANSFER_CHUNK_SIZE)
+                if not data:
+                    break
+                yield data
+                transferred_bytes += len(data)
+                if progress:
+                    progress(transferred_bytes, total_bytes)
+
+    # ---------------------------------------------------------------------
+    @abc.abstractmethod
+    def stream(self, source, command, progress=None):
+        """Send the source file to the stdin of the given remote command"""
+
+    # ---------------------------------------------------------------------
+    @abc.abstractmethod
+    def upload(self, source, target, progress=None):
+        """Upload the source file to the target path"""
+
+
+class ParamikoTransferBackend(EC2TransferBackend):
+    """Transfer over the paramiko connection with the default settings"""
+
+    name = 'paramiko'
+    supports_sftp = True
+
+    # ---------------------------------------------------------------------
+    def _open_session(self):
+        """Open a session channel on the SSH connection"""
+        return self.ssh_client.get_transport().open_session()
+
+    # ---------------------------------------------------------------------
+    def open_sftp(self, ssh_client=None):
+        """Open an SFTP session on the given SSH connection, by default
+           the connection of the backend"""
+        return (ssh_client or self.ssh_client).open_sftp()
+
+    # ---------------------------------------------------------------------
+    def stream(self, source, command, progress=None):
+        """Send the source file to the stdin of the given remote command"""
+        channel = self._open_session()
+        try:
+            channel.settimeout(self.timeout)
+            channel.exec_command(command)
+            for data in self._read_chunks(source, progress):
+                channel.sendall(data)
+            channel.shutdown_write()
+            exit_status = channel.recv_exit_status()
+            if exit_status:
+                cmd_error = b''
+                while channel.recv_stderr_ready():
+                    cmd_error += channel.recv_stderr(4096)
+                msg = 'Execution of "%s" failed with exit status %d' % (
+                    command, exit_status
+                )
+                msg += '\n%s' % cmd_error.decode('utf-8', 'replace')
+                raise EC2TransferException(msg)
+        finally:
+            channel.close()
+
+    # ---------------------------------------------------------------------
+    def upload(self, source, target, progress=None):
+        """Upload the source file to the target path with SFTP"""
+        sftp = self.open_sftp()
+        try:
+            sftp.get_channel().settimeout(self.timeout)
+            sftp.put(source, target, progress)
+        finally:
+            sftp.close()
+
+
+class TunedParamikoTransferBackend(ParamikoTransferBackend):
+    """Transfer over the paramiko connection with a large window, large
+       packets and pipelined SFTP writes"""
+
+    name = 'paramiko-tuned'
+
+    # ---------------------------------------------------------------------
+    def _open_session(self):
+        """Open a session channel with a large window on the connection"""
+        return self.ssh_client.get_transport().open_session(
+            window_size=TUNED_WINDOW_SIZE,
+            max_packet_size=TUNED_MAX_PACKET_SIZE
+        )
+
+    # ---------------------------------------------------------------------
+    def open_sftp(self, ssh_client=None):
+        """Open an SFTP session with a large window on the given SSH
+           connection, by default the connection of the backend"""
+        return paramiko.SFTPClient.from_transport(
+            (ssh_client or self.ssh_client).get_transport(),
+            window_size=TUNED_WINDOW_SIZE,
+            max_packet_size=TUNED_MAX_PACKET_SIZE
+        )
+
+    # ---------------------------------------------------------------------
+    def upload(self, source, target, progress=None):
+        """Upload the source file to the target path with pipelined SFTP
+           writes"""
+        sftp = self.open_sftp()
+        try:
+            sftp.get_channel().settimeout(self.timeout)
+            with sftp.open(target, 'wb') as remote:
+                remote.set_pipelined(True)
+                for data in self._read_chunks(source, progress):
+                    remote.write(data)
+        finally:
+            sftp.close()
+
+
+class OpenSSHTransferBackend(EC2TransferBackend):
+    """Transfer through a pipe into the system ssh client, its compiled
+       crypto is considerably faster than the one of paramiko"""
+
+    name = 'openssh'
+
+    def __init__(
+            self,
+            ssh_client,
+            username,
+            key_filename,
+            timeout=900,
+            log_callback=None,
+            cipher=None,
+            compression=False
+    ):
+        EC2TransferBackend.__init__(
+            self,
+            ssh_client,
+            username,
+            key_filename,
+            timeout=timeout,
+            log_callback=log_callback
+        )
+        self.cipher = cipher or DEFAULT_SSH_CIPHER
+        self.compression = compression
+
+    # ---------------------------------------------------------------------
+    def _get_ssh_command(self, command):
+        """Return the ssh command line that runs the given remote command
+           on the helper instance"""
+        hostname = self.ssh_client.get_transport().getpeername()[0]
+        ssh_command = [
+            'ssh',
+            '-i', self.key_filename,
+            '-l', self.username,
+            '-c', self.cipher,
+            '-o', 'BatchMode=yes',
+            '-o', 'ConnectTimeout=%d' % self.timeout,
+            '-o', 'ServerAliveInterval=30',
+            '-o', 'StrictHostKeyChecking=no',
+            '-o', 'UserKnownHostsFile=/dev/null',
+            '-o', 'LogLevel=ERROR'
+        ]
+        if self.compression:
+            ssh_command.append('-C')
+        ssh_command += [hostname, command]
+
+        return ssh_command
+
+    # ---------------------------------------------------------------------
+    def stream(self, source, command, progress=None):
+        """Send the source file to the stdin of the given remote command
+           through the system ssh client"""
+        ssh_command = self._get_ssh_command(command)
+        self.log.debug('Running: %s' % ' '.join(ssh_command))
+        with tempfile.TemporaryFile() as cmd_error:
+            try:
+                ssh = subprocess.Popen(
+                    ssh_command,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.DEVNULL,
+                    stderr=cmd_error
+                )
+            except OSError as e:
+                msg = 'Unable to run the ssh client: %s' % e
+                raise EC2TransferException(msg) from e
+            try:
+                for data in self._read_chunks(source, progress):
+                    ssh.stdin.write(data)
+                ssh.stdin.close()
+            except BrokenPipeError:
+                # The remote command ended early, report its error
+                pass
+            except BaseException:
+                # Aborted by the progress callback or interrupted, do not
+                # leave the ssh client running
+                ssh.kill()
+                ssh.wait()
+                raise
+            exit_status = ssh.wait()
+            if exit_status:
+                cmd_error.seek(0)
+                msg = 'Execution of "%s" failed with exit status %d' % (
+                    command, exit_status
+                )
+                msg += '\n%s' % cmd_error.read().decode('utf-8', 'replace')
+                if exit_status == 255:
+                    # The exit status of ssh for connection failures
+                    raise ConnectionError(msg)
+                raise EC2TransferException(msg)
+
+    # ---------------------------------------------------------------------
+    def upload(self, source, target, progress=None):
+        """Upload the source file to the target path through the system ssh
+           client"""
+        self.stream(source, 'cat > %s' % shlex.quote(target), progress)
+
+
+TRANSFER_BACKENDS = dict(
+    (backend.name, backend) for backend in (
+        ParamikoTransferBackend,
+        TunedParamikoTransferBackend,
+        OpenSSHTransferBackend
+    )
+)
+
+
+# ----------------------------------------------------------------------------
+def get_transfer_backend(
+        name,
+        ssh_client,
+        username,
+        key_filename,
+        timeout=900,
+        log_callback=None,
+        cipher=None,
+        compression=False
+):
+    """Return an instance of the transfer backend with the given name"""
+    if name not in TRANSFER_BACKENDS:
+        msg = 'Unknown transfer backend "%s", expecting one of %s' % (
+            name, ', '.join(TRANSFER_BACKENDS)
+        )
+        raise EC2TransferException(msg)
+    backend_args = {'timeout': timeout, 'log_callback': log_callback}
+    if name == OpenSSHTransferBackend.name:
+        backend_args['cipher'] = cipher
+        backend_args['compression'] = compression
+
+    return TRANSFER_BACKENDS[name](
+        ssh_client, username, key_filename, **backend_args
+    )
+
+
+# ----------------------------------------------------------------------------
+def benchmark_transfer_backends(
+        backends,
+        size=BENCHMARK_SIZE,
+        target=BENCHMARK_TARGET
+):
+    """Upload a sample of size random bytes with every given backend and
+       return the list of (backend, bytes per second) tuples, fastest
+       first. Random data is not compressible, compression does not favor
+       a backend. Backends that fail are left out."""
+    results = []
+    with tempfile.NamedTemporaryFile() as sample:
+        sample.write(os.urandom(size))
+        sample.flush()
+        for backend in backends:
+            start = time.monotonic()
+            try:
+                backend.upload(sample.name, target)
+            except Exception as e:
+                backend.log.debug(
+                    'Transfer backend %s failed: %s' % (backend.name, e)
+                )
+                continue
+            elapsed = max(time.monotonic() - start, 1e-6)
+            backend.throughput = size / elapsed
+            results.append((backend, backend.throughput))
+
+    return sorted(results, key=lambda result: result[1], reverse=True)
+
+
+# ----------------------------------------------------------------------------
+def select_transfer_backend(
+        backends,
+        size=BENCHMARK_SIZE,
+        target=BENCHMARK_TARGET
+):
+    """Return the fastest of the given backends according to the
+       benchmark, the benchmark file is removed afterwards"""
+    results = benchmark_transfer_backends(backends, size, target)
+    if not results:
+        raise EC2TransferException('No transfer backend is usable')
+    fastest = results[0][0]
+    for backend, throughput in results:
+        fastest.log.info(
+            'Transfer backend %s: %.1f MiB/s' % (
+                backend.name, throughput / 1024 ** 2
+            )
+        )
+    fastest.ssh_client.exec_command('rm -f %s' % shlex.quote(target))
+
+    return fastest
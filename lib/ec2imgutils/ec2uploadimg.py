@@ -15,19 +15,97 @@
 # You should have received a copy of the GNU General Public License
 # along with ec2uploadimg. If not, see <http://www.gnu.org/licenses/>.
 
+import base64
+import boto3
 import botocore
+import hashlib
 import json
 import logging
 import os
 import paramiko
+import queue
+import re
+import shlex
+import shutil
 import socket
 import sys
+import tarfile
+import tempfile
 import threading
 import time
 
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    wait
+)
 
+import ec2imgutils.ec2transcode as transcode
+import ec2imgutils.ec2transfer as transfer
+import ec2imgutils.ec2utils as utils
 from ec2imgutils.ec2imgutils import EC2ImgUtils
-from ec2imgutils.ec2imgutilsExceptions import EC2UploadImgException
+from ec2imgutils.ec2imgutilsExceptions import (
+    EC2TranscodeException,
+    EC2TransferException,
+    EC2UploadImgException
+)
+
+# The block size of snapshots written with the EBS direct APIs
+EBS_BLOCK_SIZE = 512 * 1024
+EBS_ZERO_BLOCK = bytes(EBS_BLOCK_SIZE)
+# Remote decompression commands of the streaming upload per extension,
+# multi-threaded where the helper instance supports it
+STREAM_DECOMPRESSORS = {
+    '.raw': None,
+    '.gz': '$(command -v pigz || echo gzip) -dc',
+    '.bz2': 'bzip2 -dc',
+    '.xz': 'xz -dc -T0',
+    '.zst': '$(command -v pzstd || echo zstd) -dc'
+}
+# Remote commands inflating the uploaded image file per extension
+UNPACK_DECOMPRESSORS = {
+    '.gz': '$(command -v pigz || echo gzip) -d',
+    '.bz2': 'bzip2 -d',
+    '.xz': 'xz -d -T0',
+    '.zst': '$(command -v pzstd || echo zstd) -d -q --rm'
+}
+# Remote tar options of the streaming upload per archive extension
+STREAM_TAR_OPTIONS = {
+    '.tar': '-xO',
+    '.tar.gz': '-xzO',
+    '.tgz': '-xzO',
+    '.tar.bz2': '-xjO',
+    '.tbz': '-xjO',
+    '.tar.xz': '-xJO',
+    '.txz': '-xJO'
+}
+STREAM_CHUNK_SIZE = 1024 * 1024
+# Smallest range written per channel by the chunked upload and the number
+# of attempts per range
+UPLOAD_MIN_CHUNK_SIZE = 64 * 1024 * 1024
+UPLOAD_CHUNK_ATTEMPTS = 3
+# The chunked upload opens another connection every UPLOAD_RAMP_INTERVAL
+# seconds as long as the throughput grew by UPLOAD_RAMP_MIN_GAIN with the
+# previous one
+UPLOAD_RAMP_INTERVAL = 10
+UPLOAD_RAMP_MIN_GAIN = 1.1
+# Connection failures an interrupted upload is resumed after
+UPLOAD_RESUME_ERRORS = (
+    ConnectionError, EOFError, paramiko.SSHException, socket.timeout
+)
+# Block size bounds of dd writing the target device, the block size is
+# picked to keep DD_QUEUE_DEPTH requests of the device's largest I/O size
+# in flight with direct I/O
+DD_DEFAULT_BLOCK_SIZE = 4 * 1024 * 1024
+DD_MAX_BLOCK_SIZE = 16 * 1024 * 1024
+DD_MIN_BLOCK_SIZE = 1024 * 1024
+DD_QUEUE_DEPTH = 16
+# The "N bytes (...) copied, T s, ..." lines of dd status=progress
+DD_PROGRESS = re.compile(r'^(\d+) bytes .*copied, ([\d.,]+) s')
+EBS_RETRY_ERROR_CODES = utils.THROTTLE_ERROR_CODES + (
+    'InternalServerException',
+    'RequestThrottledException'
+)
 
 
 class EC2ImageUploader(EC2ImgUtils):
@@ -68,7 +146,22 @@ class EC2ImageUploader(EC2ImgUtils):
                  boot_mode=None,
                  tpm_support=None,
                  imds_support=None,
-                 image_tags=None
+                 image_tags=None,
+                 use_ebs_direct=False,
+                 ebs_endpoint_url=None,
+                 upload_workers=8,
+                 sparse=True,
+                 stream=False,
+                 upload_channels=1,
+                 transfer_backend='paramiko',
+                 ssh_cipher=None,
+                 ssh_compression=False,
+                 transcode=False,
+                 transcode_level=None,
+                 link_bandwidth=None,
+                 dd_block_size=None,
+                 upload_resume_attempts=3,
+                 copy_timeout=7200
                  ):
         EC2ImgUtils.__init__(
             self,
@@ -121,6 +214,32 @@ class EC2ImageUploader(EC2ImgUtils):
         self.storage_volume_size = 2 * self.root_volume_size
         self.aborted = False
         self.image_tags = image_tags
+        self.use_ebs_direct = use_ebs_direct
+        self.ebs_endpoint_url = ebs_endpoint_url
+        self.upload_workers = max(1, upload_workers)
+        self.sparse = sparse
+        self.stream = stream
+        self.upload_channels = max(1, upload_channels)
+        self.transfer_backend = transfer_backend
+        self.ssh_cipher = ssh_cipher
+        self.ssh_compression = ssh_compression
+        self.transfer = None
+        self.transcode = transcode
+        self.transcode_level = transcode_level
+        self.link_bandwidth = link_bandwidth
+        self.transcoded_image_dir = None
+        self.dd_block_size = dd_block_size
+        self.dd_throughput = None
+        self.upload_resume_attempts = upload_resume_attempts
+        # The (offset, length) chunks of the chunked upload verified on the
+        # helper instance, None before a chunked upload started
+        self.acknowledged_chunks = None
+        self.acknowledged_lock = threading.Lock()
+        # Poll delay and overall timeout for the region copies of the root
+        # snapshot, in seconds
+        self.copy_min_delay = 10
+        self.copy_max_delay = 120
+        self.copy_timeout = copy_timeout
 
         if sriov_type and sriov_type != 'simple':
             raise EC2UploadImgException(
@@ -136,6 +255,15 @@ class EC2ImageUploader(EC2ImgUtils):
             raise EC2UploadImgException(
                 'imds_support must be one of %s' % str(imds_versions)
             )
+        transfer_backends = list(transfer.TRANSFER_BACKENDS) + ['auto']
+        if transfer_backend not in transfer_backends:
+            raise EC2UploadImgException(
+                'transfer_backend must be one of %s' % str(transfer_backends)
+            )
+        if transfer_backend == 'openssh' and self.upload_channels > 1:
+            raise EC2UploadImgException(
+                'upload_channels requires an SFTP based transfer_backend'
+            )
 
     def abort(self):
         """
@@ -202,6 +330,25 @@ class EC2ImageUploader(EC2ImgUtils):
                 msg = 'Image with name "%s" already exists' % self.image_name
                 raise EC2UploadImgException(msg)
 
+    # ---------------------------------------------------------------------
+    def _check_transcoded_image(self, source, upload_source):
+        """Return the given upload source if it is not transcoded or the
+           helper instance has zstd or pzstd to inflate it, otherwise the
+           transcoded image is removed and the original source is
+           returned"""
+        if (
+                upload_source == source or
+                self._get_command_from_instance('zstd') or
+                self._get_command_from_instance('pzstd')
+        ):
+            return upload_source
+        self.log.warning(
+            'No zstd on the helper instance, uploading %s as is' % source
+        )
+        self._remove_transcoded_image()
+
+        return source
+
     # ---------------------------------------------------------------------
     def _check_security_groups_exist(self):
         """Check that the specified security groups exist"""
@@ -289,6 +436,7 @@ class EC2ImageUploader(EC2ImgUtils):
     # ---------------------------------------------------------------------
     def _clean_up(self):
         """Clean up the given resources"""
+        self._remove_transcoded_image()
         if self.ssh_client:
             self.ssh_client.close()
         if self.instance_ids:
@@ -362,34 +510,72 @@ class EC2ImageUploader(EC2ImgUtils):
             self._check_subnet_exists()
         if self.security_group_ids:
             self._check_security_groups_exist()
-        if self.running_id:
-            # When using an already running instance, simply look up this one
-            helper_instance = self._get_helper_instance()
-        else:
-            helper_instance = self._launch_helper_instance()
-        self.helper_instance = helper_instance
-        store_volume = self._create_storage_volume()
-        self._attach_volume(store_volume)
+        # Transcode before the helper instance is launched and billed
+        upload_source = self._transcode_image(source)
+        try:
+            if self.running_id:
+                # When using an already running instance, simply look up
+                # this one
+                helper_instance = self._get_helper_instance()
+            else:
+                helper_instance = self._launch_helper_instance()
+            self.helper_instance = helper_instance
+            if self.stream:
+                return self._create_image_root_volume_streamed(
+                    source, upload_source
+                )
+            store_volume = self._create_storage_volume()
+            self._attach_volume(store_volume)
+            self._establish_ssh_connection()
+            store_device_id = self._find_device_name(self.storage_volume_size)
+            target_root_volume = self._create_target_root_volume()
+            self._attach_volume(target_root_volume)
+            target_root_device_id = self._find_device_name(
+                self.root_volume_size
+            )
+            self._format_storage_volume(store_device_id)
+            self._create_storage_filesystem(store_device_id)
+            mount_point = self._mount_storage_volume(store_device_id)
+            self._change_mount_point_permissions(mount_point, '777')
+            upload_source = self._check_transcoded_image(
+                source, upload_source
+            )
+            image_filename = self._upload_image(mount_point, upload_source)
+            self._remove_transcoded_image()
+            raw_image_filename = self._unpack_image(
+                mount_point, image_filename
+            )
+            self._dump_root_fs(
+                mount_point,
+                raw_image_filename,
+                target_root_device_id
+            )
+            self._execute_ssh_command('umount %s' % mount_point)
+            self._end_ssh_session()
+            self._detach_volume(target_root_volume)
+            self._detach_volume(store_volume)
+        finally:
+            self._remove_transcoded_image()
+
+        return target_root_volume
+
+    # ---------------------------------------------------------------------
+    def _create_image_root_volume_streamed(self, source, upload_source=None):
+        """Create the root volume by streaming the image over the SSH
+           connection into the decompression and dd commands writing the
+           target device, no storage volume is used. The upload_source is
+           the transcoded source, if any."""
         self._establish_ssh_connection()
-        store_device_id = self._find_device_name(self.storage_volume_size)
         target_root_volume = self._create_target_root_volume()
         self._attach_volume(target_root_volume)
         target_root_device_id = self._find_device_name(self.root_volume_size)
-        self._format_storage_volume(store_device_id)
-        self._create_storage_filesystem(store_device_id)
-        mount_point = self._mount_storage_volume(store_device_id)
-        self._change_mount_point_permissions(mount_point, '777')
-        image_filename = self._upload_image(mount_point, source)
-        raw_image_filename = self._unpack_image(mount_point, image_filename)
-        self._dump_root_fs(
-            mount_point,
-            raw_image_filename,
-            target_root_device_id
+        upload_source = self._check_transcoded_image(
+            source, upload_source or source
         )
-        self._execute_ssh_command('umount %s' % mount_point)
+        self._stream_image(upload_source, target_root_device_id)
+        self._remove_transcoded_image()
         self._end_ssh_session()
         self._detach_volume(target_root_volume)
-        self._detach_volume(store_volume)
 
         return target_root_volume
 
@@ -400,8 +586,115 @@ class EC2ImageUploader(EC2ImgUtils):
             return
         snapshot = self._connect().create_snapshot(
             VolumeId=volume['VolumeId'],
-            Description=self.image_description
+            Description=self.image_description,
+            TagSpecifications=self._get_snapshot_tag_specifications()
+        )
+        self._wait_for_snapshot(snapshot)
+
+        return snapshot
+
+    # ---------------------------------------------------------------------
+    def _create_snapshot_ebs_direct(self, source):
+        """Write the given local raw image to a new snapshot with the EBS
+           direct APIs, up to upload_workers blocks are written
+           concurrently"""
+        if self.aborted:
+            return
+        if not source.endswith('.raw'):
+            msg = 'Writing a snapshot with the EBS direct APIs requires an '
+            msg += 'uncompressed image file with .raw extension'
+            raise EC2UploadImgException(msg)
+        image_size = os.path.getsize(source)
+        volume_size = self.root_volume_size * 1024 ** 3
+        if image_size > volume_size:
+            msg = 'Image %s of %d bytes does not fit a %d GB snapshot' % (
+                source, image_size, self.root_volume_size
+            )
+            raise EC2UploadImgException(msg)
+
+        # Fail before any block is written instead of at registration
+        self._check_image_exists()
+
+        ebs = self._connect_ebs()
+        snapshot_id = ebs.start_snapshot(
+            VolumeSize=self.root_volume_size,
+            Description=self.image_description,
+            Tags=[dict(utils.SNAPSHOT_CREATOR_TAG)]
+        )['SnapshotId']
+        self.log.debug(
+            'Writing %s to snapshot %s with %d workers' % (
+                source, snapshot_id, self.upload_workers
+            )
         )
+
+        snapshot = {'SnapshotId': snapshot_id}
+        try:
+            checksums = self._write_snapshot_blocks(ebs, snapshot_id, source)
+            if not self.aborted:
+                # The snapshot checksum is the checksum of the concatenated
+                # block checksums in block index order
+                aggregated = hashlib.sha256()
+                for index in sorted(checksums):
+                    aggregated.update(base64.b64decode(checksums[index]))
+                ebs.complete_snapshot(
+                    SnapshotId=snapshot_id,
+                    ChangedBlocksCount=len(checksums),
+                    Checksum=base64.b64encode(aggregated.digest()).decode(),
+                    ChecksumAlgorithm='SHA256',
+                    ChecksumAggregationMethod='LINEAR'
+                )
+                self._wait_for_snapshot(snapshot)
+        except Exception:
+            self._remove_snapshot(snapshot_id)
+            raise
+
+        if self.aborted:
+            self._remove_snapshot(snapshot_id)
+            return
+
+        return snapshot
+
+    # ---------------------------------------------------------------------
+    def _write_snapshot_blocks(self, ebs, snapshot_id, source):
+        """Write the blocks of the given local raw image to the given
+           snapshot, up to upload_workers blocks are written concurrently.
+           Return a dictionary of block index to block checksum."""
+        checksums = {}
+        with open(source, 'rb') as image, \
+                ThreadPoolExecutor(max_workers=self.upload_workers) as pool:
+            in_flight = set()
+            block_index = 0
+            while not self.aborted:
+                block_data = image.read(EBS_BLOCK_SIZE)
+                if not block_data:
+                    break
+                # Every block has the full block size, pad the last one
+                block_data = block_data.ljust(EBS_BLOCK_SIZE, b'\0')
+                if self.sparse and block_data == EBS_ZERO_BLOCK:
+                    # Blocks that are not written read as zeros
+                    block_index += 1
+                    continue
+                in_flight.add(pool.submit(
+                    self._put_snapshot_block,
+                    ebs,
+                    snapshot_id,
+                    block_index,
+                    block_data
+                ))
+                block_index += 1
+                # Bound the number of blocks held in memory
+                if len(in_flight) >= 2 * self.upload_workers:
+                    done, in_flight = wait(
+                        in_flight, return_when=FIRST_COMPLETED
+                    )
+                    checksums.update(future.result() for future in done)
+            checksums.update(future.result() for future in in_flight)
+
+        return checksums
+
+    # ---------------------------------------------------------------------
+    def _wait_for_snapshot(self, snapshot):
+        """Wait for the given snapshot to complete"""
         self.log.debug(
             'Waiting for snapshot creation: {}'.format(snapshot['SnapshotId'])
         )
@@ -431,8 +724,6 @@ class EC2ImageUploader(EC2ImgUtils):
                 repeat_count
             )
 
-        return snapshot
-
     # ---------------------------------------------------------------------
     def _create_storage_filesystem(self, device_id):
         """Create an ext3 filesystem on the storage volume"""
@@ -540,6 +831,19 @@ class EC2ImageUploader(EC2ImgUtils):
 
         return 1
 
+    # ---------------------------------------------------------------------
+    def _connect_ebs(self):
+        """Connect to the EBS direct APIs of the current region, the
+           endpoint may be overridden with ebs_endpoint_url"""
+        return boto3.session.Session().client(
+            aws_access_key_id=self.access_key,
+            aws_secret_access_key=self.secret_key,
+            aws_session_token=self.session_token,
+            endpoint_url=self.ebs_endpoint_url,
+            region_name=self.region,
+            service_name='ebs'
+        )
+
     # ---------------------------------------------------------------------
     def _determine_root_device(self):
         """Figure out what the root device should be"""
@@ -563,12 +867,52 @@ class EC2ImageUploader(EC2ImgUtils):
         if self.aborted:
             return
         self.log.debug('Dumping raw image to new target root volume')
-        command = 'dd if=%s/%s of=%s bs=32k' % (image_dir,
-                                                raw_image_name,
-                                                target_root_device)
-        result = self._execute_ssh_command(command)
+        command = 'dd if=%s/%s of=%s %s status=progress' % (
+            image_dir,
+            raw_image_name,
+            target_root_device,
+            self._get_dd_options(target_root_device)
+        )
 
-        return result
+        return self._run_dd(command, target_root_device)
+
+    # ---------------------------------------------------------------------
+    def _get_dd_block_size(self, target_device):
+        """Return the block size of dd writing the target device, by
+           default a multiple of the largest I/O request of the device"""
+        if self.dd_block_size:
+            return self.dd_block_size
+        command = 'cat /sys/block/$(basename $(readlink -f %s))' % (
+            target_device
+        )
+        command += '/queue/max_sectors_kb'
+        stdin, stdout, stderr = self.ssh_client.exec_command(command)
+        try:
+            max_io_size = int(stdout.read().strip()) * 1024
+            block_size = min(
+                max(max_io_size * DD_QUEUE_DEPTH, DD_MIN_BLOCK_SIZE),
+                DD_MAX_BLOCK_SIZE
+            )
+        except ValueError:
+            block_size = DD_DEFAULT_BLOCK_SIZE
+        self.log.debug(
+            'dd block size for %s: %dK' % (target_device, block_size // 1024)
+        )
+
+        return '%dK' % (block_size // 1024)
+
+    # ---------------------------------------------------------------------
+    def _get_dd_options(self, target_device):
+        """Return the options of dd writing the target device, large full
+           blocks written with direct I/O bypassing the page cache"""
+        options = 'bs=%s iflag=fullblock oflag=direct' % (
+            self._get_dd_block_size(target_device)
+        )
+        if self.sparse:
+            # The new target volume reads as zeros, skip writing them
+            options += ' conv=sparse'
+
+        return options
 
     # ---------------------------------------------------------------------
     def _end_ssh_session(self):
@@ -579,6 +923,7 @@ class EC2ImageUploader(EC2ImgUtils):
         self.ssh_client.close()
         del self.ssh_client
         self.ssh_client = None
+        self.transfer = None
 
         return 1
 
@@ -749,6 +1094,97 @@ class EC2ImageUploader(EC2ImgUtils):
 
         return location
 
+    # ---------------------------------------------------------------------
+    def _get_stream_command(self, source, target_device):
+        """Return the remote command that unpacks the image file read from
+           stdin and writes the raw image to the target device"""
+        filename = os.path.basename(source)
+        commands = []
+        for extension, tar_options in STREAM_TAR_OPTIONS.items():
+            if filename.endswith(extension):
+                member = self._get_image_archive_member(source)
+                commands.append('tar %s -f - %s' % (
+                    tar_options, shlex.quote(member)
+                ))
+                filename = member
+                break
+        for extension, decompressor in STREAM_DECOMPRESSORS.items():
+            if filename.endswith(extension):
+                if decompressor:
+                    commands.append(decompressor)
+                break
+        else:
+            msg = 'Unable to stream image file %s, supported are raw ' % source
+            msg += 'images, optionally compressed or in a tar archive'
+            raise EC2UploadImgException(msg)
+
+        dd_command = 'dd of=%s %s' % (
+            target_device, self._get_dd_options(target_device)
+        )
+        if self.inst_user_name != 'root':
+            dd_command = 'sudo %s' % dd_command
+        commands.append(dd_command)
+
+        return ' | '.join(commands)
+
+    # ---------------------------------------------------------------------
+    def _get_image_archive_member(self, source):
+        """Return the name of the raw image, optionally compressed, in the
+           given tar archive"""
+        try:
+            with tarfile.open(source) as archive:
+                for member in archive:
+                    if not member.isfile():
+                        continue
+                    for extension in STREAM_DECOMPRESSORS:
+                        if member.name.endswith(extension):
+                            return member.name
+        except tarfile.TarError as e:
+            msg = 'Unable to read image archive %s: %s' % (source, e)
+            raise EC2UploadImgException(msg)
+
+        msg = 'Unable to find raw image file with .raw extension in %s' % (
+            source
+        )
+        raise EC2UploadImgException(msg)
+
+    # ---------------------------------------------------------------------
+    def _get_transfer_backend(self, sftp_required=False):
+        """Return the transfer backend moving the image data over the SSH
+           connection, with auto the fastest backend is picked by a
+           benchmark, among the SFTP based backends if sftp_required"""
+        if self.transfer:
+            return self.transfer
+        if self.transfer_backend == 'auto':
+            names = [
+                name for name, backend in transfer.TRANSFER_BACKENDS.items()
+                if backend.supports_sftp or not sftp_required
+            ]
+        else:
+            names = [self.transfer_backend]
+        backends = [
+            transfer.get_transfer_backend(
+                name,
+                self.ssh_client,
+                self.inst_user_name,
+                self.ssh_key_private_key_file,
+                timeout=self.channel_timeout,
+                log_callback=self.log,
+                cipher=self.ssh_cipher,
+                compression=self.ssh_compression
+            ) for name in names
+        ]
+        if len(backends) > 1:
+            self.log.debug('Benchmarking transfer backends')
+            self.transfer = transfer.select_transfer_backend(backends)
+            # Keep the choice for the connection of a resumed upload
+            self.transfer_backend = self.transfer.name
+        else:
+            self.transfer = backends[0]
+        self.log.debug('Using transfer backend %s' % self.transfer.name)
+
+        return self.transfer
+
     # ---------------------------------------------------------------------
     def _get_helper_instance(self):
         """Returns handle to running instance"""
@@ -880,13 +1316,10 @@ class EC2ImageUploader(EC2ImgUtils):
         return mount_point
 
     # ---------------------------------------------------------------------
-    def _register_image(self, snapshot):
-        """Register an image from the given snapshot"""
-        if self.aborted:
-            return
+    def _get_register_args(self, snapshot):
+        """Return the arguments of the register_image call for an image
+           backed by the given snapshot"""
         block_device_map = self._create_block_device_map(snapshot)
-        self.log.debug('Registering image')
-
         root_device_name = self._determine_root_device()
         register_args = {
             'Architecture': self.image_arch,
@@ -916,10 +1349,82 @@ class EC2ImageUploader(EC2ImgUtils):
                 imds_version = 'v%s' % imds_version
             register_args['ImdsSupport'] = imds_version
 
+        return register_args
+
+    # ---------------------------------------------------------------------
+    def _get_root_snapshot_id(self, ami_id):
+        """Return the ID of the snapshot backing the root device of the
+           given image"""
+        image = self._connect().describe_images(ImageIds=[ami_id])['Images'][0]
+        for block_map in image.get('BlockDeviceMappings', []):
+            if block_map.get('DeviceName') == image.get('RootDeviceName'):
+                snapshot_id = block_map.get('Ebs', {}).get('SnapshotId')
+                if snapshot_id:
+                    return snapshot_id
+
+        msg = 'Unable to find the root snapshot of image %s' % ami_id
+        raise EC2UploadImgException(msg)
+
+    # ---------------------------------------------------------------------
+    def _get_snapshot_tag_specifications(self):
+        """Return the tag specifications marking the created snapshots as
+           snapshots of ec2uploadimg"""
+        return [
+            {
+                'ResourceType': 'snapshot',
+                'Tags': [dict(utils.SNAPSHOT_CREATOR_TAG)]
+            }
+        ]
+
+    # ---------------------------------------------------------------------
+    def _put_snapshot_block(self, ebs, snapshot_id, block_index, block_data):
+        """Write one block of the snapshot, returns the block index and the
+           base64 encoded SHA256 checksum of the block"""
+        checksum = base64.b64encode(
+            hashlib.sha256(block_data).digest()
+        ).decode()
+        utils.call_with_retry(
+            ebs.put_snapshot_block,
+            retry_codes=EBS_RETRY_ERROR_CODES,
+            SnapshotId=snapshot_id,
+            BlockIndex=block_index,
+            BlockData=block_data,
+            DataLength=len(block_data),
+            Checksum=checksum,
+            ChecksumAlgorithm='SHA256'
+        )
+
+        return block_index, checksum
+
+    # ---------------------------------------------------------------------
+    def _register_image(self, snapshot):
+        """Register an image from the given snapshot"""
+        if self.aborted:
+            return
+        register_args = self._get_register_args(snapshot)
+        self.log.debug('Registering image')
+
         ami = self._connect().register_image(**register_args)
 
         return ami['ImageId']
 
+    # ---------------------------------------------------------------------
+    def _register_image_copy(
+            self, ec2, region, snapshot_id, boot_kernel=None
+    ):
+        """Register and tag an image with the given client of the given
+           region from the copy of the root snapshot with the options of
+           the uploaded image, a paravirtual image boots the given kernel
+           of the region"""
+        register_args = self._get_register_args({'SnapshotId': snapshot_id})
+        if self.image_virt_type == 'paravirtual':
+            register_args['KernelId'] = boot_kernel
+        self.log.debug('Registering image in %s' % region)
+        ami_id = ec2.register_image(**register_args)['ImageId']
+        self._tag_image(ami_id, ec2)
+
+        return ami_id
+
     # ---------------------------------------------------------------------
     def _remove_volume(self, volume):
         """Delete the given volume from EC2"""
@@ -929,6 +1434,100 @@ class EC2ImageUploader(EC2ImgUtils):
 
         return 1
 
+    # ---------------------------------------------------------------------
+    def _remove_snapshot(self, snapshot_id):
+        """Delete the given incomplete snapshot, a failure to delete it is
+           logged and does not hide the error of the upload"""
+        try:
+            self._connect().delete_snapshot(SnapshotId=snapshot_id)
+            self.log.debug('Deleted incomplete snapshot %s' % snapshot_id)
+        except Exception as e:
+            self.log.error(
+                'Unable to delete incomplete snapshot %s: %s' % (
+                    snapshot_id, e
+                )
+            )
+
+    # ---------------------------------------------------------------------
+    def _remove_transcoded_image(self):
+        """Remove the image file created by the transcoding"""
+        if self.transcoded_image_dir:
+            shutil.rmtree(self.transcoded_image_dir, ignore_errors=True)
+            self.transcoded_image_dir = None
+
+    # ---------------------------------------------------------------------
+    def _run_dd(self, command, target_device):
+        """Run the given dd command with status=progress on the helper
+           instance, log the throughput it reports and return the bytes
+           per second written"""
+        if self.aborted:
+            return
+        if self.inst_user_name != 'root':
+            command = 'sudo %s' % command
+        # Run with a pseudo terminal like every other command, sudo may be
+        # configured with requiretty, the terminal merges stderr carrying
+        # the progress into stdout
+        stdin, stdout, stderr = self.ssh_client.exec_command(
+            command, get_pty=True
+        )
+        channel = stdout.channel
+        channel.settimeout(self.channel_timeout)
+        progress = None
+        cmd_error = []
+        output = ''
+        try:
+            while True:
+                data = channel.recv(4096)
+                if not data:
+                    break
+                output += data.decode('utf-8', 'replace')
+                # Progress lines end with a carriage return, the final
+                # statistics with a newline
+                lines = re.split('[\r\n]', output)
+                output = lines.pop()
+                for line in lines:
+                    match = DD_PROGRESS.match(line.strip())
+                    if not match:
+                        if line.strip():
+                            cmd_error.append(line.strip())
+                        continue
+                    progress = (
+                        int(match.group(1)),
+                        float(match.group(2).replace(',', '.'))
+                    )
+                    self.log.debug(
+                        'dd: %.1f GiB written to %s, %.1f MiB/s' % (
+                            progress[0] / 1024 ** 3,
+                            target_device,
+                            progress[0] / max(progress[1], 1e-6) / 1024 ** 2
+                        )
+                    )
+            exit_status = channel.recv_exit_status()
+        except socket.timeout:
+            self._clean_up()
+            msg = 'Channel timeout reached while writing %s' % target_device
+            raise EC2UploadImgException(msg)
+        if exit_status:
+            self._clean_up()
+            msg = 'Execution of "%s" failed with exit status %d' % (
+                command, exit_status
+            )
+            msg += '\n%s' % '\n'.join(cmd_error)
+            raise EC2UploadImgException(msg)
+        if progress:
+            written_bytes, seconds = progress
+            self.dd_throughput = written_bytes / max(seconds, 1e-6)
+            self.log.info(
+                'Wrote %.1f GiB to %s in %.1fs, %.1f MiB/s' % (
+                    written_bytes / 1024 ** 3,
+                    target_device,
+                    seconds,
+                    self.dd_throughput / 1024 ** 2
+                )
+            )
+
+        return self.dd_throughput
+
     # ---------------------------------------------------------------------
     def _set_zone_to_use(self):
         """Set the availability zone to use for all operations"""
@@ -970,13 +1569,39 @@ class EC2ImageUploader(EC2ImgUtils):
                 self.progress_timer.start()
 
     # ---------------------------------------------------------------------
-    def _tag_image(self, ami_id):
-        """Tag the image"""
+    def _stream_image(self, source, target_device):
+        """Send the image file over the SSH connection to the remote
+           commands that unpack it and write it to the target device"""
+        if self.aborted:
+            return
+        command = self._get_stream_command(source, target_device)
+        self.log.debug('Streaming image file: {}'.format(source))
+        self.log.debug('Remote command: {}'.format(command))
+        try:
+            self._get_transfer_backend().stream(
+                source, command, self._transfer_progress
+            )
+            if self.log_level == logging.DEBUG:
+                print()
+        except socket.timeout:
+            self._clean_up()
+            error_msg = 'Channel timeout reached during upload process.'
+            raise EC2UploadImgException(error_msg)
+        except EC2TransferException as e:
+            self._clean_up()
+            raise EC2UploadImgException(str(e)) from e
+        except Exception as e:
+            self._clean_up()
+            raise e
+
+    # ---------------------------------------------------------------------
+    def _tag_image(self, ami_id, ec2=None):
+        """Tag the image, using the given connection if any"""
 
         if self.image_tags:
             self.log.debug('Applying tags')
             try:
-                self._connect().create_tags(
+                (ec2 or self._connect()).create_tags(
                     Resources=[ami_id], Tags=self.image_tags
                 )
             except botocore.exceptions.ParamValidationError:
@@ -987,31 +1612,424 @@ class EC2ImageUploader(EC2ImgUtils):
 
     # ---------------------------------------------------------------------
     def _upload_image(self, target_dir, source):
-        """Upload the source file to the instance"""
+        """Upload the source file to the instance, an upload interrupted by
+           a connection failure is resumed over a new connection"""
 
         if self.aborted:
             return
         filename = source.split(os.sep)[-1]
-        sftp = self.ssh_client.open_sftp()
+        target = '%s/%s' % (target_dir, filename)
+        self.log.debug('Uploading image file: {}'.format(source))
+        self.acknowledged_chunks = None
+        attempt = 0
+        while True:
+            try:
+                if attempt:
+                    self._resume_upload(source, target)
+                else:
+                    self._send_image(source, target)
+                break
+            except UPLOAD_RESUME_ERRORS as e:
+                attempt += 1
+                if self.aborted or attempt > self.upload_resume_attempts:
+                    self._clean_up()
+                    if isinstance(e, socket.timeout):
+                        error_msg = 'Channel timeout reached during upload '
+                        error_msg += 'process.'
+                        raise EC2UploadImgException(error_msg)
+                    error_msg = 'Upload of %s failed: %s' % (filename, e)
+                    raise EC2UploadImgException(error_msg) from e
+                self.log.warning(
+                    'Upload of %s interrupted (%s), resuming' % (
+                        filename, e or type(e).__name__
+                    )
+                )
+                self._end_ssh_session()
+                self._establish_ssh_connection()
+            except EC2TransferException as e:
+                self._clean_up()
+                raise EC2UploadImgException(str(e)) from e
+            except Exception as e:
+                self._clean_up()
+                raise e
+        if self.log_level == logging.DEBUG:
+            print()
+
+        return filename
+
+    # ---------------------------------------------------------------------
+    def _send_image(self, source, target):
+        """Send the source file to the target path on the instance. The
+           sparse and chunked uploads use the SFTP sessions of the transfer
+           backend, a backend without SFTP sends the complete file."""
+        sparse = self.sparse and source.endswith('.raw')
+        chunked = self.upload_channels > 1
+        backend = None
+        if self.transfer_backend != 'paramiko':
+            backend = self._get_transfer_backend(
+                sftp_required=sparse or chunked
+            )
+        if backend and not (backend.supports_sftp and (sparse or chunked)):
+            if sparse and not backend.supports_sftp:
+                self.log.warning(
+                    'The %s transfer backend sends the complete image, '
+                    'the sparse upload is skipped' % backend.name
+                )
+            backend.upload(source, target, self._transfer_progress)
+            return
+        sftp = self._open_sftp(self.ssh_client)
         try:
             sftp.get_channel().settimeout(self.channel_timeout)
-            self.log.debug('Uploading image file: {}'.format(source))
-            sftp.put(source,
-                     '%s/%s' % (target_dir, filename),
-                     self._upload_progress)
-            if self.log_level == logging.DEBUG:
-                print()
-        except socket.timeout:
-            self._clean_up()
-            error_msg = 'Channel timeout reached during upload process.'
-            raise EC2UploadImgException(error_msg)
-        except Exception as e:
-            self._clean_up()
-            raise e
+            if sparse and chunked:
+                self._upload_image_chunked(
+                    sftp,
+                    source,
+                    target,
+                    utils.find_data_extents(source)
+                )
+            elif sparse:
+                self._upload_sparse_image(sftp, source, target)
+            elif chunked:
+                self._upload_image_chunked(
+                    sftp,
+                    source,
+                    target,
+                    [(0, os.path.getsize(source))]
+                )
+            else:
+                sftp.put(source, target, self._upload_progress)
         finally:
             sftp.close()
 
-        return filename
+    # ---------------------------------------------------------------------
+    def _resume_upload(self, source, target):
+        """Continue the interrupted upload of the source file with the
+           chunked upload. The chunks the chunked upload acknowledged are
+           kept, after the other upload methods the chunks the target file
+           already covers are kept if their remote checksum matches."""
+        if self.sparse and source.endswith('.raw'):
+            extents = utils.find_data_extents(source)
+        else:
+            extents = [(0, os.path.getsize(source))]
+        if self.transfer_backend != 'paramiko':
+            self._get_transfer_backend(sftp_required=True)
+        sftp = self._open_sftp(self.ssh_client)
+        try:
+            sftp.get_channel().settimeout(self.channel_timeout)
+            try:
+                remote_size = sftp.stat(target).st_size
+            except FileNotFoundError:
+                remote_size = None
+                self.acknowledged_chunks = None
+            if remote_size is not None and self.acknowledged_chunks is None:
+                self.acknowledged_chunks = set(
+                    self._verify_uploaded_chunks(
+                        source, target, extents, remote_size
+                    )
+                )
+            pending = utils.subtract_extents(
+                extents, self.acknowledged_chunks or []
+            )
+            self.log.info(
+                'Resuming upload of %s, %d of %d bytes left' % (
+                    source,
+                    sum(length for offset, length in pending),
+                    sum(length for offset, length in extents)
+                )
+            )
+            self._upload_image_chunked(
+                sftp,
+                source,
+                target,
+                pending,
+                resume=remote_size is not None
+            )
+        finally:
+            sftp.close()
+
+    # ---------------------------------------------------------------------
+    def _verify_uploaded_chunks(self, source, target, extents, remote_size):
+        """Return the (offset, length) chunks of the given extents within
+           the first remote_size bytes whose remote checksum matches the
+           source"""
+        verified = []
+        with open(source, 'rb') as image:
+            for offset, length in extents:
+                end = min(offset + length, remote_size)
+                for chunk_offset in range(
+                        offset, end, UPLOAD_MIN_CHUNK_SIZE
+                ):
+                    chunk_length = min(
+                        UPLOAD_MIN_CHUNK_SIZE, end - chunk_offset
+                    )
+                    image.seek(chunk_offset)
+                    checksum = hashlib.sha256()
+                    remaining = chunk_length
+                    while remaining:
+                        data = image.read(
+                            min(remaining, utils.SPARSE_BLOCK_SIZE)
+                        )
+                        checksum.update(data)
+                        remaining -= len(data)
+                    remote_checksum = self._get_remote_checksum(
+                        self.ssh_client, target, chunk_offset, chunk_length
+                    )
+                    if remote_checksum == checksum.hexdigest():
+                        verified.append((chunk_offset, chunk_length))
+
+        return verified
+
+    # ---------------------------------------------------------------------
+    def _upload_sparse_image(self, sftp, source, target):
+        """Upload only the data extents of the raw source image, the
+           target file is written at the extent offsets and is sparse"""
+        extents = utils.find_data_extents(source)
+        image_size = os.path.getsize(source)
+        data_size = sum(length for offset, length in extents)
+        self.log.debug(
+            'Uploading %d of %d bytes in %d extents' % (
+                data_size, image_size, len(extents)
+            )
+        )
+        transferred = 0
+        with open(source, 'rb') as image, sftp.open(target, 'wb') as remote:
+            remote.set_pipelined(True)
+            for offset, length in extents:
+                image.seek(offset)
+                remote.seek(offset)
+                while length:
+                    if self.aborted:
+                        # Leave the partial file as it is, the upload is
+                        # neither complete nor sparse
+                        return
+                    data = image.read(min(length, utils.SPARSE_BLOCK_SIZE))
+                    remote.write(data)
+                    length -= len(data)
+                    transferred += len(data)
+                    self._upload_progress(transferred, data_size)
+            remote.truncate(image_size)
+
+    # ---------------------------------------------------------------------
+    def _get_remote_checksum(self, ssh_client, target, offset, length):
+        """Return the SHA256 checksum of the given range of the remote
+           file"""
+        command = 'dd if=%s bs=1M skip=%d count=%d ' % (
+            shlex.quote(target), offset, length
+        )
+        command += 'iflag=skip_bytes,count_bytes status=none | sha256sum'
+        stdin, stdout, stderr = ssh_client.exec_command(command)
+        checksum = stdout.read().decode('utf-8').split()
+        if stdout.channel.recv_exit_status() or not checksum:
+            msg = 'Unable to verify range %d+%d of %s: %s' % (
+                offset, length, target, stderr.read().decode('utf-8')
+            )
+            raise EC2UploadImgException(msg)
+
+        return checksum[0]
+
+    # ---------------------------------------------------------------------
+    def _open_sftp(self, ssh_client):
+        """Open an SFTP session on the given SSH connection with the
+           settings of the transfer backend, if it is SFTP based"""
+        if self.transfer and self.transfer.supports_sftp:
+            return self.transfer.open_sftp(ssh_client)
+
+        return ssh_client.open_sftp()
+
+    # ---------------------------------------------------------------------
+    def _open_ssh_client(self):
+        """Open an additional SSH connection to the helper instance"""
+        client = paramiko.client.SSHClient()
+        client.set_missing_host_key_policy(paramiko.WarningPolicy())
+        client.connect(
+            key_filename=self.ssh_key_private_key_file,
+            username=self.inst_user_name,
+            hostname=self.ssh_client.get_transport().getpeername()[0],
+            timeout=self.ssh_timeout,
+            banner_timeout=self.ssh_timeout,
+            auth_timeout=self.ssh_timeout
+        )
+
+        return client
+
+    # ---------------------------------------------------------------------
+    def _upload_chunks(self, source, target, chunks, progress, sent):
+        """Write chunks taken from the queue to the remote file over an own
+           SSH connection and verify each of them with the remote checksum,
+           failed chunks are put back into the queue. Returns when the
+           queue is empty or the connection failed."""
+        ssh_client = None
+        remote = None
+        try:
+            try:
+                ssh_client = self._open_ssh_client()
+                sftp = self._open_sftp(ssh_client)
+                sftp.get_channel().settimeout(self.channel_timeout)
+                remote = sftp.open(target, 'r+b')
+                remote.set_pipelined(True)
+            except Exception as e:
+                # The helper may limit the number of sessions, the remaining
+                # connections upload the chunks
+                self.log.debug('Unable to open upload channel: %s' % e)
+                return
+            with open(source, 'rb') as image:
+                while not self.aborted:
+                    try:
+                        offset, length, attempt = chunks.get_nowait()
+                    except queue.Empty:
+                        return
+                    try:
+                        image.seek(offset)
+                        remote.seek(offset)
+                        checksum = hashlib.sha256()
+                        remaining = length
+                        while remaining and not self.aborted:
+                            data = image.read(
+                                min(remaining, utils.SPARSE_BLOCK_SIZE)
+                            )
+                            checksum.update(data)
+                            remote.write(data)
+                            sent(len(data))
+                            remaining -= len(data)
+                        # The server handles the requests of the channel in
+                        # order, the stat reply follows the written data
+                        remote.flush()
+                        remote.stat()
+                        remote_checksum = self._get_remote_checksum(
+                            ssh_client, target, offset, length
+                        )
+                        if remote_checksum != checksum.hexdigest():
+                            raise EC2UploadImgException(
+                                'Checksum mismatch for range %d+%d' % (
+                                    offset, length
+                                )
+                            )
+                        with self.acknowledged_lock:
+                            self.acknowledged_chunks.add((offset, length))
+                        progress(length)
+                    except Exception as e:
+                        if attempt + 1 >= UPLOAD_CHUNK_ATTEMPTS:
+                            raise
+                        self.log.debug(
+                            'Retrying range %d+%d: %s' % (offset, length, e)
+                        )
+                        chunks.put((offset, length, attempt + 1))
+                        if isinstance(e, (OSError, paramiko.SSHException)):
+                            # Leave the chunk to a working connection
+                            return
+        finally:
+            if remote:
+                remote.close()
+            if ssh_client:
+                ssh_client.close()
+
+    # ---------------------------------------------------------------------
+    def _upload_image_chunked(
+            self, sftp, source, target, extents, resume=False
+    ):
+        """Upload the given (offset, length) extents of the source to the
+           target file with offset writes over up to upload_channels SSH
+           connections, opened one after another while they raise the
+           throughput. The extents are split into chunks that are
+           verified with a remote checksum after writing. With resume the
+           existing target file is kept."""
+        image_size = os.path.getsize(source)
+        data_size = sum(length for offset, length in extents)
+        chunk_size = max(
+            UPLOAD_MIN_CHUNK_SIZE,
+            -(-data_size // (4 * self.upload_channels))
+        )
+        chunks = queue.Queue()
+        for offset, length in extents:
+            for chunk_offset in range(offset, offset + length, chunk_size):
+                chunks.put((
+                    chunk_offset,
+                    min(chunk_size, offset + length - chunk_offset),
+                    0
+                ))
+        channels = max(1, min(self.upload_channels, chunks.qsize()))
+        self.log.debug(
+            'Uploading %d bytes in %d chunks over up to %d channels' % (
+                data_size, chunks.qsize(), channels
+            )
+        )
+        if self.acknowledged_chunks is None:
+            self.acknowledged_chunks = set()
+        if resume:
+            sftp.truncate(target, image_size)
+        else:
+            with sftp.open(target, 'wb') as remote:
+                remote.truncate(image_size)
+
+        progress_lock = threading.Lock()
+        transferred = [0]
+        written = [0]
+
+        def progress(length):
+            with progress_lock:
+                transferred[0] += length
+                self._upload_progress(transferred[0], data_size)
+
+        def sent(length):
+            with progress_lock:
+                written[0] += length
+
+        with ThreadPoolExecutor(max_workers=channels) as pool:
+            # Start with one connection and add the next one while the
+            # previous one raised the throughput, the link or the helper
+            # instance may be saturated well below upload_channels
+            uploads = []
+            running = set()
+            interval_bytes = 0
+            while len(uploads) < channels and not self.aborted:
+                upload = pool.submit(
+                    self._upload_chunks, source, target, chunks, progress,
+                    sent
+                )
+                uploads.append(upload)
+                running.add(upload)
+                with progress_lock:
+                    interval_start = written[0]
+                done, running = wait(
+                    running,
+                    timeout=UPLOAD_RAMP_INTERVAL,
+                    return_when=FIRST_COMPLETED
+                )
+                if done:
+                    if chunks.empty():
+                        break
+                    # A refused connection is replaced right away
+                    continue
+                with progress_lock:
+                    upload_bytes = written[0] - interval_start
+                if (
+                        interval_bytes and
+                        upload_bytes < interval_bytes * UPLOAD_RAMP_MIN_GAIN
+                ):
+                    self.log.debug(
+                        'Throughput saturated at %d upload channels' % len(
+                            running
+                        )
+                    )
+                    break
+                interval_bytes = upload_bytes
+            for upload in uploads:
+                upload.result()
+
+        if not self.aborted and not chunks.empty():
+            msg = 'Unable to upload %d chunks of %s, no upload channel ' % (
+                chunks.qsize(), source
+            )
+            msg += 'left'
+            raise ConnectionError(msg)
+
+    # ---------------------------------------------------------------------
+    def _transfer_progress(self, transferred_bytes, total_bytes):
+        """Progress callback of the transfer backends, ends the transfer
+           when the upload is aborted"""
+        if self.aborted:
+            raise EC2UploadImgException('Upload aborted')
+        self._upload_progress(transferred_bytes, total_bytes)
 
     # ---------------------------------------------------------------------
     def _upload_progress(self, transferred_bytes, total_bytes):
@@ -1025,6 +2043,31 @@ class EC2ImageUploader(EC2ImgUtils):
 
         return 1
 
+    # ---------------------------------------------------------------------
+    def _transcode_image(self, source):
+        """Recompress the source image locally with zstd, which the helper
+           instance inflates considerably faster than xz, at the given
+           compression level or the level tuned to the given link_bandwidth
+           in bytes per second. Return the file to upload."""
+        if (
+                self.aborted or
+                not self.transcode or
+                not transcode.is_transcodable(source)
+        ):
+            return source
+        self.transcoded_image_dir = tempfile.mkdtemp(prefix='ec2uploadimg-')
+        try:
+            return transcode.transcode_image(
+                source,
+                self.transcoded_image_dir,
+                level=self.transcode_level,
+                bandwidth=self.link_bandwidth,
+                log_callback=self.log
+            )
+        except EC2TranscodeException as e:
+            self._remove_transcoded_image()
+            raise EC2UploadImgException(str(e)) from e
+
     # ---------------------------------------------------------------------
     def _unpack_image(self, image_dir, image_filename):
         """Unpack the uploaded image file"""
@@ -1040,7 +2083,7 @@ class EC2ImageUploader(EC2ImgUtils):
                                                 image_dir,
                                                 image_filename)
             files = self._execute_ssh_command(command).split('\r\n')
-        elif image_filename[-2:] == 'xz':
+        elif image_filename.endswith(tuple(UNPACK_DECOMPRESSORS)):
             files = [image_filename]
         elif image_filename[-3:] == 'raw':
             raw_image_file = image_filename
@@ -1048,14 +2091,18 @@ class EC2ImageUploader(EC2ImgUtils):
         if files:
             # Find the disk image
             for fl in files:
-                if fl.strip()[-2:] == 'xz':
-                    self.log.debug('Inflating image: {}'.format(fl))
-                    command = 'xz -d %s/%s' % (image_dir, fl)
-                    self._execute_ssh_command(command)
-                    raw_image_file = fl.strip()[:-3]
+                fl = fl.strip()
+                for extension, decompressor in UNPACK_DECOMPRESSORS.items():
+                    if fl.endswith(extension):
+                        self.log.debug('Inflating image: {}'.format(fl))
+                        command = '%s %s/%s' % (decompressor, image_dir, fl)
+                        self._execute_ssh_command(command)
+                        raw_image_file = fl[:-len(extension)]
+                        break
+                if raw_image_file:
                     break
-                if fl.strip()[-4:] == '.raw':
-                    raw_image_file = fl.strip()
+                if fl[-4:] == '.raw':
+                    raw_image_file = fl
                     break
         if not raw_image_file:
             self._clean_up()
@@ -1064,6 +2111,120 @@ class EC2ImageUploader(EC2ImgUtils):
 
         return raw_image_file
 
+    # ---------------------------------------------------------------------
+    def _wait_for_snapshot_copies(
+            self, clients, snapshot_copies, results, boot_kernels=None
+    ):
+        """Wait for the given region to snapshot ID copies with a single
+           poller using the given region to client mapping and register
+           the image in every region whose copy completed. The poll delay
+           starts short, backs off while no copy changes state and resets
+           when one does. Copies still pending on abort or after
+           copy_timeout seconds are deleted. The outcome for each region
+           is stored in results."""
+        pending = dict(snapshot_copies)
+        delay = self.copy_min_delay
+        deadline = time.time() + self.copy_timeout
+        while pending and not self.aborted and time.time() < deadline:
+            time.sleep(min(delay, max(0, deadline - time.time())))
+            state_changed = False
+            for region, snapshot_id in list(pending.items()):
+                try:
+                    state = clients[region].describe_snapshots(
+                        SnapshotIds=[snapshot_id]
+                    )['Snapshots'][0]['State']
+                    if state == 'pending':
+                        continue
+                    del pending[region]
+                    state_changed = True
+                    if state != 'completed':
+                        raise EC2UploadImgException(
+                            'Snapshot copy %s is in state %s' % (
+                                snapshot_id, state
+                            )
+                        )
+                    ami_id = self._register_image_copy(
+                        clients[region],
+                        region,
+                        snapshot_id,
+                        (boot_kernels or {}).get(region)
+                    )
+                    self.log.info('Copied image to %s: %s' % (region, ami_id))
+                    results[region] = (ami_id, None)
+                except Exception as e:
+                    pending.pop(region, None)
+                    state_changed = True
+                    results[region] = (None, e)
+            if state_changed:
+                delay = self.copy_min_delay
+            else:
+                delay = min(2 * delay, self.copy_max_delay)
+
+        for region, snapshot_id in pending.items():
+            if self.aborted:
+                msg = 'Upload aborted, snapshot copy %s in %s ' % (
+                    snapshot_id, region
+                )
+            else:
+                msg = 'Snapshot copy %s in %s did not complete within ' % (
+                    snapshot_id, region
+                )
+                msg += '%d seconds, ' % self.copy_timeout
+            try:
+                clients[region].delete_snapshot(SnapshotId=snapshot_id)
+                msg += 'deleted, no image registered'
+            except Exception as e:
+                msg += 'could not be deleted and is left behind: %s' % e
+            self.log.error(msg)
+            results[region] = (None, EC2UploadImgException(msg))
+
+    # ---------------------------------------------------------------------
+    def copy_image_to_regions(self, ami_id, regions, boot_kernels=None):
+        """Copy the root snapshot of the given image to the given regions
+           and register an image with the same options and tags in every
+           region. Kernel IDs are region specific, a paravirtual image is
+           registered with the kernel of the region given in the
+           boot_kernels dictionary, regions without one are not copied to.
+           The copies run concurrently and are waited on by a single
+           poller. Returns a dictionary of region to a tuple of the image
+           ID and the error, if any."""
+        results = {}
+        if self.aborted or not regions:
+            return results
+        snapshot_id = self._get_root_snapshot_id(ami_id)
+        boot_kernels = boot_kernels or {}
+
+        clients = {}
+        snapshot_copies = {}
+        for region in regions:
+            if (
+                    self.image_virt_type == 'paravirtual' and
+                    not boot_kernels.get(region)
+            ):
+                msg = 'No boot kernel for the paravirtual image in region %s'
+                results[region] = (None, EC2UploadImgException(msg % region))
+                continue
+            try:
+                clients[region] = self._connect(region)
+                snapshot_copies[region] = clients[region].copy_snapshot(
+                    SourceRegion=self.region,
+                    SourceSnapshotId=snapshot_id,
+                    Description=self.image_description,
+                    TagSpecifications=self._get_snapshot_tag_specifications()
+                )['SnapshotId']
+                self.log.debug(
+                    'Copying snapshot %s to %s: %s' % (
+                        snapshot_id, region, snapshot_copies[region]
+                    )
+                )
+            except Exception as e:
+                results[region] = (None, e)
+
+        self._wait_for_snapshot_copies(
+            clients, snapshot_copies, results, boot_kernels
+        )
+        return results
+
     # ---------------------------------------------------------------------
     def create_image(self, source):
         """Create an AMI (Amazon Machine Image) from the given source"""
@@ -1168,7 +2329,8 @@ class EC2ImageUploader(EC2ImgUtils):
             InstanceId=self.helper_instance['InstanceId'],
             Name=self.image_name,
             Description=self.image_description,
-            NoReboot=True
+            NoReboot=True,
+            TagSpecifications=self._get_snapshot_tag_specifications()
         )
 
         self.log.debug('Waiting for new image creation')
@@ -1208,6 +2370,8 @@ class EC2ImageUploader(EC2ImgUtils):
     # ---------------------------------------------------------------------
     def create_snapshot(self, source):
         """Create a snapshot from the given source"""
+        if self.use_ebs_direct:
+            return self._create_snapshot_ebs_direct(source)
         if self.log_level == logging.DEBUG:
             print()
         root_volume = self._create_image_root_volume(source)
@@ -17,11 +17,18 @@
 
 import boto3
 import configparser
+import datetime
+import errno
 import logging
+import mmap
 import os
+import random
 import re
 import sys
+import time
 
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
 from itertools import repeat
 
 from ec2imgutils.ec2imgutilsExceptions import (
@@ -29,6 +36,147 @@ from ec2imgutils.ec2imgutilsExceptions import (
     EC2ConfigFileParseException
 )
 
+# Launch permission targets besides 12 digit account numbers
+ORGANIZATION_ARN_EXP = (
+    r'^arn:aws[a-z-]*:organizations::\d{12}:organization/o-[a-z0-9]{10,32}$'
+)
+ORGANIZATIONAL_UNIT_ARN_EXP = (
+    r'^arn:aws[a-z-]*:organizations::\d{12}:ou/o-[a-z0-9]{10,32}/'
+    r'ou-[a-z0-9]{4,32}-[a-z0-9]{8,32}$'
+)
+# Date and version parts of image names, stripped to get the image family
+IMAGE_VERSION_EXP = re.compile(
+    r'[-_.]v?(\d{8}(\d{4,6})?|\d{4}[-.]\d{2}[-.]\d{2})(?=[-_.]|$)|'
+    r'[-_.]v\d+(\.\d+)*(?=[-_.]|$)'
+)
+# Kinds of image selectors, KIND=VALUE, and the image criteria they match
+SELECTOR_KINDS = ('id', 'name', 'fragment', 'regex')
+# Tag ec2uploadimg puts on the snapshots it creates, the orphaned snapshot
+# removal of ec2removeimg is limited to snapshots carrying it
+SNAPSHOT_CREATOR_TAG = {
+    'Key': 'ec2imgutils:created-by',
+    'Value': 'ec2uploadimg'
+}
+# Granularity of the zero block detection in image files
+SPARSE_BLOCK_SIZE = 64 * 1024
+# Error codes EC2 uses to signal that requests are being throttled
+THROTTLE_ERROR_CODES = (
+    'RequestLimitExceeded',
+    'Throttling',
+    'ThrottlingException',
+    'TooManyRequestsException'
+)
+
+
+# ----------------------------------------------------------------------------
+def call_with_retry(
+        api_call,
+        retry_codes=THROTTLE_ERROR_CODES,
+        retries=6,
+        delay=1,
+        **kwargs
+):
+    """Call the given API function with the given keyword arguments. If the
+       call fails with one of the given error codes retry it with an
+       exponentially growing, jittered delay."""
+    attempt = 0
+    while True:
+        try:
+            return api_call(**kwargs)
+        except ClientError as e:
+            error_code = e.response.get('Error', {}).get('Code')
+            if error_code not in retry_codes or attempt >= retries:
+                raise
+        time.sleep(delay * (2 ** attempt) * random.uniform(0.5, 1.0))
+        attempt += 1
+
+
+# ----------------------------------------------------------------------------
+def chunks(items, chunk_size):
+    """Split the given list into lists of at most chunk_size items"""
+    for start in range(0, len(items), chunk_size):
+        yield items[start:start + chunk_size]
+
+
+# ----------------------------------------------------------------------------
+def _get_allocated_ranges(fd, size):
+    """Yield the (start, end) ranges of the given file that hold data
+       according to SEEK_DATA/SEEK_HOLE, the whole file if the OS or the
+       file system does not support them"""
+    if not hasattr(os, 'SEEK_DATA'):
+        yield 0, size
+        return
+    offset = 0
+    while offset < size:
+        try:
+            data_start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # No data after offset
+                return
+            yield offset, size
+            return
+        data_end = min(os.lseek(fd, data_start, os.SEEK_HOLE), size)
+        yield data_start, data_end
+        offset = data_end
+
+
+# ----------------------------------------------------------------------------
+def find_data_extents(path, block_size=SPARSE_BLOCK_SIZE):
+    """Return the list of (offset, length) extents of the given file that
+       contain data. Holes are skipped with SEEK_DATA/SEEK_HOLE and blocks
+       of zeros within the allocated ranges are skipped as well, they are
+       compared against a zero block of block_size bytes with memcmp over
+       the memory mapped file."""
+    size = os.path.getsize(path)
+    extents = []
+    if not size:
+        return extents
+    zero_block = bytes(block_size)
+    scanned = 0
+    with open(path, 'rb') as image, \
+            mmap.mmap(image.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for start, end in _get_allocated_ranges(image.fileno(), size):
+            # Zero detection is aligned to block boundaries, a block shared
+            # with the previous range is scanned once
+            offset = max(start - start % block_size, scanned)
+            while offset < end:
+                block_end = min(offset + block_size, size)
+                if data[offset:block_end] != zero_block[:block_end - offset]:
+                    if extents and extents[-1][0] + extents[-1][1] == offset:
+                        extents[-1] = (
+                            extents[-1][0], block_end - extents[-1][0]
+                        )
+                    else:
+                        extents.append((offset, block_end - offset))
+                offset = block_end
+            scanned = offset
+
+    return extents
+
+
+# ----------------------------------------------------------------------------
+def subtract_extents(extents, removed):
+    """Return the parts of the given (offset, length) extents that are not
+       covered by the removed (offset, length) ranges"""
+    remaining = []
+    removed = sorted(removed)
+    for offset, length in extents:
+        end = offset + length
+        for removed_offset, removed_length in removed:
+            removed_end = removed_offset + removed_length
+            if removed_end <= offset or removed_offset >= end:
+                continue
+            if removed_offset > offset:
+                remaining.append((offset, removed_offset - offset))
+            offset = max(offset, removed_end)
+            if offset >= end:
+                break
+        if offset < end:
+            remaining.append((offset, end - offset))
+
+    return remaining
+
 
 # ----------------------------------------------------------------------------
 def find_images_by_id(images, image_id):
@@ -89,6 +237,73 @@ def find_images_by_name_regex_match(images, image_name_regex, log_callback):
     return matching_images
 
 
+# ----------------------------------------------------------------------------
+def find_images_by_selectors(images, selectors, log_callback):
+    """Return a list of images that match any of the given (kind, value)
+       selectors, evaluated in a single pass over the images. The first
+       selector that matches an image is recorded as "kind=value" in the
+       Selector entry of the image."""
+    matchers = []
+    for kind, value in selectors:
+        if kind not in SELECTOR_KINDS:
+            raise ValueError('Unknown image selector "%s"' % kind)
+        if kind == 'regex':
+            value = re.compile(value)
+        matchers.append((kind, value))
+    match_names = [kind for kind, value in matchers if kind != 'id']
+
+    matching_images = []
+    for image in images:
+        image_name = image.get('Name')
+        for (kind, value), (_, selector_value) in zip(matchers, selectors):
+            if kind == 'id':
+                matched = image['ImageId'] == value
+            elif not image_name:
+                continue
+            elif kind == 'name':
+                matched = image_name == value
+            elif kind == 'fragment':
+                matched = image_name.find(value) != -1
+            else:
+                matched = bool(value.match(image_name))
+            if matched:
+                image['Selector'] = '%s=%s' % (kind, selector_value)
+                matching_images.append(image)
+                break
+        else:
+            if match_names and not image_name:
+                _no_name_warning(image, log_callback)
+
+    return matching_images
+
+
+# ----------------------------------------------------------------------------
+def find_images_by_removal_date(images, removal_date, log_callback):
+    """Return a list of images tagged with a "Removal date" that is on or
+       before the given date, the date is expected in the YYYYMMDD format."""
+    matching_images = []
+    for image in images:
+        for tag in image.get('Tags', []):
+            if tag.get('Key') != 'Removal date':
+                continue
+            try:
+                image_removal_date = datetime.datetime.strptime(
+                    tag.get('Value', ''),
+                    '%Y%m%d'
+                )
+            except ValueError:
+                msg = 'WARNING: Found image with invalid "Removal date" tag '
+                msg += '"%s", ignoring for search results. ' % tag.get('Value')
+                msg += 'Image ID: %s' % image['ImageId']
+                log_callback.info(msg)
+                break
+            if image_removal_date <= removal_date:
+                matching_images.append(image)
+            break
+
+    return matching_images
+
+
 # -----------------------------------------------------------------------------
 def generate_config_account_name(account):
     """Generate the name of an account as it expected in the configuration"""
@@ -256,6 +471,131 @@ def validate_account_numbers(share_with):
     return False
 
 
+# ----------------------------------------------------------------------------
+def parse_selector(selector):
+    """Return the (kind, value) tuple for the given KIND=VALUE image
+       selector or None if the selector is not valid"""
+    kind, separator, value = selector.partition('=')
+    if not separator or not value or kind not in SELECTOR_KINDS:
+        return None
+    if kind == 'regex':
+        try:
+            re.compile(value)
+        except re.error:
+            return None
+
+    return (kind, value)
+
+
+# ----------------------------------------------------------------------------
+def _get_share_targets(share_with):
+    """Split the given comma separated share list into the unique account
+       numbers, organization ARNs and organizational unit ARNs in the
+       order given"""
+    accounts = []
+    organization_arns = []
+    organizational_unit_arns = []
+    for target in dict.fromkeys(filter(None, share_with.split(','))):
+        if re.match(ORGANIZATION_ARN_EXP, target):
+            organization_arns.append(target)
+        elif re.match(ORGANIZATIONAL_UNIT_ARN_EXP, target):
+            organizational_unit_arns.append(target)
+        else:
+            accounts.append(target)
+
+    return accounts, organization_arns, organizational_unit_arns
+
+
+# ----------------------------------------------------------------------------
+def get_share_permissions(share_with):
+    """Return the list of launch permissions for the given comma separated
+       list of account numbers, organization ARNs and organizational unit
+       ARNs, duplicate entries are dropped"""
+    accounts, organization_arns, organizational_unit_arns = (
+        _get_share_targets(share_with)
+    )
+    permissions = [{'UserId': account} for account in accounts]
+    permissions += [{'OrganizationArn': arn} for arn in organization_arns]
+    permissions += [
+        {'OrganizationalUnitArn': arn} for arn in organizational_unit_arns
+    ]
+
+    return permissions
+
+
+# ----------------------------------------------------------------------------
+def validate_share_list(share_with):
+    """Return True if the given comma separated list only contains 12 digit
+       account numbers, organization ARNs and organizational unit ARNs"""
+    accounts, organization_arns, organizational_unit_arns = (
+        _get_share_targets(share_with)
+    )
+    if accounts:
+        return validate_account_numbers(','.join(accounts))
+    return bool(organization_arns or organizational_unit_arns)
+
+
+# ----------------------------------------------------------------------------
+def query_yes_no(question):
+    """Ask the given yes or no question, return True if the answer is
+       yes. An empty answer counts as yes."""
+    yes = {'yes', 'y', 'ye', ''}
+    no = {'no', 'n'}
+
+    while True:
+        choice = input(question).lower()
+        if choice in yes:
+            return True
+        elif choice in no:
+            return False
+        else:
+            sys.stdout.write("Please respond with 'yes' or 'no'\n")
+
+
+# ----------------------------------------------------------------------------
+def run_in_parallel(task, items, max_workers=1):
+    """Call task for every given item using a pool of at most max_workers
+       threads. Return a list of (item, result, error) tuples in the order
+       of the given items, error is None if the task succeeded."""
+    results = []
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(task, item) for item in items]
+        for item, future in zip(items, futures):
+            try:
+                results.append((item, future.result(), None))
+            except Exception as e:
+                results.append((item, None, e))
+
+    return results
+
+
+# ----------------------------------------------------------------------------
+def get_image_family(image_name):
+    """Return the family of the given image name, the name without date
+       and version parts, e.g. suse-sles-15-sp5-v20240101-hvm-ssd-x86_64
+       belongs to the suse-sles-15-sp5-hvm-ssd-x86_64 family"""
+    if not image_name:
+        return '(unnamed)'
+    return IMAGE_VERSION_EXP.sub('', image_name)
+
+
+# ----------------------------------------------------------------------------
+class RegionLoggerAdapter(logging.LoggerAdapter):
+    """Logger adapter that prefixes every message with the region it
+       concerns, the output of concurrently processed regions is
+       interleaved otherwise"""
+
+    def process(self, msg, kwargs):
+        return '%s: %s' % (self.extra['region'], msg), kwargs
+
+
+# ----------------------------------------------------------------------------
+def get_region_logger(logger, region):
+    """Return a logger adapter that prefixes the messages of the given
+       logger with the given region"""
+    return RegionLoggerAdapter(logger, {'region': region})
+
+
 # ----------------------------------------------------------------------------
 def get_logger(verbose):
     """
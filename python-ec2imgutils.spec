@@ -41,6 +41,7 @@ BuildRequires:  python-rpm-macros
 Requires:       %{pythons}-boto3 >= 1.29.84
 Requires:       %{pythons}-dateutil
 Requires:       %{pythons}-paramiko >= 2.2.0
+Recommends:     %{pythons}-zstandard
 %if %{with libalternatives}
 BuildRequires:  alts
 Requires:       alts
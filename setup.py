@@ -46,7 +46,8 @@ if __name__ == '__main__':
         license='GPLv3+',
         install_requires=requirements,
         extras_require={
-            'dev': dev_requirements
+            'dev': dev_requirements,
+            'zstd': ['zstandard']
         },
         author='SUSE Public Cloud Team',
         author_email='public-cloud-dev@susecloud.net',
@@ -0,0 +1,28 @@
+#
+# Copyright (c) 2026 SUSE LLC.  All rights reserved.
+#
+# This file is part of ec2utils
+#
+# ec2utils is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# ec2utils is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ec2utils. If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def journal_cache_dir(tmp_path, monkeypatch):
+    """Keep the run journals written by the tools out of the user's home"""
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    return tmp_path
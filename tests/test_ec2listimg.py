@@ -19,11 +19,12 @@
 # <http://www.gnu.org/licenses/>.
 #
 
+import json
 import logging
 import pytest
 import os
 
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
 
 # Hack to get the script without the .py imported for testing
 from importlib.machinery import SourceFileLoader
@@ -311,6 +312,315 @@ def test_list_images_filtering_by_name_regex(get_owned_images_mock, caplog):
     assert "ami-00fcc31892067693b" in caplog.text
 
 
+@patch('ec2listimg.ec2lsimg.EC2ListImage._get_owned_images')
+def test_list_images_filtering_by_selectors(get_owned_images_mock, caplog):
+    test_cli_args = [
+        "--account",
+        "tester",
+        "--access-id",
+        "testAccId",
+        "--file",
+        data_path + os.sep + 'complete.cfg',
+        "--select",
+        "name=testImageName",
+        "--select",
+        "id=ami-00fcc31892067693b",
+        "--regions",
+        "region1",
+        "--secret-key",
+        "testSecretKey",
+        "--verbose",
+        "1"
+    ]
+    get_owned_images_mock.return_value = mock_get_owned_images()
+    ec2listimg.main(test_cli_args)
+    get_owned_images_mock.assert_called_once_with()
+    assert "ami-00fcc31892067693a\t(name=testImageName)" in caplog.text
+    assert "ami-00fcc31892067693b\t(id=ami-00fcc31892067693b)" in caplog.text
+
+
+def test_invalid_selector(caplog):
+    test_cli_args = [
+        "--account",
+        "tester",
+        "--select",
+        "tag=release"
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2listimg.main(test_cli_args)
+    assert excinfo.value.code == 1
+    assert 'as value of --select, got "tag=release"' in caplog.text
+
+
+@patch('ec2listimg.ec2lsimg.EC2ListImage._connect')
+def test_storage_report(ec2connect_mock, caplog):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+
+    def image(image_id, name, *snapshot_ids):
+        return {
+            'ImageId': image_id,
+            'Name': name,
+            'BlockDeviceMappings': [
+                {'DeviceName': '/dev/sda1', 'Ebs': {'SnapshotId': snap}}
+                for snap in snapshot_ids
+            ] + [{'DeviceName': '/dev/sdb', 'VirtualName': 'ephemeral0'}]
+        }
+
+    pages = {
+        'describe_images': [
+            {'Images': [
+                image('ami-1', 'sles-15-sp5-v20240101-x86_64', 'snap-1'),
+                image('ami-2', 'sles-15-sp5-v20240201-x86_64', 'snap-2')
+            ]},
+            {'Images': [
+                image('ami-3', 'sles-15-sp6-v20240201-x86_64', 'snap-3'),
+                image('ami-4', 'sles-15-sp6-v20240301-x86_64', 'snap-3')
+            ]},
+            {'Images': [
+                image('ami-5', 'sles-15-sp5-v20240301-x86_64', 'snap-2')
+            ]}
+        ],
+        'describe_snapshots': [
+            {'Snapshots': [
+                {'SnapshotId': 'snap-1', 'VolumeSize': 10},
+                {'SnapshotId': 'snap-2', 'VolumeSize': 10}
+            ]},
+            {'Snapshots': [
+                {'SnapshotId': 'snap-3', 'VolumeSize': 30},
+                {'SnapshotId': 'snap-9', 'VolumeSize': 8}
+            ]}
+        ]
+    }
+
+    def paginate(operation, **kwargs):
+        if 'Filters' not in kwargs:
+            return iter(pages[operation])
+        # The snapshots of an image page are read with a snapshot-id filter
+        snapshot_ids = kwargs['Filters'][0]['Values']
+        return iter([{'Snapshots': [
+            snapshot
+            for page in pages[operation]
+            for snapshot in page['Snapshots']
+            if snapshot['SnapshotId'] in snapshot_ids
+        ]}])
+
+    def get_paginator(operation):
+        paginator = MagicMock()
+        paginator.paginate.side_effect = \
+            lambda **kwargs: paginate(operation, **kwargs)
+        return paginator
+    ec2.get_paginator.side_effect = get_paginator
+
+    test_cli_args = [
+        "--account",
+        "tester",
+        "--access-id",
+        "testAccId",
+        "--file",
+        data_path + os.sep + 'complete.cfg',
+        "--regions",
+        "region1",
+        "--secret-key",
+        "testSecretKey",
+        "--storage-report",
+        "--verbose",
+        "1"
+    ]
+    ec2listimg.main(test_cli_args)
+
+    report = dict(
+        (line.split('\t')[0].strip(), line.split('\t')[1:])
+        for line in caplog.messages if '\t' in line
+    )
+    # A snapshot shared by images on different pages counts once
+    assert ['       3', '        2', '      20'] == \
+        report['sles-15-sp5-x86_64']
+    # A snapshot shared by two images counts once
+    assert ['       2', '        1', '      30'] == \
+        report['sles-15-sp6-x86_64']
+    assert ['       0', '        1', '       8'] == report['(unreferenced)']
+    assert ['       5', '        4', '      58'] == report['Total']
+    # Every image is reported as it is read
+    assert '    ami-4\tsles-15-sp6-v20240301-x86_64\t0 snapshots\t0 GiB' in \
+        caplog.messages
+    assert 'Storage report for account: tester' in caplog.text
+
+
+@patch('ec2listimg.ec2lsimg.EC2ListImage._connect')
+def test_permission_audit(ec2connect_mock, tmp_path):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+
+    paginator = MagicMock()
+    paginator.paginate.return_value = iter([
+        {'Images': [
+            {
+                'ImageId': 'ami-1',
+                'Name': 'sles-15-sp5-v20240101-x86_64',
+                'BlockDeviceMappings': [
+                    {'DeviceName': '/dev/sda1',
+                     'Ebs': {'SnapshotId': 'snap-1'}}
+                ]
+            },
+            {
+                'ImageId': 'ami-2',
+                'Name': 'sles-15-sp5-v20240201-x86_64',
+                'BlockDeviceMappings': [
+                    {'DeviceName': '/dev/sda1',
+                     'Ebs': {'SnapshotId': 'snap-1'}}
+                ]
+            }
+        ]}
+    ])
+    ec2.get_paginator.return_value = paginator
+    launch_permissions = {
+        'ami-1': [{'Group': 'all'}],
+        'ami-2': [{'UserId': '123456789012'}]
+    }
+    ec2.describe_image_attribute.side_effect = lambda **kwargs: {
+        'LaunchPermissions': launch_permissions[kwargs['ImageId']]
+    }
+    ec2.describe_snapshot_attribute.return_value = {
+        'CreateVolumePermissions': [{'UserId': '123456789012'}]
+    }
+
+    audit_path = str(tmp_path / 'audit.jsonl')
+    test_cli_args = [
+        "--account",
+        "tester",
+        "--access-id",
+        "testAccId",
+        "--file",
+        data_path + os.sep + 'complete.cfg',
+        "--regions",
+        "region1",
+        "--secret-key",
+        "testSecretKey",
+        "--permission-audit",
+        audit_path
+    ]
+    ec2listimg.main(test_cli_args)
+
+    with open(audit_path) as audit_file:
+        records = [json.loads(line) for line in audit_file]
+    assert ['ami-1', 'ami-2'] == [record['image_id'] for record in records]
+    assert records[0]['public'] is True
+    assert records[1]['public'] is False
+    assert [{'UserId': '123456789012'}] == records[1]['launch_permissions']
+    assert 'tester' == records[0]['account']
+    assert 'region1' == records[0]['region']
+    assert [{
+        'snapshot_id': 'snap-1',
+        'public': False,
+        'create_volume_permissions': [{'UserId': '123456789012'}]
+    }] == records[1]['snapshots']
+    # The snapshot shared by both images is read once
+    assert 1 == ec2.describe_snapshot_attribute.call_count
+
+
+@patch('ec2listimg.ec2lsimg.EC2ListImage._connect')
+def test_permission_audit_stdout_parallel(ec2connect_mock, capsys):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+
+    paginator = MagicMock()
+    paginator.paginate.side_effect = lambda **kwargs: iter([
+        {'Images': [
+            {
+                'ImageId': 'ami-1',
+                'Name': 'sles-15-sp5-v20240101-x86_64',
+                'BlockDeviceMappings': []
+            },
+            {'ImageId': 'ami-2', 'BlockDeviceMappings': []}
+        ]}
+    ])
+    ec2.get_paginator.return_value = paginator
+    ec2.describe_image_attribute.return_value = {'LaunchPermissions': []}
+
+    test_cli_args = [
+        "--account",
+        "tester",
+        "--access-id",
+        "testAccId",
+        "--file",
+        data_path + os.sep + 'complete.cfg',
+        "--regions",
+        "region1,region2",
+        "--secret-key",
+        "testSecretKey",
+        "--image-name-frag",
+        "sles",
+        "--parallel",
+        "2",
+        "--permission-audit",
+        "-"
+    ]
+    ec2listimg.main(test_cli_args)
+
+    captured = capsys.readouterr()
+    # Only the records go to stdout, the log messages go to stderr
+    records = [json.loads(line) for line in captured.out.splitlines()]
+    assert ['region1', 'region2'] == sorted(
+        record['region'] for record in records
+    )
+    assert 'region1: WARNING: Found image with no name' in captured.err
+    assert 'region2: WARNING: Found image with no name' in captured.err
+
+
+@patch('ec2listimg.ec2lsimg.EC2ListImage._connect')
+def test_permission_audit_region_failure(ec2connect_mock, tmp_path, caplog):
+    ec2connect_mock.side_effect = Exception('Region unavailable')
+    test_cli_args = [
+        "--account",
+        "tester",
+        "--access-id",
+        "testAccId",
+        "--file",
+        data_path + os.sep + 'complete.cfg',
+        "--regions",
+        "region1,region2",
+        "--secret-key",
+        "testSecretKey",
+        "--parallel",
+        "2",
+        "--permission-audit",
+        str(tmp_path / 'audit.jsonl')
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2listimg.main(test_cli_args)
+    assert excinfo.value.code == 1
+    assert 'Region region1: Region unavailable' in caplog.text
+    assert 'Region region2: Region unavailable' in caplog.text
+
+
+def test_parallel_arg(caplog):
+    test_cli_args = [
+        "--account",
+        "tester",
+        "--parallel",
+        "0"
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2listimg.main(test_cli_args)
+    assert excinfo.value.code == 1
+    assert 'The value of --parallel must be 1 or larger' in caplog.text
+
+
+def test_permission_audit_with_storage_report(caplog):
+    test_cli_args = [
+        "--account",
+        "tester",
+        "--permission-audit",
+        "-",
+        "--storage-report"
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2listimg.main(test_cli_args)
+    assert excinfo.value.code == 1
+    assert 'are mutually exclusive' in caplog.text
+
+
 # --------------------------------------------------------------------
 # Aux functions
 def mock_get_owned_images():
@@ -223,6 +223,21 @@ def test_share_arguments(cli_args):
     assert excinfo.value.code == 1
 
 
+def test_workers_argument():
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--image-name",
+      "testImageName",
+      "--workers",
+      "0"
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        parsed_args = ec2publishimg.parse_args(cli_args)
+        ec2publishimg.check_required_arguments(parsed_args, logger)
+    assert excinfo.value.code == 1
+
+
 # --------------------------------------------------------------------
 # Tests for config file management functions
 test_cli_args_data = [
@@ -444,7 +459,10 @@ def test_main_constructor_exc(ec2pubimg_mock, caplog):
         image_name=None,
         image_name_fragment=None,
         image_name_match=None,
+        journal=None,
+        max_workers=None,
         secret_key=None,
+        selectors=None,
         visibility=None,
         log_callback=None
     ):
@@ -547,3 +565,112 @@ def test_main_exc2(ec2pubimg_mock, caplog):
         ec2publishimg.main(cli_args)
     assert excinfo.value.code == 1
     assert "EC2PublishImgException" in caplog.text
+
+
+@patch('ec2publishimg.ec2pubimg.EC2PublishImage')
+def test_main_parallel_regions(ec2pubimg_mock, caplog):
+    publishers = {}
+
+    def get_publisher(**kwargs):
+        publisher = MagicMock()
+
+        def set_region(region):
+            publishers[region] = publisher
+            if region == 'region2':
+                publisher.publish_images.side_effect = \
+                    ec2publishimg.EC2PublishImgException('denied')
+        publisher.set_region.side_effect = set_region
+        return publisher
+
+    ec2pubimg_mock.side_effect = get_publisher
+
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--access-id",
+      "testAccId",
+      "--file",
+      data_path + os.sep + 'complete.cfg',
+      "--image-name",
+      "image_name1",
+      "--parallel",
+      "3",
+      "--regions",
+      "region1,region2,region3",
+      "--secret-key",
+      "testSecretKey"
+    ]
+
+    with pytest.raises(SystemExit) as excinfo:
+        ec2publishimg.main(cli_args)
+    assert excinfo.value.code == 1
+    # Every region has its own publisher
+    assert ['region1', 'region2', 'region3'] == sorted(publishers)
+    assert 3 == len(set(id(p) for p in publishers.values()))
+    for publisher in publishers.values():
+        publisher.publish_images.assert_called_once_with()
+    summary = caplog.text[caplog.text.index('Summary:'):]
+    assert summary.index('region1') < summary.index('region2') < \
+        summary.index('region3')
+    assert 'failed: denied' in summary
+    assert 'region1             \tok' in summary
+
+
+@patch('ec2publishimg.ec2pubimg.EC2PublishImage')
+def test_main_parallel_regions_publisher_failure(ec2pubimg_mock, caplog):
+    # The publisher of one of the regions cannot be created
+    ec2pubimg_mock.side_effect = [
+        MagicMock(),
+        ec2publishimg.EC2PublishImgException('Invalid visibility')
+    ]
+
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--access-id",
+      "testAccId",
+      "--file",
+      data_path + os.sep + 'complete.cfg',
+      "--image-name",
+      "image_name1",
+      "--parallel",
+      "2",
+      "--regions",
+      "region1,region2",
+      "--secret-key",
+      "testSecretKey"
+    ]
+
+    with pytest.raises(SystemExit) as excinfo:
+        ec2publishimg.main(cli_args)
+    assert excinfo.value.code == 1
+    summary = caplog.text[caplog.text.index('Summary:'):]
+    assert 'failed: Invalid visibility' in summary
+
+
+def test_parallel_argument():
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--image-name",
+      "testImageName",
+      "--parallel",
+      "0"
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        parsed_args = ec2publishimg.parse_args(cli_args)
+        ec2publishimg.check_required_arguments(parsed_args, logger)
+    assert excinfo.value.code == 1
+
+
+def test_share_with_organization_argument():
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--image-name",
+      "testImageName",
+      "--share-with",
+      "arn:aws:organizations::123456789012:organization/o-abcdef1234"
+    ]
+    parsed_args = ec2publishimg.parse_args(cli_args)
+    ec2publishimg.check_required_arguments(parsed_args, logger)
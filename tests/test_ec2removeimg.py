@@ -19,12 +19,15 @@
 # <http://www.gnu.org/licenses/>.
 #
 
+import datetime
+import json
 import logging
 import pytest
 import io
 import sys
 import os
 
+from botocore.exceptions import ClientError
 from unittest.mock import patch, MagicMock
 
 # Hack to get the script without the .py imported for testing
@@ -153,6 +156,15 @@ def test_image_arguments_absent(cli_args):
     assert excinfo.value.code == 1
 
 
+def test_help_messages(capsys):
+    with pytest.raises(SystemExit):
+        ec2removeimg.parse_args(['--help'])
+    help_text = ' '.join(capsys.readouterr().out.split())
+    assert '--select KIND=VALUE Select images by KIND=VALUE' in help_text
+    assert '--manifest MANIFEST_FILE Remove the images listed' in help_text
+    assert '--orphaned-snapshots Remove snapshots created by' in help_text
+
+
 # --------------------------------------------------------------------
 # Tests for config file management functions
 test_cli_args_data = [
@@ -906,8 +918,721 @@ def test_remove_images_filtering_by_name_match_confirm_no_yes(
     sys.stdin = sys.__stdin__
 
 
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._get_owned_images')
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._connect')
+def test_remove_expired_images(
+    ec2connect_mock,
+    get_owned_imgs_mock,
+    caplog
+):
+    ec2 = MagicMock()
+    ec2.deregister_image.return_value = None
+    ec2.delete_snapshot.return_value = None
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.return_value = mock_get_owned_expired_images()
+
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--access-id",
+      "testAccId",
+      "--expired",
+      "--file",
+      data_path + os.sep + 'complete.cfg',
+      "--parallel",
+      "2",
+      "--regions",
+      "region1,region2",
+      "--secret-key",
+      "testSecretKey"
+    ]
+    ec2removeimg.main(cli_args)
+    assert ec2.deregister_image.call_count == 2
+    ec2.deregister_image.assert_called_with(ImageId='ami-000cc31892067693a')
+    ec2.delete_snapshot.assert_called_with(SnapshotId='snap-000f48a8fa4545e1a')
+    assert "Summary" in caplog.text
+    assert "region2" in caplog.text
+
+
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._get_owned_images')
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._connect')
+def test_remove_expired_images_region_failure(
+    ec2connect_mock,
+    get_owned_imgs_mock,
+    caplog
+):
+    ec2 = MagicMock()
+    ec2.deregister_image.side_effect = Exception('Access denied')
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.return_value = mock_get_owned_expired_images()
+
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--access-id",
+      "testAccId",
+      "--expired",
+      "--file",
+      data_path + os.sep + 'complete.cfg',
+      "--regions",
+      "region1",
+      "--secret-key",
+      "testSecretKey"
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2removeimg.main(cli_args)
+    assert excinfo.value.code == 1
+    assert "failed: Access denied" in caplog.text
+
+
+@patch('ec2removeimg.create_image_remover')
+def test_remove_expired_images_other_regions_continue(
+    create_image_remover_mock,
+    caplog
+):
+    failing_remover = MagicMock()
+    failing_remover.remove_images.side_effect = \
+        ec2removeimg.EC2RemoveImgException('Unable to remove snapshot')
+    remover = MagicMock()
+    remover.remove_images.return_value = [
+        ('ami-000cc31892067693a', 'snap-000f48a8fa4545e1a')
+    ]
+    create_image_remover_mock.side_effect = [failing_remover, remover]
+
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--access-id",
+      "testAccId",
+      "--expired",
+      "--file",
+      data_path + os.sep + 'complete.cfg',
+      "--regions",
+      "region1,region2",
+      "--secret-key",
+      "testSecretKey"
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2removeimg.main(cli_args)
+    assert excinfo.value.code == 1
+    # The failed region raises the library exception instead of ending the
+    # run, the next region is still processed
+    remover.set_region.assert_called_once_with('region2')
+    remover.remove_images.assert_called_once_with()
+    assert "Region region1: Unable to remove snapshot" in caplog.text
+    assert "failed: Unable to remove snapshot" in caplog.text
+
+
+@patch('ec2removeimg.create_image_remover')
+def test_remove_expired_images_remover_failure(
+    create_image_remover_mock,
+    caplog
+):
+    remover = MagicMock()
+    remover.remove_images.return_value = []
+    create_image_remover_mock.side_effect = [
+        remover,
+        ec2removeimg.EC2RemoveImgException('Invalid arguments')
+    ]
+
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--access-id",
+      "testAccId",
+      "--expired",
+      "--file",
+      data_path + os.sep + 'complete.cfg',
+      "--regions",
+      "region1,region2",
+      "--secret-key",
+      "testSecretKey"
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2removeimg.main(cli_args)
+    assert excinfo.value.code == 1
+    # The worker error ends up in the summary of all regions
+    assert "Summary" in caplog.text
+    assert "failed: Invalid arguments" in caplog.text
+
+
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._get_owned_images')
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._connect')
+def test_remove_images_resume(
+    ec2connect_mock,
+    get_owned_imgs_mock,
+    caplog
+):
+    ec2 = MagicMock()
+    ec2.deregister_image.return_value = None
+    ec2.delete_snapshot.return_value = None
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.return_value = mock_get_owned_images()
+
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--access-id",
+      "testAccId",
+      "--all",
+      "--file",
+      data_path + os.sep + 'complete.cfg',
+      "--image-name-match",
+      ".*",
+      "--regions",
+      "region1,region2",
+      "--resume",
+      "--secret-key",
+      "testSecretKey"
+    ]
+    args = ec2removeimg.parse_args(cli_args)
+    # Simulate a previous run that completed region1 and one image in
+    # region2 before it was interrupted
+    journal = ec2removeimg.get_journal(args, logger)
+    journal.record('region1')
+    journal.record('region2', 'ami-000cc31892067693a', 'remove')
+
+    ec2removeimg.main(cli_args)
+    assert "Skipping region region1" in caplog.text
+    ec2.deregister_image.assert_called_once_with(
+        ImageId='ami-000cc31892067693b'
+    )
+    assert not os.path.exists(journal.journal_file)
+
+
+@patch('builtins.input')
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._get_owned_images')
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._connect')
+def test_parallel_with_confirm(
+    ec2connect_mock,
+    get_owned_imgs_mock,
+    input_mock,
+    caplog
+):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.side_effect = (
+        lambda: mock_get_owned_images()
+    )
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--access-id",
+      "testAccId",
+      "--all",
+      "--confirm",
+      "--file",
+      data_path + os.sep + 'complete.cfg',
+      "--image-name-frag",
+      "Image",
+      "--parallel",
+      "4",
+      "--preserve-snap",
+      "--regions",
+      "region1,region2,region3",
+      "--secret-key",
+      "testSecretKey"
+    ]
+
+    # Declined, nothing is removed
+    input_mock.return_value = 'n'
+    with pytest.raises(SystemExit) as excinfo:
+        ec2removeimg.main(cli_args)
+    assert excinfo.value.code == 1
+    ec2.deregister_image.assert_not_called()
+
+    # Confirmed once for the images of all regions
+    input_mock.reset_mock()
+    input_mock.return_value = 'y'
+    ec2removeimg.main(cli_args)
+    input_mock.assert_called_once_with(
+        'Confirm removal of 6 image(s) in 3 region(s) (Y/n) '
+    )
+    assert ec2.deregister_image.call_count == 6
+    summary = caplog.text[caplog.text.rindex('Summary:'):]
+    assert 'region3             \t2\t0\tok' in summary
+
+
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._get_owned_images')
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._connect')
+def test_parallel_regions(ec2connect_mock, get_owned_imgs_mock, caplog):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.side_effect = (
+        lambda: mock_get_owned_images()
+    )
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--access-id",
+      "testAccId",
+      "--file",
+      data_path + os.sep + 'complete.cfg',
+      "--image-name-frag",
+      "Image",
+      "--parallel",
+      "2",
+      "--regions",
+      "region1,region2",
+      "--secret-key",
+      "testSecretKey"
+    ]
+    # Two images match without --all, every region fails
+    with pytest.raises(SystemExit) as excinfo:
+        ec2removeimg.main(cli_args)
+    assert excinfo.value.code == 1
+    assert 'region2             \t0\t0\tfailed: Image ambiguity' in \
+        caplog.text
+    ec2.deregister_image.assert_not_called()
+
+    cli_args[cli_args.index("Image")] = "NotTest"
+    ec2removeimg.main(cli_args)
+    assert ec2.deregister_image.call_count == 2
+    assert ec2.delete_snapshot.call_count == 2
+
+
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._get_owned_images')
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._connect')
+def test_remove_images_filtering_by_selectors(
+    ec2connect_mock,
+    get_owned_imgs_mock,
+    caplog
+):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.return_value = mock_get_owned_images()
+
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--access-id",
+      "testAccId",
+      "--file",
+      data_path + os.sep + 'complete.cfg',
+      "--select",
+      "name=testImageName",
+      "--select",
+      "fragment=NotTest",
+      "--preserve-snap",
+      "--regions",
+      "region1",
+      "--secret-key",
+      "testSecretKey"
+    ]
+    # Every selector matches one image, --all is not needed
+    ec2removeimg.main(cli_args)
+    get_owned_imgs_mock.assert_called_once_with()
+    assert ec2.deregister_image.call_count == 2
+
+
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._get_owned_images')
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._connect')
+def test_remove_images_selector_ambiguity(
+    ec2connect_mock,
+    get_owned_imgs_mock,
+    caplog
+):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.return_value = mock_get_owned_images()
+
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--access-id",
+      "testAccId",
+      "--file",
+      data_path + os.sep + 'complete.cfg',
+      "--select",
+      "regex=.*Image.*",
+      "--select",
+      "id=ami-000cc31892067693a",
+      "--regions",
+      "region1",
+      "--secret-key",
+      "testSecretKey"
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2removeimg.main(cli_args)
+    assert excinfo.value.code == 1
+    assert 'selector(s) regex=.*Image.*' in caplog.text
+    ec2.deregister_image.assert_not_called()
+
+
+@patch('ec2imgutils.ec2utils.time.sleep')
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._get_owned_images')
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._connect')
+def test_remove_images_snapshot_in_use(
+    ec2connect_mock,
+    get_owned_imgs_mock,
+    sleep_mock,
+    caplog
+):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.return_value = mock_get_owned_images()
+    in_use = ClientError(
+        {'Error': {'Code': 'InvalidSnapshot.InUse'}}, 'DeleteSnapshot'
+    )
+    deleted = []
+
+    def delete_snapshot(SnapshotId):
+        if SnapshotId not in deleted:
+            deleted.append(SnapshotId)
+            raise in_use
+        deleted.append(SnapshotId)
+    ec2.delete_snapshot.side_effect = delete_snapshot
+
+    remover = ec2removeimg.ec2rmimg.EC2RemoveImage(
+        image_name_fragment='Image',
+        remove_all=True,
+        log_callback=logger
+    )
+    removed = remover.remove_images()
+
+    assert [
+        ('ami-000cc31892067693a', 'snap-000f48a8fa4545e1a'),
+        ('ami-000cc31892067693b', 'snap-000f48a8fa4545e1b')
+    ] == removed
+    assert ec2.deregister_image.call_count == 2
+    assert ec2.delete_snapshot.call_count == 4
+    # Only the snapshots still in use back off
+    assert sleep_mock.call_count == 2
+
+
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._get_owned_images')
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._connect')
+def test_remove_images_snapshot_failure(
+    ec2connect_mock,
+    get_owned_imgs_mock,
+    caplog
+):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.return_value = mock_get_owned_images()
+    ec2.delete_snapshot.side_effect = [
+        ClientError({'Error': {'Code': 'AccessDenied'}}, 'DeleteSnapshot'),
+        None
+    ]
+
+    remover = ec2removeimg.ec2rmimg.EC2RemoveImage(
+        image_name_fragment='Image',
+        max_workers=1,
+        remove_all=True,
+        log_callback=logger
+    )
+    with pytest.raises(ec2removeimg.EC2RemoveImgException) as e:
+        remover.remove_images()
+    assert 'snap-000f48a8fa4545e1a' in str(e.value)
+    assert ec2.deregister_image.call_count == 2
+    assert 'Failed to delete snapshot: snap-000f48a8fa4545e1a' in caplog.text
+
+
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._get_owned_images')
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._connect')
+def test_remove_images_journals_snapshots(
+    ec2connect_mock,
+    get_owned_imgs_mock,
+    tmp_path
+):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.return_value = mock_get_owned_images()[:1]
+    journal = ec2removeimg.ec2journal.EC2RunJournal(
+        'ec2test', {}, journal_dir=str(tmp_path)
+    )
+    # Queued by an interrupted run, snap-gone got deleted without the
+    # deletion being recorded
+    journal.record('region1', 'snap-queued', 'queue-snapshot')
+    journal.record('region1', 'snap-gone', 'queue-snapshot')
+    journal.record('region1', 'snap-done', 'queue-snapshot')
+    journal.record('region1', 'snap-done', 'delete-snapshot')
+
+    def deregister_image(ImageId):
+        # The snapshot is journaled before its image is deregistered
+        assert 'snap-000f48a8fa4545e1a' in journal.get_images(
+            'region1', 'queue-snapshot'
+        )
+    ec2.deregister_image.side_effect = deregister_image
+
+    def delete_snapshot(SnapshotId):
+        if SnapshotId == 'snap-gone':
+            raise ClientError(
+                {'Error': {'Code': 'InvalidSnapshot.NotFound'}},
+                'DeleteSnapshot'
+            )
+    ec2.delete_snapshot.side_effect = delete_snapshot
+
+    remover = ec2removeimg.ec2rmimg.EC2RemoveImage(
+        image_name_fragment='Image',
+        journal=journal,
+        log_callback=logger
+    )
+    remover.set_region('region1')
+    removed = remover.remove_images()
+
+    assert removed == [('ami-000cc31892067693a', 'snap-000f48a8fa4545e1a')]
+    assert sorted(
+        call[1]['SnapshotId'] for call in ec2.delete_snapshot.call_args_list
+    ) == ['snap-000f48a8fa4545e1a', 'snap-gone', 'snap-queued']
+    assert journal.get_images('region1', 'delete-snapshot') == [
+        'snap-000f48a8fa4545e1a', 'snap-done', 'snap-gone', 'snap-queued'
+    ]
+    assert journal.is_complete('region1', 'ami-000cc31892067693a', 'remove')
+
+
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._get_owned_images')
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._connect')
+def test_remove_images_rerun_deletes_queued_snapshots(
+    ec2connect_mock,
+    get_owned_imgs_mock,
+    caplog
+):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    # The interrupted run deregistered all images
+    get_owned_imgs_mock.return_value = []
+
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--access-id",
+      "testAccId",
+      "--all",
+      "--file",
+      data_path + os.sep + 'complete.cfg',
+      "--image-name-match",
+      ".*",
+      "--regions",
+      "region1",
+      "--run-id",
+      "rerun",
+      "--secret-key",
+      "testSecretKey"
+    ]
+    args = ec2removeimg.parse_args(cli_args)
+    journal = ec2removeimg.get_journal(args, logger)
+    journal.record('region1', 'snap-queued', 'queue-snapshot')
+
+    # A plain rerun, without --resume, still deletes the snapshot
+    ec2removeimg.main(cli_args)
+    ec2.delete_snapshot.assert_called_once_with(SnapshotId='snap-queued')
+    assert not os.path.exists(journal.journal_file)
+    for path in os.listdir(os.path.dirname(journal.journal_file)):
+        if path.startswith(os.path.basename(journal.journal_file) + '.'):
+            os.remove(os.path.join(
+                os.path.dirname(journal.journal_file), path
+            ))
+
+
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._connect')
+def test_remove_manifest_images(ec2connect_mock, tmp_path, caplog):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    owned_images = dict(
+        (image['ImageId'], image) for image in mock_get_owned_images()
+    )
+
+    def describe_images(Owners, Filters):
+        return {'Images': [
+            owned_images[image_id] for image_id in Filters[0]['Values']
+            if image_id in owned_images
+        ]}
+    ec2.describe_images.side_effect = describe_images
+
+    def deregister_image(ImageId):
+        if ImageId == 'ami-000cc31892067693b':
+            raise ClientError({'Error': {'Code': 'AuthFailure'}}, 'Deregister')
+    ec2.deregister_image.side_effect = deregister_image
+
+    manifest = tmp_path / 'cleanup.jsonl'
+    manifest.write_text('\n'.join(json.dumps(entry) for entry in [
+        {'account': 'tester', 'region': 'r1',
+         'image_id': 'ami-000cc31892067693a'},
+        {'account': 'tester', 'region': 'r1', 'image_id': 'ami-missing'},
+        {'region': 'r2', 'image_id': 'ami-000cc31892067693b'},
+        {'region': 'r2', 'image_id': 'ami-old', 'status': 'removed'}
+    ]) + '\n')
+    cli_args = [
+      "--account",
+      "tester",
+      "--file",
+      data_path + os.sep + 'complete.cfg',
+      "--manifest",
+      str(manifest),
+      "--parallel",
+      "2"
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2removeimg.main(cli_args)
+    assert excinfo.value.code == 1
+
+    results_path = tmp_path / 'cleanup.results.jsonl'
+    results = [
+        json.loads(line) for line in results_path.read_text().splitlines()
+    ]
+    assert ['removed', 'not_found', 'failed'] == [
+        result['status'] for result in results
+    ]
+    assert 'snap-000f48a8fa4545e1a' == results[0]['snapshot_id']
+    assert 'AuthFailure' in results[2]['error']
+    ec2.delete_snapshot.assert_called_once_with(
+        SnapshotId='snap-000f48a8fa4545e1a'
+    )
+
+    # Feeding the results back in retries the failed entry only
+    ec2.reset_mock()
+    ec2.deregister_image.side_effect = None
+    cli_args[cli_args.index(str(manifest))] = str(results_path)
+    cli_args += ['--results', str(tmp_path / 'retry.jsonl')]
+    ec2removeimg.main(cli_args)
+    ec2.deregister_image.assert_called_once_with(
+        ImageId='ami-000cc31892067693b'
+    )
+    retry = json.loads((tmp_path / 'retry.jsonl').read_text())
+    assert 'removed' == retry['status']
+    assert retry['error'] is None
+
+
+def test_manifest_with_confirm():
+    cli_args = [
+      "--account",
+      "tester",
+      "--manifest",
+      "cleanup.jsonl",
+      "--confirm"
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        parsed_args = ec2removeimg.parse_args(cli_args)
+        ec2removeimg.check_required_arguments(parsed_args, logger)
+    assert excinfo.value.code == 1
+
+
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._connect')
+def test_remove_orphaned_snapshots(ec2connect_mock, caplog):
+    ec2, paginators = mock_orphaned_snapshots_client()
+    ec2connect_mock.return_value = ec2
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--access-id",
+      "testAccId",
+      "--dry-run",
+      "--file",
+      data_path + os.sep + 'complete.cfg',
+      "--orphaned-snapshots",
+      "--min-age",
+      "7",
+      "--parallel",
+      "2",
+      "--regions",
+      "region1,region2",
+      "--secret-key",
+      "testSecretKey"
+    ]
+    ec2removeimg.main(cli_args)
+    assert 'snap-orphan-old\t20200101' in caplog.text
+    assert 'snap-orphan-new' not in caplog.text
+    ec2.delete_snapshot.assert_not_called()
+    # Disabled images still reference their snapshots
+    paginators['describe_images'].paginate.assert_called_with(
+        Owners=['self'], IncludeDisabled=True
+    )
+    # Only the snapshots created by ec2uploadimg are candidates
+    paginators['describe_snapshots'].paginate.assert_called_with(
+        OwnerIds=['self'],
+        Filters=[{
+            'Name': 'tag:ec2imgutils:created-by',
+            'Values': ['ec2uploadimg']
+        }]
+    )
+
+    cli_args.remove("--dry-run")
+    ec2removeimg.main(cli_args)
+    assert ec2.delete_snapshot.call_count == 4
+    assert set(
+        call[1]['SnapshotId'] for call in ec2.delete_snapshot.call_args_list
+    ) == {'snap-orphan-old', 'snap-orphan-page2'}
+    assert 'region2             \t2\t\t0\tok' in caplog.text
+
+
+@patch('builtins.input')
+@patch('ec2removeimg.ec2rmimg.EC2RemoveImage._connect')
+def test_remove_orphaned_snapshots_all_snapshots(
+    ec2connect_mock,
+    input_mock,
+    caplog
+):
+    ec2, paginators = mock_orphaned_snapshots_client()
+    ec2connect_mock.return_value = ec2
+    cli_args = [
+      "--account",
+      "testAccName",
+      "--access-id",
+      "testAccId",
+      "--file",
+      data_path + os.sep + 'complete.cfg',
+      "--orphaned-snapshots",
+      "--all-snapshots",
+      "--regions",
+      "region1,region2",
+      "--secret-key",
+      "testSecretKey"
+    ]
+    # Snapshots not created by ec2uploadimg require a confirmation
+    input_mock.return_value = 'n'
+    with pytest.raises(SystemExit) as excinfo:
+        ec2removeimg.main(cli_args)
+    assert excinfo.value.code == 1
+    input_mock.assert_called_once_with(
+        'Confirm removal of 4 snapshot(s) in 2 region(s), including '
+        'snapshots not created by ec2uploadimg (Y/n) '
+    )
+    paginators['describe_snapshots'].paginate.assert_called_with(
+        OwnerIds=['self'], Filters=[]
+    )
+    ec2.delete_snapshot.assert_not_called()
+
+    input_mock.return_value = 'y'
+    ec2removeimg.main(cli_args)
+    assert ec2.delete_snapshot.call_count == 4
+    assert 'region1             \t2\t\t0\tok' in caplog.text
+
+    # --force skips the confirmation
+    input_mock.reset_mock()
+    ec2removeimg.main(cli_args + ["--force"])
+    input_mock.assert_not_called()
+    assert ec2.delete_snapshot.call_count == 8
+
+
+def test_force_requires_all_snapshots():
+    cli_args = [
+      "--account",
+      "tester",
+      "--orphaned-snapshots",
+      "--force"
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        parsed_args = ec2removeimg.parse_args(cli_args)
+        ec2removeimg.check_required_arguments(parsed_args, logger)
+    assert excinfo.value.code == 1
+
+
 # --------------------------------------------------------------------
 # Aux functions
+def mock_get_owned_expired_images():
+    myImages = mock_get_owned_images()
+    myImages[0]["Tags"] = [
+        {"Key": "Deprecated on", "Value": "20220101"},
+        {"Key": "Removal date", "Value": "20220701"}
+    ]
+    myImages[1]["Tags"] = [
+        {"Key": "Deprecated on", "Value": "20220101"},
+        {"Key": "Removal date", "Value": "29990101"}
+    ]
+    return myImages
+
+
 def mock_get_owned_images():
     myImage1 = {}
     myImage1["Architecture"] = "x86_64"
@@ -1029,3 +1754,29 @@ def mock_get_owned_images_without_snapid():
     myImages.append(myImage1)
     myImages.append(myImage2)
     return myImages
+
+
+def mock_orphaned_snapshots_client():
+    ec2 = MagicMock()
+    old = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+    new = datetime.datetime.now(datetime.timezone.utc)
+    pages = {
+        'describe_images': [{'Images': mock_get_owned_images()}],
+        'describe_snapshots': [
+            {'Snapshots': [
+                {'SnapshotId': 'snap-000f48a8fa4545e1a', 'StartTime': old},
+                {'SnapshotId': 'snap-orphan-old', 'StartTime': old},
+                {'SnapshotId': 'snap-orphan-new', 'StartTime': new}
+            ]},
+            {'Snapshots': [
+                {'SnapshotId': 'snap-000f48a8fa4545e1b', 'StartTime': old},
+                {'SnapshotId': 'snap-orphan-page2', 'StartTime': old}
+            ]}
+        ]
+    }
+    paginators = {}
+    for operation, operation_pages in pages.items():
+        paginators[operation] = MagicMock()
+        paginators[operation].paginate.return_value = operation_pages
+    ec2.get_paginator.side_effect = lambda operation: paginators[operation]
+    return ec2, paginators
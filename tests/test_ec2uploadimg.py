@@ -1554,6 +1554,586 @@ def test_failed_upload(
     assert excinfo.value.code != 0
 
 
+@patch('ec2uploadimg.get_amiID')
+@patch('ec2uploadimg.EC2Setup')
+@patch('ec2uploadimg.ec2upimg.EC2ImageUploader')
+def test_main_parallel_regions(
+    EC2ImageUploader_mock,
+    EC2Setup_mock,
+    get_amiID_mock,
+    caplog
+):
+    get_amiID_mock.return_value = 'ami-helper'
+
+    def get_uploader(**kwargs):
+        uploader = MagicMock()
+        if kwargs['region'] == 'region2':
+            uploader.create_image.side_effect = ValueError('upload failed')
+        else:
+            uploader.create_image.return_value = 'ami-' + kwargs['region']
+        return uploader
+    EC2ImageUploader_mock.side_effect = get_uploader
+
+    cli_args = [
+        "--account",
+        "testAccName",
+        "--access-id",
+        "testAccId",
+        "--description",
+        "This is a test description for the image",
+        "--file",
+        data_path + os.sep + 'complete.cfg',
+        "--machine",
+        "x86_64",
+        "--name",
+        "testImageName",
+        "--parallel",
+        "2",
+        "--private-key-file",
+        data_path + os.sep + 'invalid.cfg',
+        "--regions",
+        "region1,region2,region3",
+        "--secret-key",
+        "testAwsSecretKey",
+        "--security-group-ids",
+        "testSG1,testSG2",
+        "--ssh-key-pair",
+        "testSshKeyPair",
+        "--type",
+        "testType",
+        "--user",
+        "testUser",
+        "--virt-type",
+        "hvm",
+        data_path + os.sep + 'complete.cfg'
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2uploadimg.main(cli_args)
+    assert excinfo.value.code == 1
+    # Every region has its own setup which is cleaned up
+    assert EC2Setup_mock.call_count == 3
+    assert EC2Setup_mock.return_value.clean_up.call_count == 3
+    assert 'region1: Created image: ami-region1' in caplog.text
+    assert 'region2: upload failed' in caplog.text
+    assert 'created ami-region3' in caplog.text
+    # The summary carries the actual error of the region
+    assert 'failed: upload failed' in caplog.text
+    assert not ec2uploadimg.active_uploads
+
+
+@patch('ec2uploadimg.get_amiID')
+@patch('ec2uploadimg.EC2Setup')
+@patch('ec2uploadimg.ec2upimg.EC2ImageUploader')
+def test_main_parallel_regions_exit(
+    EC2ImageUploader_mock,
+    EC2Setup_mock,
+    get_amiID_mock,
+    caplog
+):
+    get_amiID_mock.return_value = 'ami-helper'
+
+    def get_uploader(**kwargs):
+        if kwargs['region'] == 'region2':
+            raise ValueError('no uploader')
+        uploader = MagicMock()
+        uploader.create_image.return_value = 'ami-' + kwargs['region']
+        return uploader
+    EC2ImageUploader_mock.side_effect = get_uploader
+
+    cli_args = [
+        "--account",
+        "testAccName",
+        "--access-id",
+        "testAccId",
+        "--description",
+        "This is a test description for the image",
+        "--file",
+        data_path + os.sep + 'complete.cfg',
+        "--machine",
+        "x86_64",
+        "--name",
+        "testImageName",
+        "--parallel",
+        "2",
+        "--private-key-file",
+        data_path + os.sep + 'invalid.cfg',
+        "--regions",
+        "region1,region2,region3",
+        "--secret-key",
+        "testAwsSecretKey",
+        "--security-group-ids",
+        "testSG1,testSG2",
+        "--ssh-key-pair",
+        "testSshKeyPair",
+        "--type",
+        "testType",
+        "--user",
+        "testUser",
+        "--virt-type",
+        "hvm",
+        data_path + os.sep + 'complete.cfg'
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2uploadimg.main(cli_args)
+    assert excinfo.value.code == 1
+    assert 'region2: no uploader' in caplog.text
+    assert 'created ami-region3' in caplog.text
+    # The exit code of a region that exited is in the summary
+    assert 'failed: Upload to region region2 exited with code 1' in (
+        caplog.text
+    )
+    assert not ec2uploadimg.active_uploads
+
+
+@patch('ec2uploadimg.get_amiID')
+@patch('ec2uploadimg.EC2Setup')
+@patch('ec2uploadimg.ec2upimg.EC2ImageUploader')
+def test_main_copy_image(
+    EC2ImageUploader_mock,
+    EC2Setup_mock,
+    get_amiID_mock,
+    caplog
+):
+    get_amiID_mock.return_value = 'ami-helper'
+    uploader = MagicMock()
+    uploader.create_image.return_value = 'ami-1'
+    uploader.copy_image_to_regions.return_value = {
+        'region2': ('ami-2', None),
+        'region3': (None, ValueError('copy failed'))
+    }
+    EC2ImageUploader_mock.return_value = uploader
+
+    cli_args = [
+        "--account",
+        "testAccName",
+        "--access-id",
+        "testAccId",
+        "--copy-image",
+        "--description",
+        "This is a test description for the image",
+        "--file",
+        data_path + os.sep + 'complete.cfg',
+        "--machine",
+        "x86_64",
+        "--name",
+        "testImageName",
+        "--private-key-file",
+        data_path + os.sep + 'invalid.cfg',
+        "--regions",
+        "region1,region2,region3",
+        "--secret-key",
+        "testAwsSecretKey",
+        "--security-group-ids",
+        "testSG1,testSG2",
+        "--ssh-key-pair",
+        "testSshKeyPair",
+        "--type",
+        "testType",
+        "--user",
+        "testUser",
+        "--virt-type",
+        "hvm",
+        data_path + os.sep + 'complete.cfg'
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2uploadimg.main(cli_args)
+    assert excinfo.value.code == 1
+    # The image is uploaded to the first region only
+    assert EC2ImageUploader_mock.call_count == 1
+    assert EC2ImageUploader_mock.call_args[1]['region'] == 'region1'
+    uploader.copy_image_to_regions.assert_called_once_with(
+        'ami-1', ['region2', 'region3'], {'region2': None, 'region3': None}
+    )
+    assert EC2ImageUploader_mock.call_args[1]['copy_timeout'] == 7200
+    assert 'created ami-1' in caplog.text
+    assert 'created ami-2' in caplog.text
+    assert 'failed: copy failed' in caplog.text
+
+
+@patch('ec2uploadimg.get_amiID')
+@patch('ec2uploadimg.EC2Setup')
+@patch('ec2uploadimg.ec2upimg.EC2ImageUploader')
+def test_main_copy_image_paravirtual(
+    EC2ImageUploader_mock,
+    EC2Setup_mock,
+    get_amiID_mock,
+    caplog
+):
+    get_amiID_mock.return_value = 'ami-helper'
+
+    cli_args = [
+        "--account",
+        "tester",
+        "--copy-image",
+        "--description",
+        "This is a test description for the image",
+        "--file",
+        data_path + os.sep + 'complete.cfg',
+        "--machine",
+        "x86_64",
+        "--name",
+        "testImageName",
+        "--regions",
+        "us-east-1,region2",
+        "--virt-type",
+        "para",
+        data_path + os.sep + 'complete.cfg'
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2uploadimg.main(cli_args)
+    assert excinfo.value.code == 1
+    # The copy region has no kernel configured, nothing is uploaded
+    assert 'Could not find bootkernel in config' in caplog.text
+    EC2ImageUploader_mock.assert_not_called()
+    EC2Setup_mock.assert_not_called()
+
+
+@patch('ec2uploadimg.get_amiID')
+@patch('ec2uploadimg.EC2Setup')
+@patch('ec2uploadimg.ec2upimg.EC2ImageUploader')
+def test_main_copy_image_aborted(
+    EC2ImageUploader_mock,
+    EC2Setup_mock,
+    get_amiID_mock,
+    caplog
+):
+    get_amiID_mock.return_value = 'ami-helper'
+    uploader = MagicMock()
+    # An aborted upload creates no image
+    uploader.create_image.return_value = None
+    EC2ImageUploader_mock.return_value = uploader
+
+    cli_args = [
+        "--account",
+        "testAccName",
+        "--access-id",
+        "testAccId",
+        "--copy-image",
+        "--description",
+        "This is a test description for the image",
+        "--file",
+        data_path + os.sep + 'complete.cfg',
+        "--machine",
+        "x86_64",
+        "--name",
+        "testImageName",
+        "--private-key-file",
+        data_path + os.sep + 'invalid.cfg',
+        "--regions",
+        "region1,region2",
+        "--secret-key",
+        "testAwsSecretKey",
+        "--security-group-ids",
+        "testSG1",
+        "--ssh-key-pair",
+        "testSshKeyPair",
+        "--type",
+        "testType",
+        "--user",
+        "testUser",
+        "--virt-type",
+        "hvm",
+        data_path + os.sep + 'complete.cfg'
+    ]
+    ec2uploadimg.main(cli_args)
+    uploader.copy_image_to_regions.assert_not_called()
+    assert 'Created image' not in caplog.text
+    assert 'None' not in caplog.text
+    assert 'region1             \taborted' in caplog.text
+
+
+def test_main_copy_image_with_snaponly(caplog):
+    cli_args = [
+        "--account",
+        "testAccName",
+        "--copy-image",
+        "--description",
+        "This is a test description for the image",
+        "--machine",
+        "x86_64",
+        "--name",
+        "testImageName",
+        "--regions",
+        "region1,region2",
+        "--snaponly",
+        "--virt-type",
+        "hvm",
+        data_path + os.sep + 'complete.cfg'
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2uploadimg.main(cli_args)
+    assert excinfo.value.code == 1
+    assert 'cannot be specified with --snaponly' in caplog.text
+
+
+@patch('ec2uploadimg.EC2Setup')
+@patch('ec2uploadimg.ec2upimg.EC2ImageUploader')
+def test_main_ebs_direct(
+    EC2ImageUploader_mock,
+    EC2Setup_mock,
+    caplog
+):
+    uploader = MagicMock()
+    uploader.create_image.return_value = 'ami-1'
+    EC2ImageUploader_mock.return_value = uploader
+
+    cli_args = [
+        "--account",
+        "testAccName",
+        "--access-id",
+        "testAccId",
+        "--description",
+        "This is a test description for the image",
+        "--ebs-direct",
+        "--file",
+        data_path + os.sep + 'complete.cfg',
+        "--machine",
+        "x86_64",
+        "--name",
+        "testImageName",
+        "--regions",
+        "region1",
+        "--secret-key",
+        "testAwsSecretKey",
+        "--upload-workers",
+        "16",
+        "--virt-type",
+        "hvm",
+        data_path + os.sep + 'complete.cfg'
+    ]
+    ec2uploadimg.main(cli_args)
+
+    assert 'Created image: ami-1' in caplog.text
+    uploader_args = EC2ImageUploader_mock.call_args[1]
+    assert uploader_args['use_ebs_direct'] is True
+    assert uploader_args['upload_workers'] == 16
+    # No helper instance resources are needed
+    assert uploader_args['launch_ami'] is None
+    assert uploader_args['ssh_key_pair_name'] is None
+    setup = EC2Setup_mock.return_value
+    setup.create_upload_key_pair.assert_not_called()
+    setup.create_security_group.assert_not_called()
+    setup.create_vpc_subnet.assert_not_called()
+
+
+def test_main_ebs_direct_with_root_swap(caplog):
+    cli_args = [
+        "--account",
+        "testAccName",
+        "--description",
+        "This is a test description for the image",
+        "--ebs-direct",
+        "--machine",
+        "x86_64",
+        "--name",
+        "testImageName",
+        "--regions",
+        "region1",
+        "--use-root-swap",
+        "--virt-type",
+        "hvm",
+        data_path + os.sep + 'complete.cfg'
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2uploadimg.main(cli_args)
+    assert excinfo.value.code == 1
+    assert 'cannot be specified with --use-snapshot' in caplog.text
+
+
+def test_main_transcode_invalid(caplog):
+    cli_args = [
+        "--account",
+        "testAccName",
+        "--description",
+        "This is a test description for the image",
+        "--ebs-direct",
+        "--machine",
+        "x86_64",
+        "--name",
+        "testImageName",
+        "--regions",
+        "region1",
+        "--transcode",
+        "--virt-type",
+        "hvm",
+        data_path + os.sep + 'complete.cfg'
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2uploadimg.main(cli_args)
+    assert excinfo.value.code == 1
+    assert '--transcode cannot be specified with --ebs-direct' in caplog.text
+
+    cli_args.remove("--ebs-direct")
+    cli_args[-1:-1] = ["--transcode-level", "22"]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2uploadimg.main(cli_args)
+    assert excinfo.value.code == 1
+    assert '--transcode-level must be 1 to 19' in caplog.text
+
+
+def test_main_invalid_dd_block_size(caplog):
+    cli_args = [
+        "--account",
+        "testAccName",
+        "--dd-block-size",
+        "32x",
+        "--description",
+        "This is a test description for the image",
+        "--machine",
+        "x86_64",
+        "--name",
+        "testImageName",
+        "--regions",
+        "region1",
+        "--virt-type",
+        "hvm",
+        data_path + os.sep + 'complete.cfg'
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2uploadimg.main(cli_args)
+    assert excinfo.value.code == 1
+    assert '--dd-block-size must be a number of bytes' in caplog.text
+
+
+def test_main_openssh_upload_channels(caplog):
+    cli_args = [
+        "--account",
+        "testAccName",
+        "--description",
+        "This is a test description for the image",
+        "--machine",
+        "x86_64",
+        "--name",
+        "testImageName",
+        "--regions",
+        "region1",
+        "--transfer-backend",
+        "openssh",
+        "--upload-channels",
+        "4",
+        "--virt-type",
+        "hvm",
+        data_path + os.sep + 'complete.cfg'
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2uploadimg.main(cli_args)
+    assert excinfo.value.code == 1
+    assert 'cannot be combined with --transfer-backend openssh' in caplog.text
+
+
+def test_main_invalid_link_bandwidth(caplog):
+    cli_args = [
+        "--account",
+        "testAccName",
+        "--description",
+        "This is a test description for the image",
+        "--machine",
+        "x86_64",
+        "--name",
+        "testImageName",
+        "--regions",
+        "region1",
+        "--transcode",
+        "--link-bandwidth",
+        "0",
+        "--virt-type",
+        "hvm",
+        data_path + os.sep + 'complete.cfg'
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2uploadimg.main(cli_args)
+    assert excinfo.value.code == 1
+    assert 'The value of --link-bandwidth must be 1 or larger' in caplog.text
+
+
+def test_main_invalid_upload_resume_attempts(caplog):
+    cli_args = [
+        "--account",
+        "testAccName",
+        "--description",
+        "This is a test description for the image",
+        "--machine",
+        "x86_64",
+        "--name",
+        "testImageName",
+        "--regions",
+        "region1",
+        "--upload-resume-attempts",
+        "-1",
+        "--virt-type",
+        "hvm",
+        data_path + os.sep + 'complete.cfg'
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2uploadimg.main(cli_args)
+    assert excinfo.value.code == 1
+    assert '--upload-resume-attempts must be 0 or larger' in caplog.text
+
+
+def test_signal_handler_aborts_active_uploads():
+    setup = MagicMock()
+    uploader = MagicMock()
+    ec2uploadimg.register_upload('region1', setup)
+    ec2uploadimg.register_upload('region2', setup, uploader)
+    try:
+        ec2uploadimg.signal_handler(None, None)
+        assert ec2uploadimg.aborted
+        uploader.abort.assert_called_once_with()
+    finally:
+        ec2uploadimg.unregister_upload('region1')
+        ec2uploadimg.unregister_upload('region2')
+        ec2uploadimg.aborted = False
+
+
+@patch('ec2uploadimg.os._exit')
+def test_signal_handler_second_signal_exits_immediately(exit_mock):
+    exit_mock.side_effect = SystemExit
+    uploader = MagicMock()
+    ec2uploadimg.register_upload('region1', MagicMock(), uploader)
+    try:
+        ec2uploadimg.signal_handler(None, None)
+        with pytest.raises(SystemExit):
+            ec2uploadimg.signal_handler(None, None)
+        exit_mock.assert_called_once_with(1)
+        uploader.abort.assert_called_once_with()
+    finally:
+        ec2uploadimg.unregister_upload('region1')
+        ec2uploadimg.aborted = False
+
+
+def test_signal_handler_no_active_uploads():
+    try:
+        with pytest.raises(SystemExit) as excinfo:
+            ec2uploadimg.signal_handler(None, None)
+        assert excinfo.value.code == 1
+    finally:
+        ec2uploadimg.aborted = False
+
+
+def test_main_invalid_parallel(caplog):
+    cli_args = [
+        "--account",
+        "testAccName",
+        "--description",
+        "This is a test description for the image",
+        "--machine",
+        "x86_64",
+        "--name",
+        "testImageName",
+        "--parallel",
+        "0",
+        "--regions",
+        "region1",
+        "--virt-type",
+        "hvm",
+        data_path + os.sep + 'complete.cfg'
+    ]
+    with pytest.raises(SystemExit) as excinfo:
+        ec2uploadimg.main(cli_args)
+    assert excinfo.value.code == 1
+    assert 'The value of --parallel must be 1 or larger' in caplog.text
+
+
 @patch('ec2uploadimg.utils.get_from_config')
 def test_main_unable_to_get_access_keys(
     get_from_config_mock
@@ -19,10 +19,14 @@
 # <http://www.gnu.org/licenses/>.
 #
 
+import datetime
 import logging
 import os
 import pytest
 
+from botocore.exceptions import ClientError
+from unittest.mock import MagicMock, patch
+
 from ec2imgutils import ec2utils
 from ec2imgutils.ec2imgutilsExceptions import (
     EC2AccountException,
@@ -241,6 +245,151 @@ def test_get_regions_from_cmd():
     assert expected == regions
 
 
+def test_find_images_by_removal_date():
+    """Test find_images_by_removal_date finds images with a removal date
+       on or before the given date and ignores invalid tags"""
+    images = _get_test_images()
+    images[0]['Tags'] = [{'Key': 'Removal date', 'Value': '20220101'}]
+    images[1]['Tags'] = [{'Key': 'Removal date', 'Value': '20990101'}]
+    image = {}
+    image['ImageId'] = 2
+    image['Tags'] = [{'Key': 'Removal date', 'Value': 'soon'}]
+    images.append(image)
+    found_images = ec2utils.find_images_by_removal_date(
+        images,
+        datetime.datetime(2022, 1, 1),
+        logger
+    )
+    assert 1 == len(found_images)
+    assert 0 == found_images[0]['ImageId']
+
+
+def test_run_in_parallel():
+    """Test run_in_parallel returns results and errors in item order"""
+    def task(item):
+        if item == 2:
+            raise ValueError('failed')
+        return item * 10
+
+    results = ec2utils.run_in_parallel(task, [1, 2, 3], 2)
+    assert [1, 2, 3] == [item for item, result, error in results]
+    assert [10, None, 30] == [result for item, result, error in results]
+    assert isinstance(results[1][2], ValueError)
+    assert results[0][2] is None
+
+
+def test_get_region_logger(caplog):
+    """Test the region logger prefixes messages with the region"""
+    logger = logging.getLogger('ec2imgutils')
+    region_logger = ec2utils.get_region_logger(logger, 'us-east-1')
+    with caplog.at_level(logging.INFO, logger='ec2imgutils'):
+        region_logger.info('Created image: ami-1')
+    assert 'us-east-1: Created image: ami-1' in caplog.messages
+
+
+def test_find_images_by_selectors():
+    """Test images are matched against mixed selectors in one pass"""
+    images = _get_test_images()
+    images.append({'ImageId': 'ami-noname'})
+    images.append({'ImageId': 'ami-other', 'Name': 'otherimage-2'})
+    selectors = [
+        ('name', 'testimage-0'),
+        ('regex', r'.*image-\d$'),
+        ('id', 'ami-noname'),
+        ('fragment', 'nomatch')
+    ]
+    found_images = ec2utils.find_images_by_selectors(
+        images, selectors, logger
+    )
+    assert [0, 1, 'ami-noname', 'ami-other'] == [
+        image['ImageId'] for image in found_images
+    ]
+    assert [
+        'name=testimage-0',
+        r'regex=.*image-\d$',
+        'id=ami-noname',
+        r'regex=.*image-\d$'
+    ] == [image['Selector'] for image in found_images]
+
+
+def test_get_image_family():
+    """Test date and version parts are stripped from image names"""
+    assert 'suse-sles-15-sp5-hvm-ssd-x86_64' == ec2utils.get_image_family(
+        'suse-sles-15-sp5-v20240101-hvm-ssd-x86_64'
+    )
+    assert 'sles-15.5-byos-arm64' == ec2utils.get_image_family(
+        'sles-15.5-byos-v1.2.3-arm64'
+    )
+    assert 'image-x86_64' == ec2utils.get_image_family(
+        'image-2024-01-31-x86_64'
+    )
+    assert 'sles-sap-15-sp4' == ec2utils.get_image_family(
+        'sles-sap-15-sp4-v202401011230'
+    )
+    assert '(unnamed)' == ec2utils.get_image_family(None)
+
+
+def test_parse_selector():
+    """Test parsing of KIND=VALUE image selectors"""
+    assert ('name', 'a=b') == ec2utils.parse_selector('name=a=b')
+    assert ('regex', '^sles-15') == ec2utils.parse_selector('regex=^sles-15')
+    assert ec2utils.parse_selector('tag=release') is None
+    assert ec2utils.parse_selector('name=') is None
+    assert ec2utils.parse_selector('fragment') is None
+    assert ec2utils.parse_selector('regex=[') is None
+
+
+def test_get_share_permissions():
+    """Test share lists are split into unique launch permissions"""
+    org_arn = 'arn:aws:organizations::123456789012:organization/o-abcdef1234'
+    ou_arn = (
+        'arn:aws:organizations::123456789012:ou/o-abcdef1234/'
+        'ou-ab12-cdef5678'
+    )
+    share_with = ','.join(
+        ['123456789012', org_arn, ou_arn, '123456789012', '210987654321', '']
+    )
+    assert ec2utils.validate_share_list(share_with)
+    assert [
+        {'UserId': '123456789012'},
+        {'UserId': '210987654321'},
+        {'OrganizationArn': org_arn},
+        {'OrganizationalUnitArn': ou_arn}
+    ] == ec2utils.get_share_permissions(share_with)
+    assert ec2utils.validate_share_list(org_arn)
+    assert not ec2utils.validate_share_list('123456789012,1234')
+    assert not ec2utils.validate_share_list(
+        'arn:aws:organizations::123456789012:organization/x'
+    )
+    assert not ec2utils.validate_share_list(',')
+
+
+@patch('ec2imgutils.ec2utils.time.sleep')
+def test_call_with_retry(sleep_mock):
+    """Test call_with_retry retries throttled calls only"""
+    throttled = ClientError(
+        {'Error': {'Code': 'Throttling'}}, 'DescribeImages'
+    )
+    api_call = MagicMock(side_effect=[throttled, throttled, 'done'])
+    assert 'done' == ec2utils.call_with_retry(api_call, ImageIds=['ami-1'])
+    assert 3 == api_call.call_count
+    api_call.assert_called_with(ImageIds=['ami-1'])
+    assert 2 == sleep_mock.call_count
+
+    denied = ClientError(
+        {'Error': {'Code': 'AccessDenied'}}, 'DescribeImages'
+    )
+    api_call = MagicMock(side_effect=denied)
+    with pytest.raises(ClientError):
+        ec2utils.call_with_retry(api_call)
+    assert 1 == api_call.call_count
+
+    api_call = MagicMock(side_effect=throttled)
+    with pytest.raises(ClientError):
+        ec2utils.call_with_retry(api_call, retries=2)
+    assert 3 == api_call.call_count
+
+
 # --------------------------------------------------------------------
 # Helpers
 def _get_test_images():
@@ -253,3 +402,53 @@ def _get_test_images():
         images.append(image)
 
     return images
+
+
+def test_find_data_extents(tmp_path):
+    """Test holes and zero blocks are skipped and extents are merged"""
+    block = 4096
+    image = tmp_path / 'image.raw'
+    with open(image, 'wb') as image_file:
+        image_file.write(b'\1' * (block + 10))
+        image_file.write(bytes(3 * block))
+        image_file.seek(10 * block)
+        image_file.write(b'\2' * block)
+        image_file.truncate(20 * block + 100)
+    extents = ec2utils.find_data_extents(str(image), block)
+    assert [(0, 2 * block), (10 * block, block)] == extents
+
+
+def test_find_data_extents_empty(tmp_path):
+    """Test an empty or all zero file has no data extents"""
+    image = tmp_path / 'image.raw'
+    image.write_bytes(b'')
+    assert [] == ec2utils.find_data_extents(str(image))
+    image.write_bytes(bytes(100000))
+    assert [] == ec2utils.find_data_extents(str(image))
+
+
+def test_find_data_extents_partial_last_block(tmp_path):
+    """Test data in a partial last block is found"""
+    image = tmp_path / 'image.raw'
+    image.write_bytes(bytes(5000) + b'\3')
+    assert [(4096, 905)] == ec2utils.find_data_extents(str(image), 4096)
+
+
+def test_subtract_extents():
+    """Test the removed ranges are cut out of the extents"""
+    extents = [(0, 100), (200, 100)]
+    assert ec2utils.subtract_extents(extents, []) == extents
+    assert ec2utils.subtract_extents(extents, [(0, 100), (200, 100)]) == []
+    assert ec2utils.subtract_extents(
+        extents, [(250, 10), (0, 30), (50, 200)]
+    ) == [(30, 20), (260, 40)]
+
+
+@patch('builtins.input')
+def test_query_yes_no(input_mock):
+    """Test the question is repeated until yes or no is answered"""
+    input_mock.side_effect = ['maybe', 'N']
+    assert ec2utils.query_yes_no('Continue? ') is False
+    assert input_mock.call_count == 2
+    input_mock.side_effect = ['']
+    assert ec2utils.query_yes_no('Continue? ') is True
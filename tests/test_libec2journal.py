@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2026 SUSE LLC.  All rights reserved.
+#
+# This file is part of ec2utils
+#
+# ec2utils is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# ec2utils is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ec2utils. If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+import logging
+import os
+import pytest
+
+import ec2imgutils.ec2journal as ec2journal
+
+from ec2imgutils.ec2imgutilsExceptions import EC2JournalException
+
+logger = logging.getLogger('ec2imgutils')
+logger.setLevel(logging.INFO)
+
+
+# -----------------------------------------------------------------------------
+def test_journal_record_and_resume(tmp_path):
+    arguments = {'imageName': 'foo', 'regions': 'r1,r2'}
+    journal = ec2journal.EC2RunJournal(
+        'ec2test', arguments, journal_dir=str(tmp_path), log_callback=logger
+    )
+    journal.record('r1', 'ami-1', 'remove')
+    journal.record('r1')
+    assert journal.is_complete('r1')
+    assert not journal.is_complete('r2')
+
+    resumed = ec2journal.EC2RunJournal(
+        'ec2test',
+        arguments,
+        resume=True,
+        journal_dir=str(tmp_path),
+        log_callback=logger
+    )
+    assert resumed.journal_file == journal.journal_file
+    assert resumed.is_complete('r1', 'ami-1', 'remove')
+    assert resumed.is_complete('r1')
+    assert not resumed.is_complete('r1', 'ami-2', 'remove')
+
+
+# -----------------------------------------------------------------------------
+def test_journal_new_run_moves_previous_aside(tmp_path, caplog):
+    arguments = {'imageName': 'foo'}
+    journal = ec2journal.EC2RunJournal(
+        'ec2test', arguments, journal_dir=str(tmp_path)
+    )
+    journal.record('r1')
+    with open(journal.journal_file) as journal_file:
+        previous_entries = journal_file.read()
+    journal = ec2journal.EC2RunJournal(
+        'ec2test', arguments, journal_dir=str(tmp_path), log_callback=logger
+    )
+    assert not journal.is_complete('r1')
+    assert os.path.getsize(journal.journal_file) == 0
+    # The record of the interrupted run is kept next to the new journal
+    previous_files = [
+        path for path in tmp_path.iterdir()
+        if str(path) != journal.journal_file
+    ]
+    assert len(previous_files) == 1
+    assert str(previous_files[0]).startswith(journal.journal_file + '.')
+    assert previous_files[0].read_text() == previous_entries
+    assert 'Found the journal of an interrupted run' in caplog.text
+    assert 'it cannot be resumed' in caplog.text
+
+
+# -----------------------------------------------------------------------------
+def test_journal_new_run_carries_over_actions(tmp_path):
+    journal = ec2journal.EC2RunJournal(
+        'ec2test', {}, journal_dir=str(tmp_path)
+    )
+    journal.record('r1', 'snap-1', 'queue-snapshot')
+    journal.record('r1', 'snap-2', 'queue-snapshot')
+    journal.record('r1', 'snap-1', 'delete-snapshot')
+    journal.record('r1', 'ami-1', 'remove')
+    journal.record('r2')
+    journal = ec2journal.EC2RunJournal(
+        'ec2test',
+        {},
+        journal_dir=str(tmp_path),
+        carry_over_actions=('queue-snapshot', 'delete-snapshot')
+    )
+    assert journal.get_images('r1', 'queue-snapshot') == ['snap-1', 'snap-2']
+    assert journal.get_images('r1', 'delete-snapshot') == ['snap-1']
+    assert journal.get_images('r2', 'queue-snapshot') == []
+    assert not journal.is_complete('r1', 'ami-1', 'remove')
+    assert not journal.is_complete('r2')
+    # The carried over work is in the new journal for a later resume
+    resumed = ec2journal.EC2RunJournal(
+        'ec2test', {}, resume=True, journal_dir=str(tmp_path)
+    )
+    assert resumed.get_images('r1', 'queue-snapshot') == ['snap-1', 'snap-2']
+
+
+# -----------------------------------------------------------------------------
+def test_journal_new_run_after_empty_journal(tmp_path):
+    journal = ec2journal.EC2RunJournal(
+        'ec2test', {}, journal_dir=str(tmp_path)
+    )
+    ec2journal.EC2RunJournal('ec2test', {}, journal_dir=str(tmp_path))
+    # A journal without recorded work is reused
+    assert [journal.journal_file] == [
+        str(path) for path in tmp_path.iterdir()
+    ]
+
+
+# -----------------------------------------------------------------------------
+def test_journal_keyed_by_run_id_and_arguments(tmp_path):
+    journal1 = ec2journal.EC2RunJournal(
+        'ec2test', {'imageName': 'foo'}, journal_dir=str(tmp_path)
+    )
+    journal2 = ec2journal.EC2RunJournal(
+        'ec2test', {'imageName': 'bar'}, journal_dir=str(tmp_path)
+    )
+    journal3 = ec2journal.EC2RunJournal(
+        'ec2test',
+        {'imageName': 'foo'},
+        run_id='release',
+        journal_dir=str(tmp_path)
+    )
+    assert len(
+        {journal1.journal_file, journal2.journal_file, journal3.journal_file}
+    ) == 3
+
+
+# -----------------------------------------------------------------------------
+def test_journal_ignores_partial_line(tmp_path):
+    journal = ec2journal.EC2RunJournal(
+        'ec2test', {}, journal_dir=str(tmp_path)
+    )
+    journal.record('r1')
+    with open(journal.journal_file, 'a') as journal_file:
+        journal_file.write('{"region": "r2", "ima')
+    resumed = ec2journal.EC2RunJournal(
+        'ec2test', {}, resume=True, journal_dir=str(tmp_path)
+    )
+    assert resumed.is_complete('r1')
+    assert not resumed.is_complete('r2')
+
+
+# -----------------------------------------------------------------------------
+def test_journal_finish(tmp_path):
+    journal = ec2journal.EC2RunJournal(
+        'ec2test', {}, journal_dir=str(tmp_path)
+    )
+    journal.finish()
+    assert not os.path.exists(journal.journal_file)
+
+
+# -----------------------------------------------------------------------------
+def test_journal_unusable_dir(tmp_path):
+    blocker = tmp_path / 'blocker'
+    blocker.write_text('')
+    with pytest.raises(EC2JournalException):
+        ec2journal.EC2RunJournal(
+            'ec2test', {}, journal_dir=str(blocker / 'journal')
+        )
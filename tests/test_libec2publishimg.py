@@ -0,0 +1,428 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2026 SUSE LLC.  All rights reserved.
+#
+# This file is part of ec2utils
+#
+# ec2utils is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# ec2utils is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ec2utils. If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+import logging
+import pytest
+
+from botocore.exceptions import ClientError
+from unittest.mock import patch, MagicMock
+
+import ec2imgutils.ec2publishimg as ec2pubimg
+
+from ec2imgutils.ec2imgutilsExceptions import EC2PublishImgException
+
+logger = logging.getLogger('ec2imgutils')
+logger.setLevel(logging.INFO)
+
+
+# -----------------------------------------------------------------------------
+def test_get_snapshot_ids_for_image():
+    publisher = ec2pubimg.EC2PublishImage(log_callback=logger)
+    image = mock_get_owned_images()[0]
+    image['BlockDeviceMappings'].append({'DeviceName': '/dev/sdb'})
+    assert publisher._get_snapshot_ids_for_image(image) == [
+        'snap-000f48a8fa4545e1a'
+    ]
+
+
+# -----------------------------------------------------------------------------
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._connect')
+def test_set_block_device_mappings(ec2connect_mock):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    images = mock_get_owned_images()
+    del images[1]['BlockDeviceMappings']
+    ec2.describe_images.return_value = {
+        'Images': [mock_get_owned_images()[1]]
+    }
+
+    publisher = ec2pubimg.EC2PublishImage(log_callback=logger)
+    publisher._set_block_device_mappings(images)
+
+    ec2.describe_images.assert_called_once_with(
+        ImageIds=['ami-000cc31892067693b']
+    )
+    assert publisher._get_snapshot_ids_for_image(images[1]) == [
+        'snap-000f48a8fa4545e1b'
+    ]
+
+
+# -----------------------------------------------------------------------------
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._get_owned_images')
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._connect')
+def test_publish_images_uses_image_records(
+    ec2connect_mock,
+    get_owned_imgs_mock
+):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.return_value = mock_get_owned_images()
+
+    publisher = ec2pubimg.EC2PublishImage(
+        allow_copy='image',
+        image_name_fragment='Image',
+        visibility='all',
+        log_callback=logger
+    )
+    publisher.publish_images()
+
+    # Only the bulk public state prefetch, no per image lookups
+    ec2.describe_images.assert_called_once_with(
+        Owners=['self'],
+        Filters=[
+            {
+                'Name': 'image-id',
+                'Values': ['ami-000cc31892067693a', 'ami-000cc31892067693b']
+            },
+            {'Name': 'is-public', 'Values': ['true']}
+        ]
+    )
+    assert ec2.modify_image_attribute.call_count == 2
+    ec2.modify_snapshot_attribute.assert_any_call(
+        SnapshotId='snap-000f48a8fa4545e1b',
+        CreateVolumePermission={'Add': [{'Group': 'all'}]}
+    )
+
+
+# -----------------------------------------------------------------------------
+@patch('ec2imgutils.ec2publishimg.time.sleep')
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._get_owned_images')
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._connect')
+def test_publish_images_batched_wait_for_pending(
+    ec2connect_mock,
+    get_owned_imgs_mock,
+    sleep_mock,
+    caplog
+):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    images = mock_get_owned_images()
+    images.append(dict(images[0], ImageId='ami-pending1', State='pending'))
+    images.append(dict(images[0], ImageId='ami-pending2', State='pending'))
+    images.append(dict(images[0], ImageId='ami-pending3', State='pending'))
+    get_owned_imgs_mock.return_value = images
+
+    published = []
+    ec2.modify_image_attribute.side_effect = (
+        lambda **kwargs: published.append(kwargs['ImageId'])
+    )
+    polls = [
+        {'Images': [
+            {'ImageId': 'ami-pending1', 'State': 'pending'},
+            {'ImageId': 'ami-pending2', 'State': 'pending'},
+            {'ImageId': 'ami-pending3', 'State': 'pending'}
+        ]},
+        {'Images': [
+            {'ImageId': 'ami-pending1', 'State': 'pending'},
+            {'ImageId': 'ami-pending2', 'State': 'available'},
+            {'ImageId': 'ami-pending3', 'State': 'failed'}
+        ]},
+        {'Images': [
+            {'ImageId': 'ami-pending1', 'State': 'available'}
+        ]}
+    ]
+    poll_filters = []
+
+    def describe_images(Owners, Filters):
+        if len(Filters) > 1:
+            # Public state prefetch
+            return {'Images': []}
+        poll_filters.append(Filters)
+        return polls.pop(0)
+    ec2.describe_images.side_effect = describe_images
+
+    publisher = ec2pubimg.EC2PublishImage(
+        image_name_fragment='Image',
+        max_workers=1,
+        visibility='all',
+        log_callback=logger
+    )
+    publisher.publish_images()
+
+    # Available images first, pending ones in the order they turned available
+    assert published == [
+        'ami-000cc31892067693a',
+        'ami-000cc31892067693b',
+        'ami-pending2',
+        'ami-pending1'
+    ]
+    # One describe call per poll for all pending images
+    assert len(poll_filters) == 3
+    assert poll_filters[0] == [{
+        'Name': 'image-id',
+        'Values': ['ami-pending1', 'ami-pending2', 'ami-pending3']
+    }]
+    # The delay backs off while nothing changes and resets on a change
+    assert [args[0][0] for args in sleep_mock.call_args_list] == [5, 10, 5]
+    assert 'ami-pending3 as the state is failed' in caplog.text
+
+
+# -----------------------------------------------------------------------------
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._connect')
+def test_wait_for_available_images_timeout(ec2connect_mock, caplog):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    ec2.describe_images.return_value = {
+        'Images': [{'ImageId': 'ami-pending1', 'State': 'pending'}]
+    }
+    publisher = ec2pubimg.EC2PublishImage(log_callback=logger)
+    publisher.wait_min_delay = 0.01
+    publisher.wait_timeout = 0.05
+
+    images = list(publisher._wait_for_available_images(
+        [{'ImageId': 'ami-pending1', 'State': 'pending'}]
+    ))
+
+    assert images == []
+    assert 'ami-pending1 as it failed to become' in caplog.text
+
+
+# -----------------------------------------------------------------------------
+@patch('ec2imgutils.ec2utils.time.sleep')
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._get_owned_images')
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._connect')
+def test_publish_images_concurrent_with_throttling(
+    ec2connect_mock,
+    get_owned_imgs_mock,
+    sleep_mock,
+    caplog
+):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.return_value = mock_get_owned_images()
+    throttled = ClientError(
+        {'Error': {'Code': 'RequestLimitExceeded'}},
+        'ModifySnapshotAttribute'
+    )
+    ec2.modify_snapshot_attribute.side_effect = [throttled, None, None]
+
+    publisher = ec2pubimg.EC2PublishImage(
+        allow_copy='123456789012',
+        image_name_fragment='Image',
+        max_workers=8,
+        visibility='123456789012',
+        log_callback=logger
+    )
+    with caplog.at_level(logging.DEBUG, logger='ec2imgutils'):
+        publisher.publish_images()
+
+    assert ec2.modify_image_attribute.call_count == 2
+    assert ec2.modify_snapshot_attribute.call_count == 3
+    assert sleep_mock.call_count == 1
+    # The summary is in image order regardless of completion order
+    assert caplog.text.index('ami-000cc31892067693a') < \
+        caplog.text.index('ami-000cc31892067693b')
+
+
+# -----------------------------------------------------------------------------
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._get_owned_images')
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._connect')
+def test_publish_images_failure(
+    ec2connect_mock,
+    get_owned_imgs_mock,
+    caplog
+):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.return_value = mock_get_owned_images()
+    ec2.modify_snapshot_attribute.side_effect = [
+        None,
+        ClientError({'Error': {'Code': 'AccessDenied'}}, 'Modify')
+    ]
+
+    publisher = ec2pubimg.EC2PublishImage(
+        allow_copy='image',
+        image_name_fragment='Image',
+        max_workers=1,
+        visibility='all',
+        log_callback=logger
+    )
+    with pytest.raises(EC2PublishImgException) as e:
+        publisher.publish_images()
+    assert 'ami-000cc31892067693b' in str(e.value)
+    assert 'Failed to publish: ami-000cc31892067693b' in caplog.text
+
+
+# -----------------------------------------------------------------------------
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._get_owned_images')
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._connect')
+def test_publish_images_already_public(ec2connect_mock, get_owned_imgs_mock):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    images = mock_get_owned_images()
+    get_owned_imgs_mock.return_value = images
+    ec2.describe_images.return_value = {'Images': images}
+    ec2.describe_snapshot_attribute.return_value = {
+        'CreateVolumePermissions': [{'Group': 'all'}]
+    }
+
+    publisher = ec2pubimg.EC2PublishImage(
+        allow_copy='image',
+        image_name_fragment='Image',
+        visibility='all',
+        log_callback=logger
+    )
+    publisher.publish_images()
+
+    ec2.modify_image_attribute.assert_not_called()
+    ec2.modify_snapshot_attribute.assert_not_called()
+    # The image launch permissions are known from the public state
+    ec2.describe_image_attribute.assert_not_called()
+    assert ec2.describe_snapshot_attribute.call_count == 2
+
+
+# -----------------------------------------------------------------------------
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._get_owned_images')
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._connect')
+def test_publish_images_share_missing_accounts(
+    ec2connect_mock,
+    get_owned_imgs_mock
+):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.return_value = mock_get_owned_images()[:1]
+    ec2.describe_image_attribute.return_value = {
+        'LaunchPermissions': [{'UserId': '123456789012'}]
+    }
+    ec2.describe_snapshot_attribute.return_value = {
+        'CreateVolumePermissions': [
+            {'UserId': '123456789012'},
+            {'UserId': '210987654321'}
+        ]
+    }
+
+    publisher = ec2pubimg.EC2PublishImage(
+        allow_copy='image',
+        image_name_fragment='Image',
+        visibility='123456789012,210987654321',
+        log_callback=logger
+    )
+    publisher.publish_images()
+
+    ec2.describe_images.assert_not_called()
+    ec2.modify_image_attribute.assert_called_once_with(
+        ImageId='ami-000cc31892067693a',
+        LaunchPermission={'Add': [{'UserId': '210987654321'}]}
+    )
+    ec2.modify_snapshot_attribute.assert_not_called()
+
+
+# -----------------------------------------------------------------------------
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._get_owned_images')
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._connect')
+def test_publish_images_large_share_list(
+    ec2connect_mock,
+    get_owned_imgs_mock
+):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.return_value = mock_get_owned_images()[:1]
+    accounts = ['%012d' % account for account in range(250)]
+    ec2.describe_image_attribute.return_value = {
+        'LaunchPermissions': [{'UserId': accounts[0]}]
+    }
+    ec2.describe_snapshot_attribute.return_value = {
+        'CreateVolumePermissions': []
+    }
+
+    publisher = ec2pubimg.EC2PublishImage(
+        allow_copy='image',
+        image_name_fragment='Image',
+        visibility=','.join(accounts + accounts[:10]),
+        log_callback=logger
+    )
+    publisher.publish_images()
+
+    # 249 missing accounts in chunks of 100, duplicates dropped
+    shared = []
+    for call in ec2.modify_image_attribute.call_args_list:
+        chunk = call[1]['LaunchPermission']['Add']
+        assert len(chunk) <= 100
+        shared += [permission['UserId'] for permission in chunk]
+    assert ec2.modify_image_attribute.call_count == 3
+    assert sorted(shared) == accounts[1:]
+    assert ec2.modify_snapshot_attribute.call_count == 3
+
+
+# -----------------------------------------------------------------------------
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._get_owned_images')
+@patch('ec2imgutils.ec2publishimg.EC2PublishImage._connect')
+def test_publish_images_share_with_organization(
+    ec2connect_mock,
+    get_owned_imgs_mock,
+    caplog
+):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    get_owned_imgs_mock.return_value = mock_get_owned_images()[:1]
+    ec2.describe_image_attribute.return_value = {'LaunchPermissions': []}
+    org_arn = 'arn:aws:organizations::123456789012:organization/o-abcdef1234'
+
+    publisher = ec2pubimg.EC2PublishImage(
+        allow_copy='image',
+        image_name_fragment='Image',
+        visibility=org_arn,
+        log_callback=logger
+    )
+    publisher.publish_images()
+
+    ec2.modify_image_attribute.assert_called_once_with(
+        ImageId='ami-000cc31892067693a',
+        LaunchPermission={'Add': [{'OrganizationArn': org_arn}]}
+    )
+    ec2.modify_snapshot_attribute.assert_not_called()
+    assert 'Snapshots cannot be shared with organizations' in caplog.text
+
+
+# -----------------------------------------------------------------------------
+def test_publish_invalid_share_list():
+    with pytest.raises(EC2PublishImgException):
+        ec2pubimg.EC2PublishImage(
+            visibility='123456789012,12345',
+            log_callback=logger
+        )
+
+
+# --------------------------------------------------------------------
+# Aux functions
+def mock_get_owned_images():
+    images = []
+    for suffix in ['a', 'b']:
+        images.append({
+            'Architecture': 'x86_64',
+            'CreationDate': '2022-04-11T14:01:58.000Z',
+            'ImageId': 'ami-000cc31892067693%s' % suffix,
+            'Name': 'testImage%s' % suffix,
+            'State': 'available',
+            'BlockDeviceMappings': [
+                {
+                    'DeviceName': '/dev/sda1',
+                    'Ebs': {
+                        'DeleteOnTermination': True,
+                        'SnapshotId': 'snap-000f48a8fa4545e1%s' % suffix,
+                        'VolumeSize': 10,
+                        'VolumeType': 'gp3',
+                        'Encrypted': False
+                    }
+                }
+            ]
+        })
+    return images
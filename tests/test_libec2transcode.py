@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2026 SUSE LLC.  All rights reserved.
+#
+# This file is part of ec2utils
+#
+# ec2utils is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# ec2utils is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ec2utils. If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+import logging
+import lzma
+import os
+import pytest
+import shutil
+import struct
+import subprocess
+import tarfile
+
+import ec2imgutils.ec2transcode as ec2transcode
+
+from ec2imgutils.ec2imgutilsExceptions import EC2TranscodeException
+from unittest.mock import MagicMock, patch
+
+logger = logging.getLogger('ec2imgutils')
+logger.setLevel(logging.INFO)
+
+zstd_available = ec2transcode.zstandard or shutil.which('zstd')
+
+
+def decompress(path):
+    """Return the uncompressed content of the given zstd file"""
+    if ec2transcode.zstandard:
+        with open(path, 'rb') as compressed:
+            return ec2transcode.zstandard.ZstdDecompressor().stream_reader(
+                compressed, read_across_frames=True
+            ).read()
+    return subprocess.run(
+        ['zstd', '-dc', path], stdout=subprocess.PIPE, check=True
+    ).stdout
+
+
+# -----------------------------------------------------------------------------
+def test_get_transcoded_name():
+    assert ec2transcode.get_transcoded_name('disk.raw.xz') == 'disk.raw.zst'
+    assert ec2transcode.get_transcoded_name('disk.raw') == 'disk.raw.zst'
+    assert ec2transcode.get_transcoded_name('disk.tar.gz') == 'disk.raw.zst'
+    assert ec2transcode.is_transcodable('disk.raw.xz')
+    assert not ec2transcode.is_transcodable('disk.raw.zst')
+
+
+# -----------------------------------------------------------------------------
+def test_open_image_archive(tmp_path):
+    raw_image = tmp_path / 'disk.raw.xz'
+    raw_image.write_bytes(lzma.compress(b'ec2' * 1024))
+    readme = tmp_path / 'README'
+    readme.write_bytes(b'readme')
+    archive = tmp_path / 'image.tar.gz'
+    with tarfile.open(archive, 'w:gz') as tar:
+        tar.add(readme, 'README')
+        tar.add(raw_image, 'image/disk.raw.xz')
+
+    archives = []
+    tarfile_open = tarfile.open
+
+    def open_archive(*args, **kwargs):
+        archives.append(tarfile_open(*args, **kwargs))
+        return archives[-1]
+
+    with patch('ec2imgutils.ec2transcode.tarfile.open', open_archive):
+        with ec2transcode.open_image(str(archive)) as (name, image):
+            assert name == 'disk.raw.xz'
+            assert image.read() == b'ec2' * 1024
+    # The member and the archive are closed on exit
+    assert image.closed
+    assert archives[0].closed
+
+    with tarfile.open(archive, 'w:gz') as tar:
+        tar.add(readme, 'README')
+    with pytest.raises(EC2TranscodeException) as error:
+        with ec2transcode.open_image(str(archive)):
+            pass
+    assert 'Unable to find raw image file' in str(error.value)
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.skipif(not zstd_available, reason='zstd is not available')
+def test_transcode_image(tmp_path):
+    data = os.urandom(1024 * 1024) + bytes(8 * 1024 * 1024)
+    source = tmp_path / 'disk.raw.xz'
+    source.write_bytes(lzma.compress(data))
+    target_dir = tmp_path / 'transcoded'
+    target_dir.mkdir()
+
+    target = ec2transcode.transcode_image(
+        str(source), str(target_dir), level=1, workers=2, log_callback=logger
+    )
+    assert target == str(target_dir / 'disk.raw.zst')
+    assert decompress(target) == data
+
+
+# -----------------------------------------------------------------------------
+@pytest.mark.skipif(not zstd_available, reason='zstd is not available')
+@patch('ec2imgutils.ec2transcode.TRANSCODE_FRAME_SIZE', 1000)
+def test_zstd_writer_frames(tmp_path):
+    data = os.urandom(3500)
+    target = tmp_path / 'disk.raw.zst'
+    with ec2transcode.ZstdWriter(str(target), 3, 2) as writer:
+        writer.write(data[:1500])
+        writer.write(data[1500:])
+
+    # Every frame is preceded by the skippable frame holding its size
+    content = target.read_bytes()
+    frames = []
+    while content:
+        magic, size, frame_size = struct.unpack('<III', content[:12])
+        assert (magic, size) == (0x184D2A50, 4)
+        frames.append(content[12:12 + frame_size])
+        content = content[12 + frame_size:]
+    assert len(frames) == 4
+    assert all(frame.startswith(b'\x28\xb5\x2f\xfd') for frame in frames)
+    assert decompress(str(target)) == data
+
+
+# -----------------------------------------------------------------------------
+@patch('ec2imgutils.ec2transcode.ZstdWriter')
+@patch('ec2imgutils.ec2transcode.select_compression_level')
+def test_transcode_image_bandwidth(
+    select_compression_level_mock, zstd_writer_mock, tmp_path
+):
+    select_compression_level_mock.return_value = 9
+
+    def zstd_writer(target, level, workers):
+        open(target, 'wb').close()
+        return MagicMock()
+    zstd_writer_mock.side_effect = zstd_writer
+    source = tmp_path / 'disk.raw'
+    source.write_bytes(b'data')
+    ec2transcode.transcode_image(
+        str(source), str(tmp_path), bandwidth=12500000, workers=4
+    )
+    select_compression_level_mock.assert_called_once_with(
+        b'data', 12500000, 4
+    )
+    zstd_writer_mock.assert_called_once_with(
+        str(tmp_path / 'disk.raw.zst'), 9, 4
+    )
+
+
+# -----------------------------------------------------------------------------
+def test_transcode_image_corrupt(tmp_path):
+    source = tmp_path / 'disk.raw.xz'
+    source.write_bytes(b'not xz data')
+    with pytest.raises(EC2TranscodeException) as error:
+        ec2transcode.transcode_image(str(source), str(tmp_path), level=1)
+    assert 'Unable to transcode image file' in str(error.value)
+
+
+# -----------------------------------------------------------------------------
+@patch('ec2imgutils.ec2transcode.shutil.which')
+@patch('ec2imgutils.ec2transcode.zstandard', None)
+def test_transcode_without_zstd(which_mock, tmp_path):
+    which_mock.return_value = None
+    with pytest.raises(EC2TranscodeException) as error:
+        ec2transcode.ZstdWriter(str(tmp_path / 'disk.raw.zst'), 3, 1)
+    assert 'requires the zstandard module or the zstd command' in str(
+        error.value
+    )
+
+
+# -----------------------------------------------------------------------------
+@patch('ec2imgutils.ec2transcode.time.monotonic')
+@patch('ec2imgutils.ec2transcode.compress_sample')
+def test_select_compression_level(compress_sample_mock, monotonic_mock):
+    sample = bytes(1000)
+    # Compressed sizes and durations of levels 1, 3 and 6
+    compress_sample_mock.side_effect = [bytes(500), bytes(400), bytes(300)]
+    monotonic_mock.side_effect = [0, 1, 1, 3, 3, 13]
+
+    # On a slow link the smaller output of level 3 wins, level 6 is
+    # compression bound and no higher level is tried
+    level = ec2transcode.select_compression_level(
+        sample, bandwidth=100, workers=2, levels=(1, 3, 6, 9)
+    )
+    assert level == 3
+    assert compress_sample_mock.call_count == 3
+
+    # On a fast link the fastest compression wins
+    compress_sample_mock.side_effect = [bytes(500), bytes(400)]
+    monotonic_mock.side_effect = [0, 1, 1, 3]
+    level = ec2transcode.select_compression_level(
+        sample, bandwidth=100000, workers=2, levels=(1, 3, 6, 9)
+    )
+    assert level == 1
@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2026 SUSE LLC.  All rights reserved.
+#
+# This file is part of ec2utils
+#
+# ec2utils is free software: you can redistribute it
+# and/or modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation, either version 3 of
+# the License, or (at your option) any later version.
+#
+# ec2utils is distributed in the hope that it will
+# be useful, but WITHOUT ANY WARRANTY; without even the implied warranty
+# of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ec2utils. If not, see
+# <http://www.gnu.org/licenses/>.
+#
+
+import io
+import logging
+import pytest
+
+import ec2imgutils.ec2transfer as ec2transfer
+
+from ec2imgutils.ec2imgutilsExceptions import EC2TransferException
+from unittest.mock import MagicMock, patch
+
+logger = logging.getLogger('ec2imgutils')
+logger.setLevel(logging.INFO)
+
+
+class LocalSSHTransferBackend(ec2transfer.OpenSSHTransferBackend):
+    """Run the remote commands of the openssh backend on the local host"""
+
+    def _get_ssh_command(self, command):
+        return ['sh', '-c', command]
+
+
+class BenchmarkStandIn:
+    """Transfer backend with a fixed duration of the upload"""
+
+    def __init__(self, name, error=None):
+        self.name = name
+        self.error = error
+        self.log = logger
+        self.ssh_client = MagicMock()
+
+    def upload(self, source, target, progress=None):
+        if self.error:
+            raise self.error
+
+
+# -----------------------------------------------------------------------------
+def test_get_transfer_backend():
+    ssh_client = MagicMock()
+    backend = ec2transfer.get_transfer_backend(
+        'openssh',
+        ssh_client,
+        'ec2-user',
+        '/key.pem',
+        timeout=60,
+        log_callback=logger,
+        cipher='chacha20-poly1305@openssh.com',
+        compression=True
+    )
+    assert isinstance(backend, ec2transfer.OpenSSHTransferBackend)
+    assert backend.cipher == 'chacha20-poly1305@openssh.com'
+    assert backend.compression
+    assert backend.timeout == 60
+
+    backend = ec2transfer.get_transfer_backend(
+        'paramiko-tuned', ssh_client, 'ec2-user', '/key.pem'
+    )
+    assert isinstance(backend, ec2transfer.TunedParamikoTransferBackend)
+    assert backend.ssh_client == ssh_client
+
+    with pytest.raises(EC2TransferException) as error:
+        ec2transfer.get_transfer_backend(
+            'scp', ssh_client, 'ec2-user', '/key.pem'
+        )
+    assert 'Unknown transfer backend "scp"' in str(error.value)
+
+
+# -----------------------------------------------------------------------------
+def test_openssh_command():
+    ssh_client = MagicMock()
+    ssh_client.get_transport().getpeername.return_value = ('10.0.0.1', 22)
+    backend = ec2transfer.OpenSSHTransferBackend(
+        ssh_client, 'ec2-user', '/key.pem', timeout=60, compression=True
+    )
+    command = backend._get_ssh_command('dd of=/dev/xvdg bs=32k')
+    assert command[:7] == [
+        'ssh', '-i', '/key.pem', '-l', 'ec2-user',
+        '-c', ec2transfer.DEFAULT_SSH_CIPHER
+    ]
+    assert 'BatchMode=yes' in command
+    assert 'ConnectTimeout=60' in command
+    assert '-C' in command
+    assert command[-2:] == ['10.0.0.1', 'dd of=/dev/xvdg bs=32k']
+
+
+# -----------------------------------------------------------------------------
+def test_openssh_upload(tmp_path):
+    source = tmp_path / 'image.raw'
+    source.write_bytes(b'ec2' * 1024 * 1024)
+    target = tmp_path / 'target dir'
+    target.mkdir()
+    progress = MagicMock()
+    backend = LocalSSHTransferBackend(
+        MagicMock(), 'ec2-user', '/key.pem', log_callback=logger
+    )
+    backend.upload(str(source), str(target / 'image.raw'), progress)
+    assert (target / 'image.raw').read_bytes() == source.read_bytes()
+    progress.assert_called_with(3 * 1024 * 1024, 3 * 1024 * 1024)
+
+
+# -----------------------------------------------------------------------------
+def test_openssh_stream_remote_failure(tmp_path):
+    source = tmp_path / 'image.raw'
+    source.write_bytes(b'\0' * 1024)
+    backend = LocalSSHTransferBackend(
+        MagicMock(), 'ec2-user', '/key.pem', log_callback=logger
+    )
+    with pytest.raises(EC2TransferException) as error:
+        backend.stream(str(source), 'echo broken image >&2; exit 3')
+    assert 'failed with exit status 3' in str(error.value)
+    assert 'broken image' in str(error.value)
+
+
+# -----------------------------------------------------------------------------
+@patch('ec2imgutils.ec2transfer.paramiko.SFTPClient.from_transport')
+def test_tuned_paramiko_upload(from_transport_mock, tmp_path):
+    source = tmp_path / 'image.raw'
+    source.write_bytes(b'ec2' * 1024 * 1024)
+    remote = io.BytesIO()
+    remote.set_pipelined = MagicMock()
+    sftp = from_transport_mock.return_value
+    sftp.open.return_value.__enter__.return_value = remote
+    ssh_client = MagicMock()
+    backend = ec2transfer.TunedParamikoTransferBackend(
+        ssh_client, 'ec2-user', '/key.pem', timeout=60
+    )
+    backend.upload(str(source), '/mnt/image.raw')
+
+    from_transport_mock.assert_called_once_with(
+        ssh_client.get_transport(),
+        window_size=ec2transfer.TUNED_WINDOW_SIZE,
+        max_packet_size=ec2transfer.TUNED_MAX_PACKET_SIZE
+    )
+    sftp.get_channel().settimeout.assert_called_once_with(60)
+    sftp.open.assert_called_once_with('/mnt/image.raw', 'wb')
+    remote.set_pipelined.assert_called_once_with(True)
+    assert remote.getvalue() == source.read_bytes()
+    sftp.close.assert_called_once_with()
+
+
+# -----------------------------------------------------------------------------
+@patch('ec2imgutils.ec2transfer.time.monotonic')
+def test_select_transfer_backend(monotonic_mock):
+    slow = BenchmarkStandIn('paramiko')
+    broken = BenchmarkStandIn('openssh', OSError('no ssh client'))
+    fast = BenchmarkStandIn('paramiko-tuned')
+    # start and end of the slow and the fast upload, the broken backend
+    # has no end
+    monotonic_mock.side_effect = [0, 4, 10, 20, 21]
+
+    backend = ec2transfer.select_transfer_backend(
+        [slow, broken, fast], size=1024, target='/tmp/bench'
+    )
+    assert backend == fast
+    fast.ssh_client.exec_command.assert_called_once_with('rm -f /tmp/bench')
+
+
+# -----------------------------------------------------------------------------
+def test_select_transfer_backend_none_usable():
+    broken = BenchmarkStandIn('openssh', OSError('no ssh client'))
+    with pytest.raises(EC2TransferException) as error:
+        ec2transfer.select_transfer_backend([broken], size=1024)
+    assert 'No transfer backend is usable' in str(error.value)
+
+
+# -----------------------------------------------------------------------------
+def test_openssh_connection_failure(tmp_path):
+    source = tmp_path / 'image.raw'
+    source.write_bytes(b'\0' * 1024)
+    backend = LocalSSHTransferBackend(
+        MagicMock(), 'ec2-user', '/key.pem', log_callback=logger
+    )
+    with pytest.raises(ConnectionError) as error:
+        backend.stream(
+            str(source), 'cat > /dev/null; echo reset >&2; exit 255'
+        )
+    assert 'reset' in str(error.value)
+
+
+# -----------------------------------------------------------------------------
+def test_transfer_backend_is_abstract():
+    with pytest.raises(TypeError):
+        ec2transfer.EC2TransferBackend(MagicMock(), 'ec2-user', '/key.pem')
+    assert ec2transfer.TunedParamikoTransferBackend.supports_sftp
+    assert not ec2transfer.OpenSSHTransferBackend.supports_sftp
+
+
+# -----------------------------------------------------------------------------
+def test_openssh_stream_aborted(tmp_path):
+    source = tmp_path / 'image.raw'
+    source.write_bytes(b'\0' * 4 * ec2transfer.TRANSFER_CHUNK_SIZE)
+    backend = LocalSSHTransferBackend(
+        MagicMock(), 'ec2-user', '/key.pem', log_callback=logger
+    )
+    processes = []
+    popen = ec2transfer.subprocess.Popen
+
+    def run(*args, **kwargs):
+        processes.append(popen(*args, **kwargs))
+        return processes[-1]
+
+    def progress(transferred_bytes, total_bytes):
+        raise KeyboardInterrupt
+
+    with patch('ec2imgutils.ec2transfer.subprocess.Popen', side_effect=run):
+        with pytest.raises(KeyboardInterrupt):
+            backend.stream(
+                str(source), 'cat > /dev/null; sleep 60', progress
+            )
+    # The ssh client is ended instead of left running
+    assert processes[0].returncode is not None
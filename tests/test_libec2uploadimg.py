@@ -19,12 +19,16 @@
 # <http://www.gnu.org/licenses/>.
 #
 
+import base64
+import hashlib
 import inspect
 import logging
 import os
 import pytest
 import socket
 import sys
+import tarfile
+import threading
 
 
 from unittest.mock import patch, MagicMock, call
@@ -36,6 +40,7 @@ code_path = os.path.abspath('%s/../lib' % test_path)
 sys.path.insert(0, code_path)
 
 import ec2imgutils.ec2uploadimg as ec2upimg  # noqa: E402
+import ec2imgutils.ec2utils as ec2utils  # noqa: E402
 from ec2imgutils.ec2imgutilsExceptions import (  # noqa: E402
     EC2UploadImgException
 )
@@ -1090,7 +1095,14 @@ def test_create_snapshot(
     # assertions
     assert resp['SnapshotId'] == snapshot['SnapshotId']
     ec2.assert_has_calls([
-        call.create_snapshot(VolumeId='myVolumeId', Description='AWS EC2 AMI'),
+        call.create_snapshot(
+            VolumeId='myVolumeId',
+            Description='AWS EC2 AMI',
+            TagSpecifications=[{
+                'ResourceType': 'snapshot',
+                'Tags': [ec2utils.SNAPSHOT_CREATOR_TAG]
+            }]
+        ),
         call.get_waiter('snapshot_completed')
     ])
 
@@ -1360,30 +1372,58 @@ def test_device_exists(
     execute_ssh_command_mock.assert_has_calls([call('ls myDeviceId')])
 
 
-@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._execute_ssh_command')
+def dd_ssh_client(max_sectors_kb, progress, exit_status=0):
+    """SSH client running dd with the given terminal output"""
+    ssh_client = MagicMock()
+    stdout = MagicMock()
+    stdout.read.return_value = max_sectors_kb
+    stdout.channel.recv.side_effect = progress + [b'']
+    stdout.channel.recv_exit_status.return_value = exit_status
+    ssh_client.exec_command.return_value = (MagicMock(), stdout, MagicMock())
+    return ssh_client
+
+
 def test_dump_root_fs(
-    execute_ssh_command_mock,
     caplog
 ):
     # Mocks
-    execute_ssh_command_mock.return_value = 'success'
+    ssh_client = dd_ssh_client(b'256\n', [
+        b'1073741824 bytes (1.1 GB, 1.0 GiB) copied, 4 s, 268 MB/s\r',
+        b'2147483648 bytes (2.1 GB, 2.0 GiB) copied, 8 s, 268 MB/s\r215',
+        b'0 records in\n2048+0 records out\n2147483648 bytes (2.1 GB, '
+        b'2.0 GiB) copied, 8,0 s, 268 MB/s\n'
+    ])
 
     # Instance creation
     uploader = ec2upimg.EC2ImageUploader(
         access_key='',
+        inst_user_name='ec2-user',
         wait_count=1,
         log_callback=logger
     )
-    result = uploader._dump_root_fs(
-        'myImageDir',
-        'rawImageName',
-        'targetRootDevice'
-    )
+    uploader.ssh_client = ssh_client
+    with caplog.at_level(logging.INFO):
+        result = uploader._dump_root_fs(
+            'myImageDir',
+            'rawImageName',
+            'targetRootDevice'
+        )
 
     # assertions
-    assert result == 'success'
-    execute_ssh_command_mock.assert_has_calls([
-        call('dd if=myImageDir/rawImageName of=targetRootDevice bs=32k')
+    assert result == 256 * 1024 ** 2
+    assert 'Wrote 2.0 GiB to targetRootDevice in 8.0s, 256.0 MiB/s' in \
+        caplog.text
+    ssh_client.exec_command.assert_has_calls([
+        call(
+            'cat /sys/block/$(basename $(readlink -f targetRootDevice))'
+            '/queue/max_sectors_kb'
+        ),
+        call(
+            'sudo dd if=myImageDir/rawImageName of=targetRootDevice '
+            'bs=4096K iflag=fullblock oflag=direct conv=sparse '
+            'status=progress',
+            get_pty=True
+        )
     ])
 
 
@@ -1931,6 +1971,124 @@ def test_upload_image(
     ])
 
 
+@patch('ec2imgutils.ec2uploadimg.transfer.get_transfer_backend')
+def test_upload_image_transfer_backend(get_transfer_backend_mock, caplog):
+    # Mocks
+    ssh_client_mock = MagicMock()
+    backend = get_transfer_backend_mock.return_value
+    backend.name = 'openssh'
+    backend.supports_sftp = False
+
+    # Instance creation
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        transfer_backend='openssh',
+        ssh_cipher='aes256-ctr'
+    )
+    uploader.ssh_client = ssh_client_mock
+    uploader.ssh_key_private_key_file = '/key.pem'
+    uploader.inst_user_name = 'ec2-user'
+
+    response = uploader._upload_image('targetDir', '/test/imageName.raw')
+
+    # assertions
+    assert response == 'imageName.raw'
+    get_transfer_backend_mock.assert_called_once_with(
+        'openssh',
+        ssh_client_mock,
+        'ec2-user',
+        '/key.pem',
+        timeout=900,
+        log_callback=logger,
+        cipher='aes256-ctr',
+        compression=False
+    )
+    backend.upload.assert_called_once_with(
+        '/test/imageName.raw',
+        'targetDir/imageName.raw',
+        uploader._transfer_progress
+    )
+    ssh_client_mock.open_sftp().put.assert_not_called()
+    assert 'the sparse upload is skipped' in caplog.text
+
+    # An abort ends the transfer
+    uploader.aborted = True
+    with pytest.raises(EC2UploadImgException):
+        uploader._transfer_progress(1, 2)
+
+
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._upload_sparse_image')
+@patch('ec2imgutils.ec2uploadimg.transfer.paramiko.SFTPClient.from_transport')
+def test_upload_image_tuned_transfer_backend_sparse(
+    from_transport_mock,
+    upload_sparse_image_mock
+):
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        transfer_backend='paramiko-tuned'
+    )
+    uploader.ssh_client = MagicMock()
+    uploader._upload_image('targetDir', '/test/imageName.raw')
+
+    # The sparse upload runs over the SFTP session of the tuned backend
+    sftp = from_transport_mock.return_value
+    upload_sparse_image_mock.assert_called_once_with(
+        sftp, '/test/imageName.raw', 'targetDir/imageName.raw'
+    )
+    assert from_transport_mock.call_args[1]['window_size'] == \
+        ec2upimg.transfer.TUNED_WINDOW_SIZE
+    uploader.ssh_client.open_sftp.assert_not_called()
+
+
+@patch('ec2imgutils.ec2uploadimg.transfer.select_transfer_backend')
+def test_get_transfer_backend_auto_sftp_required(select_transfer_backend_mock):
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        log_callback=logger,
+        transfer_backend='auto'
+    )
+    uploader.ssh_client = MagicMock()
+    selected = select_transfer_backend_mock.return_value
+    selected.name = 'paramiko-tuned'
+
+    assert uploader._get_transfer_backend(sftp_required=True) == selected
+    # Backends without SFTP are not benchmarked for a sparse upload
+    names = [
+        backend.name
+        for backend in select_transfer_backend_mock.call_args[0][0]
+    ]
+    assert names == ['paramiko', 'paramiko-tuned']
+    # The choice is kept for a resumed upload
+    assert uploader.transfer_backend == 'paramiko-tuned'
+
+
+def test_openssh_transfer_backend_upload_channels():
+    with pytest.raises(EC2UploadImgException) as error:
+        ec2upimg.EC2ImageUploader(
+            access_key='',
+            log_callback=logger,
+            transfer_backend='openssh',
+            upload_channels=4
+        )
+    assert 'requires an SFTP based transfer_backend' in str(error.value)
+
+
+# -----------------------------------------------------------------------------
+def test_invalid_transfer_backend():
+    with pytest.raises(EC2UploadImgException) as error:
+        ec2upimg.EC2ImageUploader(
+            access_key='',
+            log_callback=logger,
+            transfer_backend='scp'
+        )
+    assert 'transfer_backend must be one of' in str(error.value)
+
+
+# -----------------------------------------------------------------------------
 @patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._upload_progress')
 def test_upload_image_socket_timeout(
     upload_progress_mock,
@@ -1946,7 +2104,8 @@ def test_upload_image_socket_timeout(
     uploader = ec2upimg.EC2ImageUploader(
         access_key='',
         wait_count=1,
-        log_callback=logger
+        log_callback=logger,
+        upload_resume_attempts=0
     )
     uploader.ssh_client = ssh_client_mock
 
@@ -1989,7 +2148,7 @@ def test_unpack_image(
     assert response == 'fileName1'
     execute_ssh_command_mock.assert_has_calls([
         call('tar -C imageDir -xvf imageDir/imageFilename.tgz'),
-        call('xz -d imageDir/fileName1.xz')
+        call('xz -d -T0 imageDir/fileName1.xz')
     ])
 
 
@@ -2011,6 +2170,114 @@ def test_unpack_image_aborted(
     assert response is None
 
 
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._execute_ssh_command')
+def test_unpack_image_zstd(execute_ssh_command_mock):
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger
+    )
+    response = uploader._unpack_image('imageDir', 'disk.raw.zst')
+
+    assert response == 'disk.raw'
+    execute_ssh_command_mock.assert_called_once_with(
+        '$(command -v pzstd || echo zstd) -d -q --rm imageDir/disk.raw.zst'
+    )
+
+
+@patch('ec2imgutils.ec2uploadimg.transcode.transcode_image')
+def test_transcode_image(transcode_image_mock):
+    # Mocks
+    transcode_image_mock.return_value = '/tmp/dir/disk.raw.zst'
+
+    # Instance creation
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        transcode=True,
+        transcode_level=6,
+        link_bandwidth=12500000
+    )
+
+    assert uploader._transcode_image('disk.raw.zst') == 'disk.raw.zst'
+    response = uploader._transcode_image('/images/disk.raw.xz')
+
+    # assertions
+    assert response == '/tmp/dir/disk.raw.zst'
+    transcoded_image_dir = uploader.transcoded_image_dir
+    assert os.path.isdir(transcoded_image_dir)
+    transcode_image_mock.assert_called_once_with(
+        '/images/disk.raw.xz',
+        transcoded_image_dir,
+        level=6,
+        bandwidth=12500000,
+        log_callback=logger
+    )
+    uploader._remove_transcoded_image()
+    assert not os.path.exists(transcoded_image_dir)
+
+
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._get_command_from_instance')
+def test_check_transcoded_image(get_command_from_instance_mock, tmp_path):
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        transcode=True
+    )
+    uploader.transcoded_image_dir = str(tmp_path)
+    get_command_from_instance_mock.return_value = '/usr/bin/zstd'
+    assert uploader._check_transcoded_image(
+        'disk.raw.xz', 'disk.raw.zst'
+    ) == 'disk.raw.zst'
+
+    # pzstd alone inflates the image as well
+    get_command_from_instance_mock.side_effect = \
+        lambda command: '/usr/bin/pzstd' if command == 'pzstd' else ''
+    assert uploader._check_transcoded_image(
+        'disk.raw.xz', 'disk.raw.zst'
+    ) == 'disk.raw.zst'
+    get_command_from_instance_mock.side_effect = None
+
+    # Without zstd on the helper instance the image is uploaded as is
+    get_command_from_instance_mock.return_value = ''
+    assert uploader._check_transcoded_image(
+        'disk.raw.xz', 'disk.raw.zst'
+    ) == 'disk.raw.xz'
+    assert not os.path.exists(str(tmp_path))
+    assert uploader.transcoded_image_dir is None
+
+
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._launch_helper_instance')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._transcode_image')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._check_image_exists')
+def test_create_image_root_volume_transcodes_before_launch(
+    check_image_exists_mock,
+    transcode_image_mock,
+    launch_helper_instance_mock,
+    tmp_path
+):
+    steps = MagicMock()
+    steps.attach_mock(transcode_image_mock, 'transcode')
+    steps.attach_mock(launch_helper_instance_mock, 'launch')
+    launch_helper_instance_mock.side_effect = EC2UploadImgException('quota')
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        transcode=True
+    )
+    uploader.transcoded_image_dir = str(tmp_path)
+
+    with pytest.raises(EC2UploadImgException):
+        uploader._create_image_root_volume('disk.raw.xz')
+
+    assert [step[0] for step in steps.mock_calls] == ['transcode', 'launch']
+    # The transcoded image is removed when the helper cannot be launched
+    assert not os.path.exists(str(tmp_path))
+
+
 @patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._register_image')
 @patch('ec2imgutils.ec2uploadimg.EC2ImageUploader.create_snapshot')
 def test_create_image(
@@ -2173,3 +2440,922 @@ def test_invalid_imds_value():
         )
     msg = "imds_support must be one of ['2.0', 'v2.0']"
     assert msg in str(e)
+
+
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._connect')
+def test_copy_image_to_regions(ec2connect_mock):
+    clients = {}
+
+    def connect(region=None):
+        return clients.setdefault(region, MagicMock())
+    ec2connect_mock.side_effect = connect
+
+    clients[None] = MagicMock()
+    clients[None].describe_images.return_value = {
+        'Images': [{
+            'RootDeviceName': '/dev/sda1',
+            'BlockDeviceMappings': [
+                {'DeviceName': '/dev/sda1', 'Ebs': {'SnapshotId': 'snap-0'}}
+            ]
+        }]
+    }
+    for region, state in (('region2', 'completed'), ('region3', 'error')):
+        clients[region] = MagicMock()
+        clients[region].copy_snapshot.return_value = {
+            'SnapshotId': 'snap-' + region
+        }
+        clients[region].describe_snapshots.side_effect = [
+            {'Snapshots': [{'State': 'pending'}]},
+            {'Snapshots': [{'State': state}]}
+        ]
+        clients[region].register_image.return_value = {
+            'ImageId': 'ami-' + region
+        }
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        region='region1',
+        sriov_type='simple',
+        wait_count=1,
+        log_callback=logger,
+        image_tags=[{'Key': 'team', 'Value': 'cloud'}]
+    )
+    uploader.copy_min_delay = 0
+    results = uploader.copy_image_to_regions('ami-0', ['region2', 'region3'])
+
+    assert results['region2'] == ('ami-region2', None)
+    assert results['region3'][0] is None
+    assert 'is in state error' in str(results['region3'][1])
+    clients['region2'].copy_snapshot.assert_called_once_with(
+        SourceRegion='region1',
+        SourceSnapshotId='snap-0',
+        Description='AWS EC2 AMI',
+        TagSpecifications=[{
+            'ResourceType': 'snapshot',
+            'Tags': [ec2utils.SNAPSHOT_CREATOR_TAG]
+        }]
+    )
+    # The register options and tags are re-applied in the target region
+    register_args = clients['region2'].register_image.call_args[1]
+    assert register_args['SriovNetSupport'] == 'simple'
+    assert register_args['BlockDeviceMappings'][0]['Ebs']['SnapshotId'] == \
+        'snap-region2'
+    clients['region2'].create_tags.assert_called_once_with(
+        Resources=['ami-region2'],
+        Tags=[{'Key': 'team', 'Value': 'cloud'}]
+    )
+    clients['region3'].register_image.assert_not_called()
+    # One client per region is used for all polls
+    assert ec2connect_mock.call_args_list.count(call('region2')) == 1
+
+
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._connect')
+def test_copy_image_to_regions_paravirtual(ec2connect_mock):
+    clients = {}
+
+    def connect(region=None):
+        return clients.setdefault(region, MagicMock())
+    ec2connect_mock.side_effect = connect
+
+    clients[None] = MagicMock()
+    clients[None].describe_images.return_value = {
+        'Images': [{
+            'RootDeviceName': '/dev/sda1',
+            'BlockDeviceMappings': [
+                {'DeviceName': '/dev/sda1', 'Ebs': {'SnapshotId': 'snap-0'}}
+            ]
+        }]
+    }
+    clients['region2'] = MagicMock()
+    clients['region2'].copy_snapshot.return_value = {
+        'SnapshotId': 'snap-region2'
+    }
+    clients['region2'].describe_snapshots.return_value = {
+        'Snapshots': [{'State': 'completed'}]
+    }
+    clients['region2'].register_image.return_value = {
+        'ImageId': 'ami-region2'
+    }
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        bootkernel='aki-region1',
+        image_virt_type='paravirtual',
+        region='region1',
+        wait_count=1,
+        log_callback=logger
+    )
+    uploader.copy_min_delay = 0
+    results = uploader.copy_image_to_regions(
+        'ami-0',
+        ['region2', 'region3'],
+        {'region2': 'aki-region2', 'region3': None}
+    )
+
+    # The kernel of the target region is registered, not the source one
+    assert results['region2'] == ('ami-region2', None)
+    register_args = clients['region2'].register_image.call_args[1]
+    assert register_args['KernelId'] == 'aki-region2'
+    # Without a kernel of the region the snapshot is not copied
+    assert results['region3'][0] is None
+    assert 'No boot kernel for the paravirtual image in region region3' in \
+        str(results['region3'][1])
+    assert 'region3' not in clients
+
+
+@patch('ec2imgutils.ec2uploadimg.time')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._connect')
+def test_copy_image_to_regions_timeout(ec2connect_mock, time_mock):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    ec2.describe_images.return_value = {
+        'Images': [{
+            'RootDeviceName': '/dev/sda1',
+            'BlockDeviceMappings': [
+                {'DeviceName': '/dev/sda1', 'Ebs': {'SnapshotId': 'snap-0'}}
+            ]
+        }]
+    }
+    ec2.copy_snapshot.return_value = {'SnapshotId': 'snap-1'}
+    ec2.describe_snapshots.return_value = {
+        'Snapshots': [{'State': 'pending'}]
+    }
+    clock = [0]
+
+    def sleep(seconds):
+        clock[0] += seconds
+    time_mock.time.side_effect = lambda: clock[0]
+    time_mock.sleep.side_effect = sleep
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        region='region1',
+        log_callback=logger,
+        copy_timeout=1000
+    )
+    results = uploader.copy_image_to_regions('ami-0', ['region2'])
+
+    assert 'did not complete within 1000 seconds' in str(results['region2'][1])
+    # The poll delay backs off from 10 up to 120 seconds
+    assert [
+        sleep_call[0][0] for sleep_call in time_mock.sleep.call_args_list
+    ] == [10, 20, 40, 80] + 7 * [120] + [10]
+    assert ec2.describe_snapshots.call_count == 12
+    ec2.register_image.assert_not_called()
+    # The pending copy is not left behind
+    ec2.delete_snapshot.assert_called_once_with(SnapshotId='snap-1')
+
+
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._connect')
+def test_copy_image_to_regions_aborted(ec2connect_mock):
+    ec2 = MagicMock()
+    ec2connect_mock.return_value = ec2
+    ec2.describe_images.return_value = {
+        'Images': [{
+            'RootDeviceName': '/dev/sda1',
+            'BlockDeviceMappings': [
+                {'DeviceName': '/dev/sda1', 'Ebs': {'SnapshotId': 'snap-0'}}
+            ]
+        }]
+    }
+    ec2.copy_snapshot.return_value = {'SnapshotId': 'snap-1'}
+    ec2.delete_snapshot.side_effect = Exception('RequestLimitExceeded')
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        region='region1',
+        log_callback=logger
+    )
+    uploader.copy_min_delay = 0
+
+    def describe_snapshots(**kwargs):
+        uploader.aborted = True
+        return {'Snapshots': [{'State': 'pending'}]}
+    ec2.describe_snapshots.side_effect = describe_snapshots
+    results = uploader.copy_image_to_regions('ami-0', ['region2'])
+
+    # The copy that could not be deleted is reported
+    error = str(results['region2'][1])
+    assert 'Upload aborted, snapshot copy snap-1 in region2' in error
+    assert 'left behind: RequestLimitExceeded' in error
+    assert ec2.describe_snapshots.call_count == 1
+    ec2.delete_snapshot.assert_called_once_with(SnapshotId='snap-1')
+
+
+class EBSDirectStandIn:
+    """In memory stand-in for the EBS direct APIs"""
+
+    def __init__(self):
+        self.blocks = {}
+        self.completed = None
+        self.lock = threading.Lock()
+
+    def start_snapshot(self, **kwargs):
+        self.volume_size = kwargs['VolumeSize']
+        self.tags = kwargs['Tags']
+        return {'SnapshotId': 'snap-direct'}
+
+    def put_snapshot_block(self, **kwargs):
+        data = kwargs['BlockData']
+        checksum = base64.b64encode(hashlib.sha256(data).digest()).decode()
+        assert checksum == kwargs['Checksum']
+        assert len(data) == kwargs['DataLength']
+        with self.lock:
+            self.blocks[kwargs['BlockIndex']] = data
+        return {'Checksum': checksum}
+
+    def complete_snapshot(self, **kwargs):
+        aggregated = hashlib.sha256()
+        for index in sorted(self.blocks):
+            aggregated.update(hashlib.sha256(self.blocks[index]).digest())
+        assert kwargs['Checksum'] == \
+            base64.b64encode(aggregated.digest()).decode()
+        self.completed = kwargs
+        return {'Status': 'pending'}
+
+
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._check_image_exists')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._wait_for_snapshot')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._connect_ebs')
+def test_create_snapshot_ebs_direct(
+    connect_ebs_mock,
+    wait_for_snapshot_mock,
+    check_image_exists_mock,
+    tmp_path
+):
+    ebs = EBSDirectStandIn()
+    connect_ebs_mock.return_value = ebs
+    image = tmp_path / 'image.raw'
+    image_data = os.urandom(3 * ec2upimg.EBS_BLOCK_SIZE + 100)
+    image.write_bytes(image_data)
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        use_ebs_direct=True,
+        upload_workers=2
+    )
+    snapshot = uploader.create_snapshot(str(image))
+
+    assert snapshot == {'SnapshotId': 'snap-direct'}
+    assert ebs.volume_size == 10
+    assert ebs.tags == [ec2utils.SNAPSHOT_CREATOR_TAG]
+    assert sorted(ebs.blocks) == [0, 1, 2, 3]
+    written = b''.join(ebs.blocks[index] for index in range(4))
+    assert written[:len(image_data)] == image_data
+    assert written[len(image_data):] == \
+        b'\0' * (4 * ec2upimg.EBS_BLOCK_SIZE - len(image_data))
+    assert ebs.completed['ChangedBlocksCount'] == 4
+    wait_for_snapshot_mock.assert_called_once_with(snapshot)
+    check_image_exists_mock.assert_called_once_with()
+
+
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._check_image_exists')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._connect')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._connect_ebs')
+def test_create_snapshot_ebs_direct_failure(
+    connect_ebs_mock,
+    ec2connect_mock,
+    check_image_exists_mock,
+    tmp_path
+):
+    ebs = EBSDirectStandIn()
+    connect_ebs_mock.return_value = ebs
+    ebs.put_snapshot_block = MagicMock(side_effect=ValueError('bad block'))
+    image = tmp_path / 'image.raw'
+    image.write_bytes(b'\1' * 10)
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        use_ebs_direct=True
+    )
+    with pytest.raises(ValueError):
+        uploader.create_snapshot(str(image))
+
+    # The incomplete snapshot is not left behind
+    ec2connect_mock.return_value.delete_snapshot.assert_called_once_with(
+        SnapshotId='snap-direct'
+    )
+    assert ebs.completed is None
+
+
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._get_owned_images')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._connect_ebs')
+def test_create_snapshot_ebs_direct_image_exists(
+    connect_ebs_mock,
+    get_owned_images_mock,
+    tmp_path
+):
+    get_owned_images_mock.return_value = [{'Name': 'default'}]
+    image = tmp_path / 'image.raw'
+    image.write_bytes(b'\1' * 10)
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        use_ebs_direct=True
+    )
+    with pytest.raises(EC2UploadImgException) as e:
+        uploader.create_snapshot(str(image))
+
+    assert 'Image with name "default" already exists' in str(e)
+    connect_ebs_mock.return_value.start_snapshot.assert_not_called()
+
+
+def test_create_snapshot_ebs_direct_compressed(tmp_path):
+    image = tmp_path / 'image.raw.xz'
+    image.write_bytes(b'xz')
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        use_ebs_direct=True
+    )
+    with pytest.raises(EC2UploadImgException) as e:
+        uploader.create_snapshot(str(image))
+    assert 'uncompressed image file with .raw extension' in str(e)
+
+
+class SFTPFileStandIn:
+    """Local file standing in for a remote SFTP file"""
+
+    def __init__(self, path, mode='wb'):
+        self.file = open(path, mode)
+        self.written = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.file.close()
+
+    def set_pipelined(self, pipelined):
+        pass
+
+    def seek(self, offset):
+        self.file.seek(offset)
+
+    def truncate(self, size):
+        self.file.truncate(size)
+
+    def write(self, data):
+        self.written += len(data)
+        self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def stat(self):
+        return os.fstat(self.file.fileno())
+
+    def close(self):
+        self.file.close()
+
+
+def test_upload_sparse_image(tmp_path):
+    source = tmp_path / 'image.raw'
+    block = ec2upimg.utils.SPARSE_BLOCK_SIZE
+    with open(source, 'wb') as image:
+        image.write(b'\1' * 100)
+        image.seek(4 * block)
+        image.write(bytes(block) + b'\2' * block)
+        image.truncate(8 * block)
+    target = tmp_path / 'target.raw'
+    remote = SFTPFileStandIn(target)
+    sftp = MagicMock()
+    sftp.open.return_value = remote
+    ssh_client = MagicMock()
+    ssh_client.open_sftp.return_value = sftp
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger
+    )
+    uploader.ssh_client = ssh_client
+    response = uploader._upload_image('targetDir', str(source))
+
+    assert response == 'image.raw'
+    sftp.open.assert_called_once_with('targetDir/image.raw', 'wb')
+    sftp.put.assert_not_called()
+    # Only the two non zero blocks are transferred
+    assert remote.written == 2 * block
+    assert target.read_bytes() == source.read_bytes()
+
+
+def test_upload_sparse_image_aborted(tmp_path):
+    source = tmp_path / 'image.raw'
+    with open(source, 'wb') as image:
+        image.write(b'\1' * 100)
+        image.truncate(8 * ec2upimg.utils.SPARSE_BLOCK_SIZE)
+    target = tmp_path / 'target.raw'
+    remote = SFTPFileStandIn(target)
+    sftp = MagicMock()
+    sftp.open.return_value = remote
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger
+    )
+    uploader.aborted = True
+    uploader._upload_sparse_image(sftp, str(source), 'targetDir/image.raw')
+
+    # The partial file is not extended to the image size
+    assert remote.written == 0
+    assert target.stat().st_size == 0
+
+
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._clean_up')
+def test_dump_root_fs_failure(clean_up_mock):
+    ssh_client = dd_ssh_client(
+        b'cat: /sys/block/xvdg/queue/max_sectors_kb: No such file',
+        [b'dd: error writing \'/dev/xvdg\': No space left on device\n'],
+        exit_status=1
+    )
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        inst_user_name='root',
+        wait_count=1,
+        log_callback=logger,
+        sparse=False
+    )
+    uploader.ssh_client = ssh_client
+    with pytest.raises(EC2UploadImgException) as e:
+        uploader._dump_root_fs('myImageDir', 'rawImageName', '/dev/xvdg')
+
+    assert 'failed with exit status 1' in str(e.value)
+    assert 'No space left on device' in str(e.value)
+    clean_up_mock.assert_called_once_with()
+    ssh_client.exec_command.assert_called_with(
+        'dd if=myImageDir/rawImageName of=/dev/xvdg bs=4096K '
+        'iflag=fullblock oflag=direct status=progress',
+        get_pty=True
+    )
+
+
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._check_image_exists')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._wait_for_snapshot')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._connect_ebs')
+def test_create_snapshot_ebs_direct_skips_zero_blocks(
+    connect_ebs_mock,
+    wait_for_snapshot_mock,
+    check_image_exists_mock,
+    tmp_path
+):
+    ebs = EBSDirectStandIn()
+    connect_ebs_mock.return_value = ebs
+    image = tmp_path / 'image.raw'
+    with open(image, 'wb') as image_file:
+        image_file.write(b'\1' * 10)
+        image_file.seek(2 * ec2upimg.EBS_BLOCK_SIZE)
+        image_file.write(b'\2' * 10)
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        use_ebs_direct=True
+    )
+    uploader.create_snapshot(str(image))
+
+    assert sorted(ebs.blocks) == [0, 2]
+    assert ebs.completed['ChangedBlocksCount'] == 2
+
+
+def test_get_stream_command(tmp_path):
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        inst_user_name='ec2-user',
+        wait_count=1,
+        log_callback=logger
+    )
+    # 128 KiB largest requests give 2 MiB blocks
+    uploader.ssh_client = dd_ssh_client(b'128', [])
+    options = 'bs=2048K iflag=fullblock oflag=direct'
+    assert uploader._get_stream_command('/tmp/image.raw', '/dev/xvdg') == \
+        'sudo dd of=/dev/xvdg %s conv=sparse' % options
+    assert uploader._get_stream_command('/tmp/image.raw.zst', '/dev/xvdg') \
+        == '$(command -v pzstd || echo zstd) -dc | ' \
+        'sudo dd of=/dev/xvdg %s conv=sparse' % options
+
+    raw_image = tmp_path / 'disk.raw.xz'
+    raw_image.write_bytes(b'xz')
+    readme = tmp_path / 'README'
+    readme.write_bytes(b'readme')
+    archive = tmp_path / 'image.tar.gz'
+    with tarfile.open(archive, 'w:gz') as tar:
+        tar.add(readme, 'README')
+        tar.add(raw_image, 'disk.raw.xz')
+    uploader.inst_user_name = 'root'
+    uploader.sparse = False
+    uploader.dd_block_size = '8M'
+    assert uploader._get_stream_command(str(archive), '/dev/xvdg') == \
+        'tar -xzO -f - disk.raw.xz | xz -dc -T0 | ' \
+        'dd of=/dev/xvdg bs=8M iflag=fullblock oflag=direct'
+
+    with pytest.raises(EC2UploadImgException) as e:
+        uploader._get_stream_command('/tmp/image.qcow2', '/dev/xvdg')
+    assert 'Unable to stream image file' in str(e)
+
+
+def test_stream_image(tmp_path):
+    source = tmp_path / 'image.raw'
+    source.write_bytes(b'\1' * (ec2upimg.STREAM_CHUNK_SIZE + 10))
+    channel = MagicMock()
+    channel.recv_exit_status.return_value = 0
+    ssh_client = MagicMock()
+    ssh_client.get_transport().open_session.return_value = channel
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        inst_user_name='root',
+        wait_count=1,
+        log_callback=logger,
+        dd_block_size='4M'
+    )
+    uploader.ssh_client = ssh_client
+    uploader._stream_image(str(source), '/dev/xvdg')
+
+    channel.exec_command.assert_called_once_with(
+        'dd of=/dev/xvdg bs=4M iflag=fullblock oflag=direct conv=sparse'
+    )
+    sent = b''.join(args[0] for args, kwargs in channel.sendall.call_args_list)
+    assert sent == source.read_bytes()
+    channel.shutdown_write.assert_called_once_with()
+    channel.close.assert_called_once_with()
+
+
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._clean_up')
+def test_stream_image_remote_failure(clean_up_mock, tmp_path):
+    source = tmp_path / 'image.raw.xz'
+    source.write_bytes(b'xz')
+    channel = MagicMock()
+    channel.recv_exit_status.return_value = 1
+    channel.recv_stderr_ready.side_effect = [True, False]
+    channel.recv_stderr.return_value = \
+        b'xz: (stdin): File format not recognized'
+    ssh_client = MagicMock()
+    ssh_client.get_transport().open_session.return_value = channel
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        inst_user_name='root',
+        wait_count=1,
+        log_callback=logger,
+        dd_block_size='4M'
+    )
+    uploader.ssh_client = ssh_client
+    with pytest.raises(EC2UploadImgException) as e:
+        uploader._stream_image(str(source), '/dev/xvdg')
+    assert 'failed with exit status 1' in str(e)
+    assert 'File format not recognized' in str(e)
+    clean_up_mock.assert_called_once_with()
+
+
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._stream_image')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._create_storage_volume')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._detach_volume')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._end_ssh_session')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._find_device_name')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._attach_volume')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._create_target_root_volume')
+@patch(
+    'ec2imgutils.ec2uploadimg.EC2ImageUploader._establish_ssh_connection'
+)
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._launch_helper_instance')
+@patch('ec2imgutils.ec2uploadimg.EC2ImageUploader._check_image_exists')
+def test_create_image_root_volume_streamed(
+    check_image_exists_mock,
+    launch_helper_instance_mock,
+    establish_ssh_connection_mock,
+    create_target_root_volume_mock,
+    attach_volume_mock,
+    find_device_name_mock,
+    end_ssh_session_mock,
+    detach_volume_mock,
+    create_storage_volume_mock,
+    stream_image_mock
+):
+    create_target_root_volume_mock.return_value = 'targetRootVol'
+    find_device_name_mock.return_value = '/dev/xvdg'
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        stream=True
+    )
+    result = uploader._create_image_root_volume('image.raw.xz')
+
+    assert result == 'targetRootVol'
+    stream_image_mock.assert_called_once_with('image.raw.xz', '/dev/xvdg')
+    attach_volume_mock.assert_called_once_with('targetRootVol')
+    detach_volume_mock.assert_called_once_with('targetRootVol')
+    create_storage_volume_mock.assert_not_called()
+
+
+def chunked_upload_stand_in(target, refused_connections=0):
+    """Return an _open_ssh_client replacement whose SFTP channels write to
+       the local target file, the first refused_connections fail"""
+    connections = []
+
+    def open_ssh_client():
+        connections.append(1)
+        if len(connections) <= refused_connections:
+            raise ec2upimg.paramiko.SSHException('Too many sessions')
+        ssh_client = MagicMock()
+        ssh_client.open_sftp().open.side_effect = \
+            lambda path, mode: SFTPFileStandIn(target, mode)
+        return ssh_client
+    return open_ssh_client
+
+
+def local_checksum(target):
+    def get_remote_checksum(ssh_client, path, offset, length):
+        with open(target, 'rb') as remote:
+            remote.seek(offset)
+            return hashlib.sha256(remote.read(length)).hexdigest()
+    return get_remote_checksum
+
+
+def test_upload_image_chunked(tmp_path):
+    source = tmp_path / 'image.raw.xz'
+    source.write_bytes(os.urandom(1000000))
+    target = tmp_path / 'target'
+    sftp = MagicMock()
+    sftp.open.side_effect = lambda path, mode: SFTPFileStandIn(target, mode)
+    ssh_client = MagicMock()
+    ssh_client.open_sftp.return_value = sftp
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        upload_channels=4
+    )
+    uploader.ssh_client = ssh_client
+    checksums = []
+    get_remote_checksum = local_checksum(target)
+
+    def remote_checksum(ssh_client, path, offset, length):
+        checksums.append((offset, length))
+        if len(checksums) == 1:
+            # A corrupted range is uploaded again
+            return 'corrupted'
+        return get_remote_checksum(ssh_client, path, offset, length)
+
+    with patch.object(ec2upimg, 'UPLOAD_MIN_CHUNK_SIZE', 100000), \
+            patch.object(uploader, '_get_remote_checksum', remote_checksum), \
+            patch.object(
+                uploader,
+                '_open_ssh_client',
+                chunked_upload_stand_in(target, refused_connections=2)
+            ):
+        response = uploader._upload_image('targetDir', str(source))
+
+    assert response == 'image.raw.xz'
+    assert target.read_bytes() == source.read_bytes()
+    # 10 chunks and one retry
+    assert len(checksums) == 11
+    assert checksums.count(checksums[0]) == 2
+    sftp.put.assert_not_called()
+
+
+def test_upload_image_chunked_sparse(tmp_path):
+    source = tmp_path / 'image.raw'
+    with open(source, 'wb') as image:
+        image.write(b'\1' * 100)
+        image.seek(1000000)
+        image.write(b'\2' * 100)
+        image.truncate(2000000)
+    target = tmp_path / 'target.raw'
+    sftp = MagicMock()
+    sftp.open.side_effect = lambda path, mode: SFTPFileStandIn(target, mode)
+    ssh_client = MagicMock()
+    ssh_client.open_sftp.return_value = sftp
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        upload_channels=2
+    )
+    uploader.ssh_client = ssh_client
+    with patch.object(
+                uploader, '_get_remote_checksum', local_checksum(target)
+            ), \
+            patch.object(
+                uploader, '_open_ssh_client', chunked_upload_stand_in(target)
+            ):
+        uploader._upload_image('targetDir', str(source))
+
+    assert target.read_bytes() == source.read_bytes()
+
+
+def test_upload_image_chunked_no_channel(tmp_path):
+    source = tmp_path / 'image.raw.xz'
+    source.write_bytes(b'xz')
+    target = tmp_path / 'target'
+    sftp = MagicMock()
+    sftp.open.side_effect = lambda path, mode: SFTPFileStandIn(target, mode)
+    ssh_client = MagicMock()
+    ssh_client.open_sftp.return_value = sftp
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        upload_channels=2,
+        upload_resume_attempts=0
+    )
+    uploader.ssh_client = ssh_client
+    with patch.object(
+                uploader,
+                '_open_ssh_client',
+                chunked_upload_stand_in(target, refused_connections=2)
+            ), \
+            patch.object(uploader, '_clean_up'):
+        with pytest.raises(EC2UploadImgException) as e:
+            uploader._upload_image('targetDir', str(source))
+    assert 'no upload channel left' in str(e)
+
+
+def test_upload_image_chunked_ramp(tmp_path, caplog):
+    source = tmp_path / 'image.raw.xz'
+    source.write_bytes(os.urandom(1000))
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        upload_channels=8
+    )
+    sent_callbacks = []
+
+    def upload_chunks(source, target, chunks, progress, sent):
+        sent_callbacks.append(sent)
+        while not chunks.empty():
+            chunks.get_nowait()
+
+    # Bytes written per interval with 1, 2, 3 and 4 connections
+    throughput = [100, 200, 250, 260]
+
+    def ramp_wait(running, timeout, return_when):
+        assert timeout == ec2upimg.UPLOAD_RAMP_INTERVAL
+        sent_callbacks[0](throughput[len(running) - 1])
+        return set(), running
+
+    with patch.object(ec2upimg, 'UPLOAD_MIN_CHUNK_SIZE', 100), \
+            patch.object(ec2upimg, 'wait', ramp_wait), \
+            patch.object(uploader, '_upload_chunks', upload_chunks):
+        with caplog.at_level(logging.DEBUG, logger='ec2imgutils'):
+            uploader._upload_image_chunked(
+                MagicMock(), str(source), 'target', [(0, 1000)]
+            )
+
+    # The fourth connection raised the throughput by less than 10%
+    assert len(sent_callbacks) == 4
+    assert 'Throughput saturated at 4 upload channels' in caplog.text
+
+
+def test_upload_chunks_channel_failure():
+    ssh_client = MagicMock()
+    ssh_client.open_sftp.side_effect = ec2upimg.paramiko.SSHException(
+        'Administratively prohibited'
+    )
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger
+    )
+    chunks = ec2upimg.queue.Queue()
+    chunks.put((0, 1000, 0))
+    with patch.object(uploader, '_open_ssh_client', return_value=ssh_client):
+        uploader._upload_chunks(
+            'image.raw', 'target', chunks, MagicMock(), MagicMock()
+        )
+
+    ssh_client.close.assert_called_once_with()
+    assert chunks.qsize() == 1
+
+
+def test_get_remote_checksum():
+    ssh_client = MagicMock()
+    stdout = MagicMock()
+    stdout.read.return_value = b'abc123  -\n'
+    stdout.channel.recv_exit_status.return_value = 0
+    ssh_client.exec_command.return_value = (MagicMock(), stdout, MagicMock())
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger
+    )
+    checksum = uploader._get_remote_checksum(ssh_client, '/mnt/img', 10, 20)
+
+    assert checksum == 'abc123'
+    ssh_client.exec_command.assert_called_once_with(
+        'dd if=/mnt/img bs=1M skip=10 count=20 '
+        'iflag=skip_bytes,count_bytes status=none | sha256sum'
+    )
+
+
+def resumed_ssh_client(target):
+    """SSH client of the new connection after an interruption whose SFTP
+       session works on the local target file"""
+    ssh_client = MagicMock()
+    sftp = ssh_client.open_sftp.return_value
+    sftp.stat.side_effect = lambda path: os.stat(target)
+    sftp.truncate.side_effect = lambda path, size: os.truncate(target, size)
+    sftp.open.side_effect = lambda path, mode: SFTPFileStandIn(target, mode)
+    return ssh_client
+
+
+@patch.object(ec2upimg, 'UPLOAD_MIN_CHUNK_SIZE', 1000)
+def test_upload_image_resume(tmp_path, caplog):
+    source = tmp_path / 'image.raw.xz'
+    source.write_bytes(os.urandom(5000))
+    target = tmp_path / 'target'
+
+    def interrupted_put(path, remote_path, progress):
+        # The first range arrived, the second one is corrupt and the
+        # third one partial
+        data = source.read_bytes()
+        target.write_bytes(data[:1000] + bytes(1000) + data[2000:2500])
+        raise ConnectionResetError('Connection reset by peer')
+
+    ssh_client = MagicMock()
+    ssh_client.open_sftp().put.side_effect = interrupted_put
+    new_ssh_client = resumed_ssh_client(target)
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger
+    )
+    uploader.ssh_client = ssh_client
+
+    def establish_ssh_connection():
+        uploader.ssh_client = new_ssh_client
+
+    with patch.object(
+                uploader, '_get_remote_checksum', local_checksum(target)
+            ), \
+            patch.object(
+                uploader, '_open_ssh_client', chunked_upload_stand_in(target)
+            ), \
+            patch.object(
+                uploader,
+                '_establish_ssh_connection',
+                side_effect=establish_ssh_connection
+            ), \
+            patch.object(uploader, '_clean_up') as clean_up_mock:
+        with caplog.at_level(logging.INFO):
+            response = uploader._upload_image('targetDir', str(source))
+
+    assert response == 'image.raw.xz'
+    assert target.read_bytes() == source.read_bytes()
+    # The first range and the arrived part of the third one are kept
+    assert 'Resuming upload of %s, 3500 of 5000 bytes left' % source in \
+        caplog.text
+    assert uploader.acknowledged_chunks == {
+        (0, 1000), (2000, 500),
+        (1000, 1000), (2500, 1000), (3500, 1000), (4500, 500)
+    }
+    ssh_client.close.assert_called_once_with()
+    clean_up_mock.assert_not_called()
+
+
+@patch.object(ec2upimg, 'UPLOAD_MIN_CHUNK_SIZE', 1000)
+def test_resume_upload_acknowledged_chunks(tmp_path, caplog):
+    source = tmp_path / 'image.raw.xz'
+    source.write_bytes(os.urandom(3000))
+    target = tmp_path / 'target'
+    target.write_bytes(source.read_bytes()[:1000] + bytes(2000))
+
+    uploader = ec2upimg.EC2ImageUploader(
+        access_key='',
+        wait_count=1,
+        log_callback=logger,
+        upload_channels=2
+    )
+    uploader.ssh_client = resumed_ssh_client(target)
+    uploader.acknowledged_chunks = {(0, 1000)}
+    remote_checksum = MagicMock(side_effect=local_checksum(target))
+    with patch.object(uploader, '_get_remote_checksum', remote_checksum), \
+            patch.object(
+                uploader, '_open_ssh_client', chunked_upload_stand_in(target)
+            ):
+        with caplog.at_level(logging.INFO):
+            uploader._resume_upload(str(source), 'targetDir/image.raw.xz')
+
+    assert target.read_bytes() == source.read_bytes()
+    assert '2000 of 3000 bytes left' in caplog.text
+    # Only the uploaded chunks are verified, the acknowledged one is kept
+    assert sorted(
+        args[2] for args, kwargs in remote_checksum.call_args_list
+    ) == [1000, 2000]